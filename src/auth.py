@@ -1,6 +1,9 @@
 import re
 from data import data
+import session
+import store
 from error import InputError, AccessError
+from records import User
 import hashlib
 import jwt
 
@@ -12,24 +15,17 @@ def auth_login(email, password):
     generates a token unique to the user"""
     validate_email(email)
     password = hashlib.sha256(password.encode()).hexdigest()
-    for user in data["users"]:
-        if user["email"] == email and user["password"] == password:
-            token = jwt.encode(
-                {"u_id": user["u_id"]}, SECRET, algorithm="HS256"
-            ).decode("utf-8")
-            data["sessions"].append({"token": token})
-            return {"u_id": user["u_id"], "token": token}
-        else:
-            raise InputError("Email/Pass combination incorrect")
+    user = store.get_user_by_email(email)
+    if user is None or user.password != password:
+        raise InputError("Email/Pass combination incorrect")
+    token = jwt.encode({"u_id": user.u_id}, SECRET, algorithm="HS256").decode("utf-8")
+    session.session_add(token, user.u_id)
+    return {"u_id": user.u_id, "token": token}
 
 
 def auth_logout(token):
     """"Remove user with token from active sessions, logging them out"""
-    init_len = len(data["sessions"])
-    data["sessions"] = [
-        active for active in data["sessions"] if not (active["token"] == token)
-    ]
-    if len(data["sessions"]) == init_len:
+    if not session.session_remove(token):
         return {"is_success": False}
     return {"is_success": True}
 
@@ -48,28 +44,26 @@ def auth_register(email, password, name_first, name_last):
 
     # email must be valid & not in use
     validate_email(email)
-    for user in data["users"]:
-        if user["email"] == email:
-            raise InputError("Email is invalid")
+    if store.get_user_by_email(email) is not None:
+        raise InputError("Email is invalid")
     if len(password) < 6:
         raise InputError("Password is invalid")
 
     permission_id = 1 if not data["users"] else 2
-    data["users"].append(
-        {
-            "u_id": data["id"],
-            "email": email,
-            "password": hashlib.sha256(password.encode()).hexdigest(),
-            "name_first": name_first,
-            "name_last": name_last,
-            "handle_str": generate_handle(name_first),
-            "permission_id": permission_id,
-        }
+    u_id = store.next_id()
+    store.add_user(
+        User(
+            u_id=u_id,
+            email=email,
+            password=hashlib.sha256(password.encode()).hexdigest(),
+            name_first=name_first,
+            name_last=name_last,
+            handle_str=generate_handle(name_first),
+            permission_id=permission_id,
+        )
     )
-    u_id = data["id"]
     token = jwt.encode({"u_id": u_id}, SECRET, algorithm="HS256").decode("utf-8")
-    data["sessions"].append({"token": token})
-    data["id"] += 1
+    session.session_add(token, u_id)
     return {"u_id": u_id, "token": token}
 
 
@@ -77,20 +71,19 @@ def generate_handle(name):
     """Generate a unique handle given a user's first name"""
     name = name[:20]
     name = name.lower()
-    i = 0
-    while handle_exists(name):
-        name = name[: (20 - len(str(i)))]
-        name += str(i)
+    if not handle_exists(name):
+        return name
+    # resume from the first suffix not already handed out for this name
+    i = store.handle_suffixes.get(name, 0)
+    while handle_exists(name[: (20 - len(str(i)))] + str(i)):
         i += 1
-    return name
+    store.handle_suffixes[name] = i + 1
+    return name[: (20 - len(str(i)))] + str(i)
 
 
 def handle_exists(name):
     """Check if the name given exists as a user string"""
-    for user in data["users"]:
-        if user["handle_str"] == name:
-            return True
-    return False
+    return store.get_user_by_handle(name) is not None
 
 
 def validate_email(email):
@@ -102,6 +95,15 @@ def validate_email(email):
 
 def auth_token(token):
     """Check if token corresponds to valid user"""
-    if token in [session["token"] for session in data["sessions"]]:
-        return jwt.decode(token.encode("utf-8"), SECRET, algorithms=["HS256"])["u_id"]
-    raise AccessError("Invalid token.")
+    if session.session_touch(token) is None:
+        raise AccessError("Invalid token.")
+    u_id = session.verified_tokens.get(token)
+    if u_id is None:
+        u_id = jwt.decode(token.encode("utf-8"), SECRET, algorithms=["HS256"])["u_id"]
+        session.verified_tokens.put(token, u_id)
+    return u_id
+
+
+def token_cache_stats():
+    """Return hit/miss counters for the verified token cache."""
+    return session.verified_tokens.stats()
@@ -2,6 +2,7 @@ import pytest
 from auth import auth_register, auth_login, auth_logout
 from error import InputError
 from other import clear
+import store
 
 
 @pytest.fixture
@@ -82,3 +83,37 @@ def test_auth_logout(reset, supply_user):
 def test_auth_logout_wrong_token(reset, supply_user):
     # incorrect token
     assert auth_logout("10") == {"is_success": False}
+
+
+def test_auth_login_second_user(reset, supply_user):
+    # login finds the right user regardless of registration order
+    user = auth_register("person2@mail.com", "password", "Person", "Two")
+    auth_logout(user["token"])
+    assert auth_login("person2@mail.com", "password") == user
+
+
+def test_auth_register_handle_suffix(reset):
+    # handles taken by earlier users get a numeric suffix
+    auth_register("person1@mail.com", "password", "Person", "One")
+    auth_register("person2@mail.com", "password", "Person", "Two")
+    auth_register("person3@mail.com", "password", "Person", "Three")
+    handles = [user["handle_str"] for user in store.user_list()]
+    assert handles == ["person", "person0", "person1"]
+
+
+def test_auth_register_handle_suffix_does_not_accumulate(reset):
+    # the third "john" gets "john1"; earlier versions appended each suffix
+    # to the last one tried and handed out "john01"
+    for i in range(4):
+        auth_register(f"john{i}@mail.com", "password", "John", "Smith")
+    auth_register("long@mail.com", "password", "Abcdefghijklmnopqrst", "Long")
+    auth_register("long2@mail.com", "password", "Abcdefghijklmnopqrst", "Long")
+    handles = [user["handle_str"] for user in store.user_list()]
+    assert handles == [
+        "john",
+        "john0",
+        "john1",
+        "john2",
+        "abcdefghijklmnopqrst",
+        "abcdefghijklmnopqrs0",
+    ]
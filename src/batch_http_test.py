@@ -0,0 +1,93 @@
+import pytest
+import re
+from subprocess import Popen, PIPE
+import signal
+from time import sleep
+import requests
+
+
+# Use this fixture to get the URL of the server. It starts the server for you,
+# so you don't need to.
+@pytest.fixture
+def url():
+    url_re = re.compile(r" \* Running on ([^ ]*)")
+    server = Popen(["python3", "src/server.py"], stderr=PIPE, stdout=PIPE)
+    line = server.stderr.readline()
+    local_url = url_re.match(line.decode())
+    if local_url:
+        yield local_url.group(1)
+        # Terminate the server
+        server.send_signal(signal.SIGINT)
+        waited = 0
+        while server.poll() is None and waited < 5:
+            sleep(0.1)
+            waited += 0.1
+        if server.poll() is None:
+            server.kill()
+    else:
+        server.kill()
+        raise Exception("Couldn't get URL from local server")
+
+
+@pytest.fixture
+def supply_user(url):
+    return requests.post(
+        f"{url}/auth/register",
+        json={
+            "email": "person1@mail.com",
+            "password": "password",
+            "name_first": "firstname",
+            "name_last": "lastname",
+        },
+    ).json()
+
+
+def test_batch_http(url, supply_user):
+    channel_id = requests.post(
+        f"{url}/channels/create",
+        json={"token": supply_user["token"], "name": "channel", "is_public": True},
+    ).json()["channel_id"]
+    resp = requests.post(
+        f"{url}/batch",
+        json={
+            "token": supply_user["token"],
+            "requests": [
+                {
+                    "method": "POST",
+                    "path": "/message/send",
+                    "params": {"channel_id": channel_id, "message": "hello"},
+                },
+                {"path": "/channels/list"},
+                {
+                    "path": "/channel/messages",
+                    "params": {"channel_id": channel_id, "start": 0},
+                },
+                {"path": "/user/profile", "params": {"u_id": supply_user["u_id"]}},
+                {"path": "/channel/details", "params": {"channel_id": -1}},
+                {"path": "/no/such/route"},
+            ],
+        },
+    )
+    assert resp.status_code == 200
+    responses = resp.json()["responses"]
+    assert [response["status"] for response in responses] == [
+        200,
+        200,
+        200,
+        200,
+        400,
+        404,
+    ]
+    message_id = responses[0]["body"]["message_id"]
+    assert responses[1]["body"]["channels"][0]["channel_id"] == channel_id
+    assert responses[2]["body"]["messages"][0]["message_id"] == message_id
+    assert responses[3]["body"]["u_id"] == supply_user["u_id"]
+    assert responses[4]["body"]["code"] == 400
+
+
+def test_batch_http_invalid_token(url):
+    resp = requests.post(
+        f"{url}/batch",
+        json={"token": "not a token", "requests": [{"path": "/channels/list"}]},
+    )
+    assert resp.status_code == 400
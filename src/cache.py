@@ -0,0 +1,64 @@
+"""
+A bounded least-recently-used cache with hit and miss counters.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Map keys to values, evicting the least recently used once full."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for key, or default on a miss."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        """Cache value under key, evicting the oldest entry if full."""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        """Evict key from the cache if it is there."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Evict every entry and reset the counters."""
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the cache's size and hit/miss counters."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
@@ -1,5 +1,7 @@
 from auth import auth_token
-from data import data
+import store
+import events
+import session
 from error import InputError, AccessError
 from user import validate_user_id, find_user
 
@@ -10,19 +12,12 @@ def channel_invite(token, channel_id, u_id):
     validate_channel_id(channel_id)
     validate_user_id(u_id)
 
-    channel = find_channel(channel_id)
-    if token_id not in [
-        member["u_id"] for member in channel["owner_members"]
-    ] and token_id not in [member["u_id"] for member in channel["all_members"]]:
+    if not store.is_member(channel_id, token_id):
         raise AccessError("The authorised user is not a member of the channel.")
 
     user = find_user(u_id)
-    user_details = {
-        "u_id": user["u_id"],
-        "name_first": user["name_first"],
-        "name_last": user["name_last"],
-    }
-    channel["all_members"].append(user_details)
+    user_details = user.member_details()
+    store.add_member(channel_id, user_details)
     return {}
 
 
@@ -31,65 +26,134 @@ def channel_details(token, channel_id):
     u_id = auth_token(token)
     validate_channel_id(channel_id)
 
-    channel = find_channel(channel_id)
-    if u_id not in [
-        member["u_id"] for member in channel["owner_members"]
-    ] and u_id not in [member["u_id"] for member in channel["all_members"]]:
+    if not store.is_member(channel_id, u_id):
         raise AccessError("The authorised user is not a member of the channel.")
 
+    channel = find_channel(channel_id)
     channel_details = {
-        "name": channel["name"],
-        "owner_members": channel["owner_members"],
-        "all_members": channel["all_members"],
+        "name": channel.name,
+        "owner_members": channel.owner_members,
+        "all_members": channel.all_members,
     }
     return channel_details
 
 
 def channel_messages(token, channel_id, start):
-    """Return up to 50 messages from a channel."""
+    """
+    Return up to 50 messages from a channel, and the seq of the channel's
+    latest change as of the page, to follow with channel_messages_since.
+    """
     u_id = auth_token(token)
     validate_channel_id(channel_id)
 
-    messages = [
-        message for message in data["messages"] if message["channel_id"] == channel_id
-    ]
-    num_messages = len(messages)
+    num_messages = store.channel_message_count(channel_id)
     if start > num_messages:
         raise InputError(
             "start is greater than the total number of messages in the channel."
         )
 
-    channel = find_channel(channel_id)
-    if u_id not in [
-        member["u_id"] for member in channel["owner_members"]
-    ] and u_id not in [member["u_id"] for member in channel["all_members"]]:
+    if not store.is_member(channel_id, u_id):
         raise AccessError("The authorised user is not a member of the channel.")
 
-    messages = messages[::-1][start:][:50]
+    # no change lands between reading the page and the seq it is as of
+    with store.message_lock:
+        messages = store.channel_message_page(channel_id, start, 50)
+        seq = events.last_seq(channel_id)
     end = start + 50 if num_messages - start >= 50 else -1
     return {
         "messages": messages,
         "start": start,
         "end": end,
+        "seq": seq,
+    }
+
+
+def channel_messages_range(token, channel_id, time_start, time_end, start):
+    """
+    Return up to 50 messages from a channel sent between time_start and
+    time_end inclusive, oldest first, skipping the start oldest.
+    """
+    u_id = auth_token(token)
+    validate_channel_id(channel_id)
+
+    if time_start > time_end:
+        raise InputError("time_start is after time_end.")
+    if start < 0:
+        raise InputError("start is negative.")
+
+    if not store.is_member(channel_id, u_id):
+        raise AccessError("The authorised user is not a member of the channel.")
+
+    messages, num_messages = store.channel_message_range(
+        channel_id, time_start, time_end, start, 50
+    )
+    if start > num_messages:
+        raise InputError(
+            "start is greater than the number of messages sent in the time range."
+        )
+
+    end = start + 50 if num_messages - start > 50 else -1
+    return {
+        "messages": messages,
+        "start": start,
+        "end": end,
+    }
+
+
+def channel_messages_since(token, channel_id, seq):
+    """
+    Return the changes made to a channel's messages after seq, oldest first,
+    and the seq of the latest. reset is True if they are no longer all held,
+    and the client should fetch the channel's messages again instead, going
+    on from the seq channel_messages returns with them.
+
+    A sent message is given as it is now, which later changes in the list
+    apply to again harmlessly, and is left out if it has since been removed.
+    """
+    u_id = auth_token(token)
+    validate_channel_id(channel_id)
+
+    if not store.is_member(channel_id, u_id):
+        raise AccessError("The authorised user is not a member of the channel.")
+
+    log = events.change_log(channel_id)
+    # no change lands between reading the log and the messages it names
+    with store.message_lock, events.lock:
+        changes = log.since(seq)
+        latest = log.last_seq()
+        if changes is not None:
+            changes = [
+                change for change in map(sent_message, changes) if change is not None
+            ]
+    return {
+        "events": changes if changes is not None else [],
+        "seq": latest,
+        "reset": changes is None,
     }
 
 
+def sent_message(change):
+    """
+    Return a logged change with the body of the message it sent, if any, or
+    None if that message has been removed.
+    """
+    if change["event"] != "message_sent":
+        return change
+    message = store.get_message(change["message_id"])
+    if message is None:
+        return None
+    return dict(change, message=message.to_dict())
+
+
 def channel_leave(token, channel_id):
     """Remove a user from a channel."""
     u_id = auth_token(token)
     validate_channel_id(channel_id)
 
-    channel = find_channel(channel_id)
-    if u_id in [member["u_id"] for member in channel["owner_members"]]:
-        member = next(
-            member for member in channel["owner_members"] if member["u_id"] == u_id
-        )
-        channel["owner_members"].remove(member)
-    elif u_id in [member["u_id"] for member in channel["all_members"]]:
-        member = next(
-            member for member in channel["all_members"] if member["u_id"] == u_id
-        )
-        channel["all_members"].remove(member)
+    if store.is_owner(channel_id, u_id):
+        store.remove_owner(channel_id, u_id)
+    elif store.is_member(channel_id, u_id):
+        store.remove_member(channel_id, u_id)
     else:
         raise AccessError("The authorised user is not a member of the channel.")
 
@@ -103,15 +167,11 @@ def channel_join(token, channel_id):
 
     user = find_user(u_id)
     channel = find_channel(channel_id)
-    if not channel["is_public"] and user["permission_id"] != 1:
+    if not channel.is_public and user.permission_id != 1:
         raise AccessError("Channel ID is private. User cannot join.")
 
-    member = {
-        "u_id": user["u_id"],
-        "name_first": user["name_first"],
-        "name_last": user["name_last"],
-    }
-    channel["all_members"].append(member)
+    member = user.member_details()
+    store.add_member(channel_id, member)
 
     return {}
 
@@ -122,20 +182,14 @@ def channel_addowner(token, channel_id, u_id):
     validate_channel_id(channel_id)
 
     user = find_user(token_id)
-    channel = find_channel(channel_id)
-    owner_id_list = [owner["u_id"] for owner in channel["owner_members"]]
-    if u_id in owner_id_list:
+    if store.is_owner(channel_id, u_id):
         raise InputError("User to be added is already an owner of the channel.")
-    elif token_id not in owner_id_list and user["permission_id"] != 1:
+    elif not store.is_owner(channel_id, token_id) and user.permission_id != 1:
         raise AccessError("Authorised user is not an owner of the channel.")
 
     new_owner = find_user(u_id)
-    member = {
-        "u_id": new_owner["u_id"],
-        "name_first": new_owner["name_first"],
-        "name_last": new_owner["name_last"],
-    }
-    channel["owner_members"].append(member)
+    member = new_owner.member_details()
+    store.add_owner(channel_id, member)
 
     return {}
 
@@ -146,33 +200,54 @@ def channel_removeowner(token, channel_id, u_id):
     validate_channel_id(channel_id)
 
     user = find_user(token_id)
-    channel = find_channel(channel_id)
-    owner_id_list = [owner["u_id"] for owner in channel["owner_members"]]
-    if u_id not in owner_id_list:
+    if not store.is_owner(channel_id, u_id):
         raise InputError("User to be removed is not an owner of the channel.")
-    elif token_id not in owner_id_list and user["permission_id"] != 1:
+    elif not store.is_owner(channel_id, token_id) and user.permission_id != 1:
         raise AccessError("Authorised user is not an owner of the channel.")
 
-    user = find_user(u_id)
-    member = {
-        "u_id": user["u_id"],
-        "name_first": user["name_first"],
-        "name_last": user["name_last"],
-    }
-    channel["owner_members"].remove(member)
+    store.remove_owner(channel_id, u_id)
 
     return {}
 
 
+def channel_subscribe(token, channel_id):
+    """
+    Subscribe to the changes made to a channel's messages. Returns an iterator
+    of events, yielding None whenever none arrives for a heartbeat interval.
+    """
+    u_id = auth_token(token)
+    validate_channel_id(channel_id)
+
+    if not store.is_member(channel_id, u_id):
+        raise AccessError("The authorised user is not a member of the channel.")
+
+    subscription = events.Subscription()
+    events.subscribe(channel_id, subscription)
+    return stream_events(token, channel_id, u_id, subscription)
+
+
+def stream_events(token, channel_id, u_id, subscription, timeout=events.HEARTBEAT):
+    """
+    Yield a subscription's events until the user logs out, their session
+    expires, they leave the channel or they fall behind.
+    """
+    try:
+        while (
+            not subscription.overflowed
+            and session.session_touch(token) == u_id
+            and store.is_member(channel_id, u_id)
+        ):
+            yield subscription.get(timeout)
+    finally:
+        events.unsubscribe(channel_id, subscription)
+
+
 def validate_channel_id(channel_id):
     """Raise InputError if given an invalid channel id."""
-    channel_id_list = [channel["channel_id"] for channel in data["channels"]]
-    if channel_id not in channel_id_list:
+    if store.get_channel(channel_id) is None:
         raise InputError("Channel ID does not exist.")
 
 
 def find_channel(channel_id):
     """Find channel given channel_id."""
-    return next(
-        channel for channel in data["channels"] if channel["channel_id"] == channel_id
-    )
+    return store.get_channel(channel_id)
@@ -131,7 +131,9 @@ def test_channel_messages_http(url, supply_user1, supply_channel):
     )
 
     assert messages.status_code == 200
-    assert messages.json() == {
+    page = messages.json()
+    assert isinstance(page.pop("seq"), int)
+    assert page == {
         "messages": [],
         "start": 0,
         "end": -1,
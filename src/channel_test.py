@@ -2,10 +2,11 @@ import pytest
 from channel import *
 from error import InputError, AccessError
 from data import data
-from auth import auth_register
+from auth import auth_register, auth_logout
 from channels import channels_create
 from other import clear
 from message import *
+import store
 
 
 @pytest.fixture
@@ -107,7 +108,7 @@ def test_channel_details(supply_user1, supply_user2, supply_channel):
 def test_channel_messages(supply_user1, supply_user2, supply_channel, supply_message):
 
     messages = channel_messages(supply_user1["token"], supply_message["channel_id"], 0)
-    assert len(messages) == 3
+    assert len(messages) == 4
 
 
 def test_channel_messages_inputerror1_with_invalid_channel_id(
@@ -227,3 +228,154 @@ def test_removeowner_not_owner(supply_owner, supply_user):
 
 # ==================================================================
 # End of Tests for function channel_removeowner
+
+
+def test_channel_messages_pagination(supply_user1, supply_user2, supply_channel):
+    channel_id = supply_channel["channel_id"]
+    for i in range(75):
+        message_send(supply_user1["token"], channel_id, str(i))
+    result = channel_messages(supply_user1["token"], channel_id, 0)
+    assert result["end"] == 50
+    assert [message["message"] for message in result["messages"]] == [
+        str(i) for i in range(74, 24, -1)
+    ]
+    result = channel_messages(supply_user1["token"], channel_id, 50)
+    assert result["end"] == -1
+    assert len(result["messages"]) == 25
+    assert result["messages"][-1]["message"] == "0"
+
+
+def test_channel_subscribe_streams_changes(supply_user1, supply_user2, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    stream = channel_subscribe(token, channel_id)
+    message_id = message_send(token, channel_id, "hello")["message_id"]
+    message_edit(token, message_id, "hello world")
+    message_react(token, message_id, 1)
+    message_pin(token, message_id)
+    message_remove(token, message_id)
+    sent = next(stream)
+    assert sent["event"] == "message_sent"
+    assert sent["message"]["message"] == "hello"
+    changes = [next(stream) for _ in range(4)]
+    assert [change.pop("seq") - sent["seq"] for change in changes] == [1, 2, 3, 4]
+    assert changes == [
+        {
+            "event": "message_edited",
+            "channel_id": channel_id,
+            "message_id": message_id,
+            "message": "hello world",
+        },
+        {
+            "event": "message_reacted",
+            "channel_id": channel_id,
+            "message_id": message_id,
+            "react_id": 1,
+            "u_id": supply_user1["u_id"],
+        },
+        {"event": "message_pinned", "channel_id": channel_id, "message_id": message_id},
+        {
+            "event": "message_removed",
+            "channel_id": channel_id,
+            "message_id": message_id,
+        },
+    ]
+    stream.close()
+
+
+def test_channel_subscribe_not_member(supply_user1, supply_user2, supply_channel):
+    with pytest.raises(AccessError):
+        channel_subscribe(supply_user2["token"], supply_channel["channel_id"])
+
+
+def test_channel_stream_ends_on_leave(supply_user1, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    stream = channel_subscribe(token, channel_id)
+    message_send(token, channel_id, "bye")
+    assert next(stream)["event"] == "message_sent"
+    channel_leave(token, channel_id)
+    assert list(stream) == []
+
+
+def test_channel_messages_since(supply_user1, supply_user2, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    first_id = message_send(token, channel_id, "first")["message_id"]
+    seq = channel_messages(token, channel_id, 0)["seq"]
+    assert channel_messages_since(token, channel_id, seq) == {
+        "events": [],
+        "seq": seq,
+        "reset": False,
+    }
+    second_id = message_send(token, channel_id, "second")["message_id"]
+    message_edit(token, second_id, "second, edited")
+    message_remove(token, first_id)
+    result = channel_messages_since(token, channel_id, seq)
+    assert result["seq"] == seq + 3
+    assert not result["reset"]
+    assert [event["event"] for event in result["events"]] == [
+        "message_sent",
+        "message_edited",
+        "message_removed",
+    ]
+    assert [event["seq"] for event in result["events"]] == [seq + 1, seq + 2, seq + 3]
+    assert result["events"][0]["message"]["message"] == "second, edited"
+    later = channel_messages_since(token, channel_id, seq + 2)["events"]
+    assert later == result["events"][2:]
+    message_remove(token, second_id)
+    result = channel_messages_since(token, channel_id, seq)
+    assert [event["seq"] for event in result["events"]] == [seq + 2, seq + 3, seq + 4]
+
+
+def test_channel_messages_since_reset(supply_user1, supply_user2, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    seq = channel_messages(token, channel_id, 0)["seq"]
+    result = channel_messages_since(token, channel_id, seq + 5)
+    assert result == {"events": [], "seq": seq, "reset": True}
+    with pytest.raises(AccessError):
+        channel_messages_since(supply_user2["token"], channel_id, seq)
+
+
+def test_channel_messages_range(supply_user1, supply_user2, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    for i in range(60):
+        message_send(token, channel_id, str(i))
+    assert (
+        len(channel_messages_range(token, channel_id, 0, 2**40, 0)["messages"]) == 50
+    )
+    # spread the messages over time, one second apart, out of send order
+    for i, message_id in enumerate(reversed(list(store.channel_log(channel_id)))):
+        message = store.get_message(message_id)
+        store.remove_message(message_id)
+        message.time_created = 1000 + i
+        store.add_message(message)
+    result = channel_messages_range(token, channel_id, 1000, 1059, 0)
+    assert result["end"] == 50
+    assert [message["message"] for message in result["messages"]] == [
+        str(i) for i in range(59, 9, -1)
+    ]
+    result = channel_messages_range(token, channel_id, 1000, 1059, 50)
+    assert result["end"] == -1
+    assert len(result["messages"]) == 10
+    result = channel_messages_range(token, channel_id, 1010, 1012, 0)
+    assert [message["message"] for message in result["messages"]] == ["49", "48", "47"]
+    assert channel_messages_range(token, channel_id, 2000, 3000, 0)["messages"] == []
+    with pytest.raises(InputError):
+        channel_messages_range(token, channel_id, 1012, 1010, 0)
+    with pytest.raises(InputError):
+        channel_messages_range(token, channel_id, 1010, 1012, 4)
+    with pytest.raises(AccessError):
+        channel_messages_range(supply_user2["token"], channel_id, 1000, 1059, 0)
+
+
+def test_channel_stream_ends_on_logout(supply_user1, supply_channel):
+    token = supply_user1["token"]
+    channel_id = supply_channel["channel_id"]
+    stream = channel_subscribe(token, channel_id)
+    message_send(token, channel_id, "bye")
+    assert next(stream)["event"] == "message_sent"
+    auth_logout(token)
+    assert list(stream) == []
@@ -2,6 +2,7 @@ import pytest
 from auth import auth_register
 from channel import channel_details, channel_join
 from channels import *
+from data import data
 from error import InputError, AccessError
 from other import clear
 
@@ -0,0 +1,411 @@
+"""
+Columnar metadata for every stored message. The message_id, channel_id,
+u_id and time_created of each message are kept in parallel int64 arrays,
+one row per message in the order they were sent, with byte flags per row
+marking whether it is pinned and whether it is still live. Message text
+stays in the records of data.py, so a scan that filters on metadata reads
+only the arrays and fetches the records it keeps.
+
+Filters are built as masks over whole columns with map() and combined
+with itertools.compress, so each pass runs in C rather than touching a
+Python object per message. Removed rows are only flagged, and the arrays
+are compacted once most of their rows are dead.
+
+The columns may start from a read-only base segment, such as the columns
+of a snapshot mapped by snapshot.py, which is read in place with the rows
+added since appended after it. A base row is found through the sorted id
+index that comes with the segment. Ids are allocated in increasing order,
+so appended rows are nearly sorted by id; a running maximum of their ids
+is kept so one is found by bisection, and the few rows whose id arrived
+late (a scheduled message sent with the id reserved when it was
+scheduled) are kept in a small map instead.
+
+MessageLog keeps the ids of a set of messages, such as a channel's, in
+the order they were sent, with removed ones left as tombstones until the
+log is compacted. TimeLog keeps them sorted by their recency keys instead,
+in two int64 columns, so a time range is found by bisection.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from functools import partial
+from itertools import accumulate, chain, compress, islice
+from operator import and_, eq, ge, le, lt
+
+# Dead rows needed before a compaction is considered
+COMPACT_MIN_DEAD = 1024
+
+
+class Column:
+    """An int64 column: a read-only base segment, then the rows appended."""
+
+    def __init__(self, base=(), rows=()):
+        self.base = base
+        self.rows = array("q", rows)
+
+    def __len__(self):
+        return len(self.base) + len(self.rows)
+
+    def __iter__(self):
+        return chain(self.base, self.rows)
+
+    def __getitem__(self, i):
+        if i < len(self.base):
+            return self.base[i]
+        return self.rows[i - len(self.base)]
+
+    def append(self, value):
+        self.rows.append(value)
+
+    def extend(self, values):
+        self.rows.extend(values)
+
+
+class MessageColumns:
+    """Parallel arrays of message metadata, indexed by row."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop every row."""
+        self.load_base((), (), (), (), b"", (), ())
+
+    def load_base(
+        self, message_ids, channel_ids, u_ids, times, pinned, sorted_ids, sorted_rows
+    ):
+        """
+        Start over from a base segment of int64 columns, read in place, and
+        its pinned flags. sorted_ids are its message_ids in order and
+        sorted_rows the row of each.
+        """
+        with self.lock:
+            self.message_ids = Column(message_ids)
+            self.channel_ids = Column(channel_ids)
+            self.u_ids = Column(u_ids)
+            self.times = Column(times)
+            self.pinned = bytearray(pinned)
+            self.live = bytearray(b"\1") * len(message_ids)
+            self.dead = 0
+            self.sorted_ids = sorted_ids
+            self.sorted_rows = sorted_rows
+            # running maximum of the appended message_ids, and message_id ->
+            # row of the appended rows whose id is below it
+            self.maxima = array("q")
+            self.out_of_order = {}
+
+    def __len__(self):
+        return len(self.message_ids) - self.dead
+
+    def append(self, message_id, channel_id, u_id, time_created, is_pinned=False):
+        """Add a row for a newly sent message."""
+        with self.lock:
+            self.message_ids.append(message_id)
+            self.channel_ids.append(channel_id)
+            self.u_ids.append(u_id)
+            self.times.append(time_created)
+            self.pinned.append(is_pinned)
+            self.live.append(1)
+            self.index_rows()
+
+    def extend(self, message_ids, channel_ids, u_ids, times, pinned):
+        """Add rows in bulk from int64 arrays, and their pinned flags as bytes."""
+        with self.lock:
+            self.message_ids.extend(message_ids)
+            self.channel_ids.extend(channel_ids)
+            self.u_ids.extend(u_ids)
+            self.times.extend(times)
+            self.pinned.extend(pinned)
+            self.live.extend(b"\1" * (len(self.message_ids) - len(self.live)))
+            self.index_rows()
+
+    def index_rows(self):
+        """
+        Extend the running maxima and out of order rows over the appended
+        rows not yet in them. The caller holds lock.
+        """
+        start = len(self.maxima)
+        ids = self.message_ids.rows[start:]
+        top = self.maxima[-1] if self.maxima else -1
+        self.maxima.extend(islice(accumulate(ids, max, initial=top), 1, None))
+        base = len(self.message_ids.base)
+        for i in compress(
+            range(start, len(self.maxima)), map(lt, ids, self.maxima[start:])
+        ):
+            self.out_of_order[self.message_ids.rows[i]] = base + i
+
+    def row(self, message_id):
+        """Return the live row of message_id, or None if it has none."""
+        i = self.out_of_order.get(message_id)
+        if i is None:
+            i = bisect_left(self.sorted_ids, message_id)
+            if i < len(self.sorted_ids) and self.sorted_ids[i] == message_id:
+                i = self.sorted_rows[i]
+            else:
+                rows = self.message_ids.rows
+                i = bisect_left(self.maxima, message_id)
+                if i == len(rows) or rows[i] != message_id:
+                    return None
+                i += len(self.message_ids.base)
+        return i if self.live[i] else None
+
+    def set_pinned(self, message_id, is_pinned):
+        """Flag a message's row as pinned or not."""
+        with self.lock:
+            i = self.row(message_id)
+            if i is not None:
+                self.pinned[i] = is_pinned
+
+    def remove(self, message_id):
+        """Mark the row of a removed message dead."""
+        with self.lock:
+            i = self.row(message_id)
+            if i is None:
+                return
+            self.live[i] = 0
+            self.dead += 1
+            if self.dead >= COMPACT_MIN_DEAD and self.dead * 2 > len(self.live):
+                self.compact()
+
+    def compact(self):
+        """
+        Rewrite the columns without their dead rows, as appended rows with no
+        base segment. The caller holds lock.
+        """
+        live = self.live
+        self.message_ids = Column(rows=compress(self.message_ids, live))
+        self.channel_ids = Column(rows=compress(self.channel_ids, live))
+        self.u_ids = Column(rows=compress(self.u_ids, live))
+        self.times = Column(rows=compress(self.times, live))
+        self.pinned = bytearray(compress(self.pinned, live))
+        self.live = bytearray(b"\1" * len(self.message_ids))
+        self.dead = 0
+        self.sorted_ids = self.sorted_rows = ()
+        self.maxima = array("q")
+        self.out_of_order = {}
+        self.index_rows()
+
+    def mask(self, channel_ids, u_id, since, until, pinned):
+        """
+        Return an iterator of flags, one per row, set for the live rows in
+        one of channel_ids, sent by u_id, sent in [since, until] and pinned
+        if pinned is True. A filter left as None matches every row. The
+        caller holds lock.
+        """
+        mask = self.live
+        if channel_ids is not None:
+            channel_ids = frozenset(channel_ids)
+            mask = map(and_, mask, map(channel_ids.__contains__, self.channel_ids))
+        if u_id is not None:
+            mask = map(and_, mask, map(partial(eq, u_id), self.u_ids))
+        if since is not None:
+            mask = map(and_, mask, map(partial(le, since), self.times))
+        if until is not None:
+            mask = map(and_, mask, map(partial(ge, until), self.times))
+        if pinned:
+            mask = map(and_, mask, self.pinned)
+        return mask
+
+    def select(self, channel_ids=None, u_id=None, since=None, until=None, pinned=None):
+        """Return the ids of the messages matching mask(), oldest first."""
+        with self.lock:
+            mask = self.mask(channel_ids, u_id, since, until, pinned)
+            return list(compress(self.message_ids, mask))
+
+    def select_keys(
+        self, channel_ids=None, u_id=None, since=None, until=None, pinned=None
+    ):
+        """
+        Return the (time_created, message_id) recency keys of the messages
+        matching mask(), in row order.
+        """
+        with self.lock:
+            mask = self.mask(channel_ids, u_id, since, until, pinned)
+            return list(compress(zip(self.times, self.message_ids), mask))
+
+    def keys(self, message_ids, channel_ids=None, u_id=None, pinned=None):
+        """
+        Return the recency keys of those of message_ids that are live, in
+        one of channel_ids, sent by u_id and pinned if pinned is True. A
+        filter left as None matches every message.
+        """
+        keys = []
+        with self.lock:
+            for message_id in message_ids:
+                i = self.row(message_id)
+                if (
+                    i is None
+                    or channel_ids is not None
+                    and self.channel_ids[i] not in channel_ids
+                    or u_id is not None
+                    and self.u_ids[i] != u_id
+                    or pinned
+                    and not self.pinned[i]
+                ):
+                    continue
+                keys.append((self.times[i], message_id))
+        return keys
+
+
+class MessageLog:
+    """
+    Message ids in the order they were added, such as a channel's. Removing
+    an id only marks its slot dead, so it costs the same however long the
+    log is; the log is compacted once most of its slots are dead.
+    """
+
+    def __init__(self, message_ids=()):
+        self.message_ids = array("q", message_ids)
+        self.live = bytearray(b"\1" * len(self.message_ids))
+        # slots of the dead ids, in order
+        self.dead = array("q")
+        # message_id -> slot of every live id, built when first needed
+        self.slots = None
+
+    def __len__(self):
+        return len(self.message_ids) - len(self.dead)
+
+    def __iter__(self):
+        return compress(self.message_ids, self.live)
+
+    def append(self, message_id):
+        """Add an id after every other."""
+        if self.slots is not None:
+            self.slots[message_id] = len(self.message_ids)
+        self.message_ids.append(message_id)
+        self.live.append(1)
+
+    def slot(self, message_id):
+        """Return the slot of a live id, or None if it is not in the log."""
+        if self.slots is None:
+            self.slots = dict(
+                zip(
+                    compress(self.message_ids, self.live),
+                    compress(range(len(self.live)), self.live),
+                )
+            )
+        return self.slots.get(message_id)
+
+    def remove(self, message_id):
+        """Remove an id, if present."""
+        slot = self.slot(message_id)
+        if slot is not None:
+            del self.slots[message_id]
+            self.kill(slot)
+
+    def kill(self, slot):
+        """Mark a slot dead, compacting the log once most slots are."""
+        self.live[slot] = 0
+        insort(self.dead, slot)
+        if len(self.dead) >= COMPACT_MIN_DEAD and len(self.dead) * 2 > len(self.live):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log without its dead slots."""
+        self.message_ids = array("q", compress(self.message_ids, self.live))
+        self.live = bytearray(b"\1" * len(self.message_ids))
+        self.dead = array("q")
+        self.slots = None
+
+    def rank(self, slot):
+        """Return how many live ids come before slot."""
+        return slot - bisect_left(self.dead, slot)
+
+    def nth(self, rank):
+        """Return the slot of the live id with rank live ids before it."""
+        # the slot is rank plus the dead slots before it
+        lo, hi = rank, rank + len(self.dead)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.rank(mid + 1) > rank:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def page(self, start, stop):
+        """Return the live ids ranked from start up to stop, in log order."""
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+        first, last = self.nth(start), self.nth(stop - 1) + 1
+        return list(compress(self.message_ids[first:last], self.live[first:last]))
+
+
+class TimeLog(MessageLog):
+    """The (time_created, message_id) keys of a set of messages, sorted."""
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        super().__init__(key[1] for key in keys)
+        self.times = array("q", (key[0] for key in keys))
+
+    def position(self, time_created, message_id):
+        """Return the first slot at or after the key (time_created, message_id)."""
+        lo = bisect_left(self.times, time_created)
+        hi = bisect_right(self.times, time_created, lo)
+        return bisect_left(self.message_ids, message_id, lo, hi)
+
+    def add(self, time_created, message_id):
+        """Add a message's key, which is usually the newest."""
+        if not self.times or (time_created, message_id) > (
+            self.times[-1],
+            self.message_ids[-1],
+        ):
+            self.times.append(time_created)
+            self.append(message_id)
+            return
+        i = self.position(time_created, message_id)
+        self.times.insert(i, time_created)
+        self.message_ids.insert(i, message_id)
+        self.live.insert(i, 1)
+        self.dead = array("q", (slot + (slot >= i) for slot in self.dead))
+        self.slots = None
+
+    def remove(self, time_created, message_id):
+        """Remove a message's key, if present."""
+        i = self.position(time_created, message_id)
+        while (
+            i < len(self.message_ids)
+            and self.times[i] == time_created
+            and self.message_ids[i] == message_id
+        ):
+            if self.live[i]:
+                self.kill(i)
+                return
+            i += 1
+
+    def compact(self):
+        self.times = array("q", compress(self.times, self.live))
+        super().compact()
+
+    def newest(self, before=None, since=None, until=None, count=None):
+        """
+        Return up to count live keys (all if None), newest first, that come
+        before the key before and were sent between since and until
+        inclusive. None leaves that end open.
+        """
+        lo = 0 if since is None else bisect_left(self.times, since)
+        hi = len(self.times) if until is None else bisect_right(self.times, until)
+        if before is not None:
+            hi = min(hi, self.position(*before))
+        keys = []
+        while hi > lo and (count is None or len(keys) < count):
+            start = lo if count is None else max(lo, hi - count)
+            chunk = compress(
+                zip(self.times[start:hi], self.message_ids[start:hi]),
+                self.live[start:hi],
+            )
+            keys.extend(reversed(list(chunk)))
+            hi = start
+        return keys[:count]
+
+    def span(self, since=None, until=None):
+        """
+        Return the (start, stop) ranks of the messages sent between since and
+        until inclusive, for page(). None leaves that end open.
+        """
+        lo = 0 if since is None else bisect_left(self.times, since)
+        hi = len(self.times) if until is None else bisect_right(self.times, until)
+        return self.rank(lo), self.rank(max(lo, hi))
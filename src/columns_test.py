@@ -0,0 +1,167 @@
+from array import array
+from columns import MessageColumns, MessageLog, TimeLog
+import columns
+
+
+def supply_columns():
+    table = MessageColumns()
+    for message_id in range(10):
+        # channel 1 gets even ids, channel 2 odd; u_id 0 sends the first half
+        table.append(message_id, 1 + message_id % 2, message_id // 5, 100 + message_id)
+    return table
+
+
+def test_columns_select():
+    table = supply_columns()
+    assert table.select() == list(range(10))
+    assert table.select(channel_ids=[1]) == [0, 2, 4, 6, 8]
+    assert table.select(u_id=1) == [5, 6, 7, 8, 9]
+    assert table.select(since=103, until=105) == [3, 4, 5]
+    assert table.select(channel_ids={2}, u_id=0, since=102) == [3]
+    assert table.select(channel_ids=[]) == []
+
+
+def test_columns_pinned():
+    table = supply_columns()
+    table.set_pinned(3, True)
+    table.set_pinned(8, True)
+    assert table.select(pinned=True) == [3, 8]
+    assert table.select(pinned=True, u_id=1) == [8]
+    table.set_pinned(8, False)
+    assert table.keys([3, 8], pinned=True) == [(103, 3)]
+
+
+def test_columns_remove():
+    table = supply_columns()
+    table.remove(4)
+    table.remove(4)
+    assert len(table) == 9
+    assert table.row(4) is None
+    assert table.row(5) == 5
+    assert table.select(channel_ids=[1]) == [0, 2, 6, 8]
+
+
+def test_columns_compact(monkeypatch):
+    monkeypatch.setattr(columns, "COMPACT_MIN_DEAD", 2)
+    table = supply_columns()
+    for message_id in range(6):
+        table.remove(message_id)
+    assert len(table.message_ids) == len(table) == 4
+    assert table.select(u_id=1) == [6, 7, 8, 9]
+    assert table.row(7) == 1
+
+
+def test_columns_out_of_order_ids():
+    table = supply_columns()
+    table.append(42, 1, 0, 200)
+    table.append(11, 2, 0, 201)
+    table.extend(
+        array("q", [43, 12]),
+        array("q", [1, 1]),
+        array("q", [0, 0]),
+        array("q", [202, 203]),
+        b"\0\0",
+    )
+    assert [table.row(message_id) for message_id in (5, 42, 11, 43, 12)] == [
+        5,
+        10,
+        11,
+        12,
+        13,
+    ]
+    assert table.row(13) is None
+    table.remove(11)
+    assert table.select(since=200) == [42, 43, 12]
+    table.compact()
+    assert table.out_of_order == {12: 12}
+    assert table.row(12) == 12 and table.row(43) == 11
+
+
+def test_columns_base_segment(monkeypatch):
+    monkeypatch.setattr(columns, "COMPACT_MIN_DEAD", 2)
+    table = MessageColumns()
+    ids = array("q", [10, 30, 20])
+    table.load_base(
+        memoryview(ids),
+        memoryview(array("q", [1, 2, 1])),
+        memoryview(array("q", [0, 0, 1])),
+        memoryview(array("q", [100, 101, 102])),
+        b"\0\1\0",
+        memoryview(array("q", [10, 20, 30])),
+        memoryview(array("q", [0, 2, 1])),
+    )
+    table.append(25, 2, 1, 103)
+    assert [table.row(message_id) for message_id in (10, 20, 25, 30, 40)] == [
+        0,
+        2,
+        3,
+        1,
+        None,
+    ]
+    assert table.select(channel_ids=[2]) == [30, 25]
+    assert table.select(pinned=True) == [30]
+    assert table.keys([20, 25], u_id=1) == [(102, 20), (103, 25)]
+    table.set_pinned(20, True)
+    table.remove(30)
+    assert table.select(pinned=True) == [20]
+    # compacting moves the rows off the base segment
+    table.remove(10)
+    table.remove(25)
+    assert table.message_ids.base == () and list(table.message_ids) == [20]
+    assert table.row(20) == 0 and table.select(pinned=True) == [20]
+
+
+def test_time_log_keeps_keys_sorted():
+    log = TimeLog([(100, 1), (100, 3), (105, 4)])
+    log.add(110, 5)
+    log.add(100, 2)
+    log.add(90, 6)
+    assert list(zip(log.times, log.message_ids)) == [
+        (90, 6),
+        (100, 1),
+        (100, 2),
+        (100, 3),
+        (105, 4),
+        (110, 5),
+    ]
+    log.remove(100, 2)
+    log.remove(100, 7)
+    assert list(log) == [6, 1, 3, 4, 5]
+    assert log.span(100, 105) == (1, 4)
+    assert log.span(101, 104) == (3, 3)
+    assert log.span(None, 99) == (0, 1)
+    assert log.span(106) == (4, 5)
+    assert log.span(120, 130) == (5, 5)
+
+
+def test_time_log_newest():
+    log = TimeLog([(100, 1), (100, 3), (105, 4), (110, 5), (120, 6)])
+    log.remove(110, 5)
+    assert log.newest() == [(120, 6), (105, 4), (100, 3), (100, 1)]
+    assert log.newest(count=2) == [(120, 6), (105, 4)]
+    assert log.newest((105, 4), count=2) == [(100, 3), (100, 1)]
+    assert log.newest((100, 2)) == [(100, 1)]
+    assert log.newest(since=101, until=115) == [(105, 4)]
+
+
+def test_message_log_tombstones(monkeypatch):
+    monkeypatch.setattr(columns, "COMPACT_MIN_DEAD", 4)
+    log = MessageLog(range(10))
+    log.append(10)
+    for message_id in (3, 4, 8):
+        log.remove(message_id)
+    log.remove(42)
+    assert len(log) == 8
+    assert list(log) == [0, 1, 2, 5, 6, 7, 9, 10]
+    assert list(log.dead) == [3, 4, 8]
+    assert [log.nth(rank) for rank in range(8)] == [0, 1, 2, 5, 6, 7, 9, 10]
+    assert log.page(2, 5) == [2, 5, 6]
+    assert log.page(6, 20) == [9, 10]
+    assert log.page(8, 9) == []
+    # past half dead, the log is compacted
+    for message_id in (0, 1, 2):
+        log.remove(message_id)
+    assert list(log.message_ids) == [5, 6, 7, 9, 10]
+    assert len(log.dead) == 0
+    log.remove(7)
+    assert log.page(0, 4) == [5, 6, 9, 10]
@@ -1,7 +1,8 @@
 data = {
     "id": 0,
-    "users": [],
-    "sessions": [],
-    "channels": [],
-    "messages": [],
+    "users": {},
+    "sessions": {},
+    "channels": {},
+    "messages": {},
+    "scheduled": {},
 }
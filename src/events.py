@@ -0,0 +1,182 @@
+"""
+Publish and subscribe for changes to the messages of a channel. store.py
+publishes a small event for every message sent, edited, removed, reacted
+to or pinned, and each is delivered to the subscribers of its channel.
+Each user also has a topic of their own, told when they join or leave a
+channel, so a subscriber can follow the user's channels as they change.
+
+A subscriber is any object with a deliver(event) method that must not
+block. A subscriber that returns False from deliver() is dropped, which is
+how one that has fallen too far behind is let go.
+
+Every event published to a channel is given the channel's next sequence
+number as its seq and kept in the channel's change log, so a client that
+knows the last seq it saw can catch up on just what it missed. A log keeps
+the latest CHANGE_LOG_SIZE events at least. The log keeps a sent message
+by its id alone rather than its whole body, which the reader looks up in
+the store. Logs live in memory, so a new
+log numbers its events from the time it was started, in microseconds,
+which keeps seqs increasing across restarts of the server.
+"""
+import queue
+import threading
+import time
+
+# Events a stream subscriber may have waiting before it is dropped
+QUEUE_SIZE = 256
+# Seconds a stream waits for an event before sending a keep-alive
+HEARTBEAT = 15
+# Latest events of a channel that can always be caught up on
+CHANGE_LOG_SIZE = 10000
+
+# channel_id -> set of subscribers
+subscribers = {}
+# u_id -> set of subscribers
+user_subscribers = {}
+# channel_id -> ChangeLog of its recent events
+change_logs = {}
+# held while delivering, so every subscriber sees a channel's events in order
+lock = threading.RLock()
+
+
+def subscribe(channel_id, subscriber):
+    """Deliver every later event of a channel to subscriber."""
+    add_subscriber(subscribers, channel_id, subscriber)
+
+
+def unsubscribe(channel_id, subscriber):
+    """Stop delivering a channel's events to subscriber."""
+    remove_subscriber(subscribers, channel_id, subscriber)
+
+
+def publish(channel_id, event):
+    """Number an event, log it and deliver it to every subscriber of a channel."""
+    with lock:
+        change_log(channel_id).append(event)
+        deliver(subscribers, channel_id, event)
+
+
+def change_log(channel_id):
+    """Return a channel's change log, starting it if it has none yet."""
+    with lock:
+        log = change_logs.get(channel_id)
+        if log is None:
+            log = change_logs[channel_id] = ChangeLog(time.time_ns() // 1000)
+        return log
+
+
+def last_seq(channel_id):
+    """Return the seq of a channel's latest event."""
+    return change_log(channel_id).last_seq()
+
+
+def subscribe_user(u_id, subscriber):
+    """Deliver every later event of a user's own topic to subscriber."""
+    add_subscriber(user_subscribers, u_id, subscriber)
+
+
+def unsubscribe_user(u_id, subscriber):
+    """Stop delivering a user's own events to subscriber."""
+    remove_subscriber(user_subscribers, u_id, subscriber)
+
+
+def publish_user(u_id, event):
+    """Deliver an event to every subscriber of a user's own topic."""
+    deliver(user_subscribers, u_id, event)
+
+
+def add_subscriber(topics, key, subscriber):
+    """Add subscriber to the topic key of topics."""
+    with lock:
+        topics.setdefault(key, set()).add(subscriber)
+
+
+def remove_subscriber(topics, key, subscriber):
+    """Remove subscriber from the topic key of topics, if there."""
+    with lock:
+        topic = topics.get(key)
+        if topic is not None:
+            topic.discard(subscriber)
+            if not topic:
+                del topics[key]
+
+
+def deliver(topics, key, event):
+    """Deliver event to the topic key of topics, dropping who refuses it."""
+    with lock:
+        for subscriber in list(topics.get(key, ())):
+            if subscriber.deliver(event) is False:
+                remove_subscriber(topics, key, subscriber)
+
+
+def clear():
+    """Drop every subscriber and change log."""
+    with lock:
+        subscribers.clear()
+        user_subscribers.clear()
+        change_logs.clear()
+
+
+def compact(event):
+    """Return what a change log keeps of an event."""
+    if event["event"] != "message_sent":
+        return event
+    return {
+        "event": event["event"],
+        "channel_id": event["channel_id"],
+        "message_id": event["message"]["message_id"],
+        "seq": event["seq"],
+    }
+
+
+class ChangeLog:
+    """The recent events of one channel, numbered from first_seq."""
+
+    def __init__(self, first_seq):
+        self.events = []
+        # seq of events[0]
+        self.start = first_seq
+
+    def append(self, event):
+        """Give event the next seq and log it."""
+        event["seq"] = self.start + len(self.events)
+        self.events.append(compact(event))
+        if len(self.events) >= 2 * CHANGE_LOG_SIZE:
+            # trimming in halves keeps appends O(1) amortised
+            dropped = len(self.events) - CHANGE_LOG_SIZE
+            del self.events[:dropped]
+            self.start += dropped
+
+    def last_seq(self):
+        """Return the seq of the latest event."""
+        return self.start + len(self.events) - 1
+
+    def since(self, seq):
+        """Return the events after seq, or None if they are not all held."""
+        if seq < self.start - 1 or seq > self.last_seq():
+            return None
+        return self.events[seq - self.start + 1 :]
+
+
+class Subscription:
+    """A subscriber that queues events for a thread to read, such as a stream."""
+
+    def __init__(self, size=None):
+        self.events = queue.Queue(QUEUE_SIZE if size is None else size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """Queue an event, giving up on the subscriber if its queue is full."""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+            return False
+        return True
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrives within timeout."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
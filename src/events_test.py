@@ -0,0 +1,75 @@
+import events
+from events import Subscription
+
+
+def test_publish_reaches_channel_subscribers_only():
+    events.clear()
+    first, second = Subscription(), Subscription()
+    events.subscribe(1, first)
+    events.subscribe(2, second)
+    event = {"event": "message_removed", "message_id": 5}
+    events.publish(1, event)
+    assert first.get(0) is event
+    assert second.get(0) is None
+
+
+def test_unsubscribe():
+    events.clear()
+    subscription = Subscription()
+    events.subscribe(1, subscription)
+    events.unsubscribe(1, subscription)
+    events.publish(1, {"event": "message_removed", "message_id": 5})
+    assert subscription.get(0) is None
+    assert events.subscribers == {}
+
+
+def test_full_subscriber_is_dropped():
+    events.clear()
+    subscription = Subscription(size=2)
+    events.subscribe(1, subscription)
+    for message_id in range(3):
+        events.publish(1, {"event": "message_removed", "message_id": message_id})
+    assert subscription.overflowed
+    assert events.subscribers == {}
+    assert subscription.get(0)["message_id"] == 0
+
+
+def test_publish_numbers_events_per_channel():
+    events.clear()
+    first = {"event": "message_removed", "message_id": 1}
+    events.publish(1, first)
+    events.publish(2, {"event": "message_removed", "message_id": 2})
+    second = {"event": "message_removed", "message_id": 3}
+    events.publish(1, second)
+    assert second["seq"] == first["seq"] + 1
+    assert events.last_seq(1) == second["seq"]
+    log = events.change_log(1)
+    assert log.since(first["seq"] - 1) == [first, second]
+    assert log.since(first["seq"]) == [second]
+    assert log.since(second["seq"]) == []
+    assert log.since(first["seq"] - 2) is None
+    assert log.since(second["seq"] + 1) is None
+
+
+def test_change_log_keeps_sent_messages_by_id():
+    log = events.ChangeLog(100)
+    event = {
+        "event": "message_sent",
+        "channel_id": 1,
+        "message": {"message_id": 7, "message": "hello"},
+    }
+    log.append(event)
+    assert event["seq"] == 100
+    assert log.since(99) == [
+        {"event": "message_sent", "channel_id": 1, "message_id": 7, "seq": 100}
+    ]
+
+
+def test_change_log_trims_oldest(monkeypatch):
+    monkeypatch.setattr(events, "CHANGE_LOG_SIZE", 4)
+    log = events.ChangeLog(100)
+    for message_id in range(10):
+        log.append({"event": "message_removed", "message_id": message_id})
+    assert log.last_seq() == 109
+    assert log.since(99) is None
+    assert [event["seq"] for event in log.since(105)] == [106, 107, 108, 109]
@@ -0,0 +1,394 @@
+"""
+A WebSocket gateway that pushes the events of events.py to clients as they
+happen. A client connects with its token in the query string, as in
+ws://host:port/?token=..., and is subscribed to every channel its user is
+in, following the user into channels they join and out of ones they leave.
+Each event is sent as a text frame of JSON.
+
+The gateway is one asyncio event loop on a thread of its own, speaking
+just enough of RFC 6455 (no extensions or subprotocols) to hold many
+mostly idle connections without a thread each. Events are published from
+the server's threads into a bounded buffer per connection. A connection
+whose buffer fills, or whose socket does not drain in time, cannot keep
+up and is closed.
+
+Clients may send text frames of JSON too. {"op": "send", "channel_id": ...,
+"message": ...} sends a message as the connected user, and is answered with
+{"op": "sent", "message_id": ...} or {"op": "error", "message": ...}.
+
+The token is checked again every PING_INTERVAL, and a connection whose
+session has ended, by logging out or expiring, is closed with POLICY.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+from werkzeug.exceptions import HTTPException
+import events
+import message
+import session
+import store
+from auth import auth_token
+from records import to_dict
+
+# Events a connection may have waiting to be sent before it is closed
+SEND_BUFFER = 256
+# Seconds a client has to take what is written to it, or to finish its handshake
+SEND_TIMEOUT = 10
+# Seconds between pings on an idle connection, and between checks of its session
+PING_INTERVAL = 30
+# Largest message accepted from a client, and largest handshake
+MAX_MESSAGE = 65536
+MAX_HANDSHAKE = 8192
+
+HANDSHAKE_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Frame opcodes
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+# Close codes
+NORMAL, GOING_AWAY, PROTOCOL_ERROR, UNSUPPORTED = 1000, 1001, 1002, 1003
+POLICY, TOO_BIG, TRY_AGAIN = 1008, 1009, 1013
+
+# The gateway's event loop, its thread and listening server while running
+loop = None
+thread = None
+server = None
+# Every open connection
+connections = set()
+# The last event encoded and its frame, as one event goes to many connections
+last_event = None
+last_frame = None
+
+
+class ProtocolError(Exception):
+    """A client broke the protocol; close its connection with code."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def accept_key(key):
+    """Return the Sec-WebSocket-Accept answering a Sec-WebSocket-Key."""
+    digest = hashlib.sha1(key.encode("latin-1") + HANDSHAKE_GUID).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def frame(opcode, payload):
+    """Return a whole, unmasked frame as the server sends it."""
+    length = len(payload)
+    if length < 126:
+        head = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return head + payload
+
+
+def unmask(payload, mask):
+    """Undo the masking of a client's frame."""
+    length = len(payload)
+    if not length:
+        return payload
+    key = (mask * (length // 4 + 1))[:length]
+    unmasked = int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")
+    return unmasked.to_bytes(length, "big")
+
+
+def encode(event):
+    """Return the text frame of an event, reusing it for the same event."""
+    global last_event, last_frame
+    if event is not last_event:
+        last_frame = frame(TEXT, json.dumps(event, default=to_dict).encode())
+        last_event = event
+    return last_frame
+
+
+class Connection:
+    """One client's WebSocket, subscribed to the channels its user is in."""
+
+    def __init__(self, reader, writer, u_id, token):
+        self.reader = reader
+        self.writer = writer
+        self.u_id = u_id
+        self.token = token
+        self.channel_ids = set()
+        # events waiting to be sent, appended to from any thread
+        self.outbox = deque()
+        self.lock = threading.Lock()
+        self.wakeup = asyncio.Event()
+        # the close code once the connection is closing
+        self.closing = None
+        self.task = asyncio.current_task()
+        # loop time the session was last found live
+        self.checked = loop.time()
+
+    def subscribe(self):
+        """Follow the user's own events and every channel they are in."""
+        events.subscribe_user(self.u_id, self)
+        for channel_id in store.user_channel_ids(self.u_id):
+            self.channel_ids.add(channel_id)
+            events.subscribe(channel_id, self)
+
+    def unsubscribe(self):
+        """Stop following the user and their channels."""
+        events.unsubscribe_user(self.u_id, self)
+        for channel_id in list(self.channel_ids):
+            events.unsubscribe(channel_id, self)
+        self.channel_ids.clear()
+
+    def deliver(self, event):
+        """Buffer an event to send, from any thread. Refuse it once full."""
+        if self.closing is not None:
+            return False
+        # follow the user into and out of channels before any of their events
+        kind = event.get("event")
+        if kind == "channel_joined":
+            self.channel_ids.add(event["channel_id"])
+            events.subscribe(event["channel_id"], self)
+        elif kind == "channel_left":
+            self.channel_ids.discard(event["channel_id"])
+            events.unsubscribe(event["channel_id"], self)
+        with self.lock:
+            if len(self.outbox) >= SEND_BUFFER:
+                full = True
+            else:
+                full = False
+                self.outbox.append(event)
+                # only the event that finds the buffer empty needs to wake it
+                wake = len(self.outbox) == 1
+        if full:
+            self.close_soon(TRY_AGAIN)
+            return False
+        if wake:
+            loop.call_soon_threadsafe(self.wakeup.set)
+        return True
+
+    def close_soon(self, code):
+        """Close the connection with code, from any thread."""
+        if self.closing is None:
+            self.closing = code
+        loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def send_events(self):
+        """Write buffered events to the client until the connection closes."""
+        writer = self.writer
+        try:
+            while self.closing is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(frame(PING, b""))
+                if loop.time() - self.checked >= PING_INTERVAL:
+                    if not await self.session_live():
+                        self.closing = POLICY
+                        break
+                self.wakeup.clear()
+                with self.lock:
+                    batch = list(self.outbox)
+                    self.outbox.clear()
+                for event in batch:
+                    writer.write(encode(event))
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # too slow to take what it was sent; drop it without a goodbye
+            self.closing = TRY_AGAIN
+            writer.transport.abort()
+            return
+        except ConnectionError:
+            writer.transport.abort()
+            return
+        writer.write(frame(CLOSE, struct.pack("!H", self.closing)))
+        writer.close()
+
+    async def session_live(self):
+        """Return whether the user's session is still live, marking it used."""
+        # touching a session may write to the persisted log, so keep it off the loop
+        u_id = await loop.run_in_executor(None, session.session_touch, self.token)
+        self.checked = loop.time()
+        return u_id == self.u_id
+
+    async def read_frame(self):
+        """Return (fin, opcode, payload) of the client's next frame."""
+        head = await self.reader.readexactly(2)
+        if head[0] & 0x70 or not head[1] & 0x80:
+            # extension bits set, or the frame is not masked
+            raise ProtocolError(PROTOCOL_ERROR)
+        fin, opcode, length = head[0] & 0x80, head[0] & 0x0F, head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        if opcode >= CLOSE and (not fin or length > 125):
+            raise ProtocolError(PROTOCOL_ERROR)
+        if length > MAX_MESSAGE:
+            raise ProtocolError(TOO_BIG)
+        mask = await self.reader.readexactly(4)
+        return fin, opcode, unmask(await self.reader.readexactly(length), mask)
+
+    async def receive(self):
+        """Read the client's messages until it closes the connection."""
+        opcode, parts, size = None, [], 0
+        while self.closing is None:
+            fin, frame_opcode, payload = await self.read_frame()
+            if frame_opcode == CLOSE:
+                return
+            if frame_opcode == PING:
+                self.writer.write(frame(PONG, payload))
+                continue
+            if frame_opcode == PONG:
+                continue
+            if (frame_opcode == CONTINUATION) != (opcode is not None):
+                raise ProtocolError(PROTOCOL_ERROR)
+            if opcode is None:
+                opcode = frame_opcode
+            parts.append(payload)
+            size += len(payload)
+            if size > MAX_MESSAGE:
+                raise ProtocolError(TOO_BIG)
+            if fin:
+                if opcode != TEXT:
+                    raise ProtocolError(UNSUPPORTED)
+                await self.handle(b"".join(parts))
+                opcode, parts, size = None, [], 0
+
+    async def handle(self, payload):
+        """Carry out a request the client sent, and answer it."""
+        try:
+            request = json.loads(payload)
+            if request.get("op") != "send":
+                raise ValueError("Unknown op.")
+            channel_id = int(request["channel_id"])
+            text = request["message"]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.deliver({"op": "error", "message": "Invalid request."})
+            return
+        try:
+            # message_send writes to the persisted log, so keep it off the loop
+            result = await loop.run_in_executor(
+                None, message.message_send, self.token, channel_id, text
+            )
+        except HTTPException as error:
+            self.deliver({"op": "error", "message": error.description})
+            return
+        self.deliver({"op": "sent", "message_id": result["message_id"]})
+
+
+def parse_handshake(request):
+    """Return (path, headers) of an HTTP request head."""
+    lines = request.decode("latin-1").split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    if method != "GET":
+        raise ValueError(method)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return path, headers
+
+
+def refuse(writer, status):
+    """Answer a handshake with an HTTP error and hang up."""
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode()
+    )
+    writer.close()
+
+
+async def accept(reader, writer):
+    """Carry out a client's handshake, then serve its connection."""
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), SEND_TIMEOUT)
+        path, headers = parse_handshake(request)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        writer.close()
+        return
+    except (asyncio.LimitOverrunError, ValueError):
+        refuse(writer, "400 Bad Request")
+        return
+    key = headers.get("sec-websocket-key")
+    if (
+        headers.get("upgrade", "").lower() != "websocket"
+        or "upgrade" not in headers.get("connection", "").lower()
+        or headers.get("sec-websocket-version") != "13"
+        or not key
+    ):
+        refuse(writer, "400 Bad Request")
+        return
+    token = parse_qs(urlsplit(path).query).get("token", [""])[0]
+    try:
+        # checking a token may write to the persisted log, so keep it off the loop
+        u_id = await loop.run_in_executor(None, auth_token, token)
+    except HTTPException:
+        refuse(writer, "403 Forbidden")
+        return
+
+    connection = Connection(reader, writer, u_id, token)
+    # subscribed before the handshake is answered, so no event is missed after
+    connection.subscribe()
+    connections.add(connection)
+    writer.write(
+        (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+        ).encode()
+    )
+    sender = asyncio.ensure_future(connection.send_events())
+    try:
+        await connection.receive()
+        connection.close_soon(NORMAL)
+    except ProtocolError as error:
+        connection.close_soon(error.code)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        connection.close_soon(GOING_AWAY)
+    finally:
+        connection.unsubscribe()
+        connections.discard(connection)
+        await sender
+
+
+def start_gateway(host="127.0.0.1", port=0):
+    """Run the gateway on a thread of its own. Return the port it listens on."""
+    global loop, thread, server
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_server(accept, host, port, limit=MAX_HANDSHAKE)
+    )
+    thread = threading.Thread(target=loop.run_forever, name="gateway", daemon=True)
+    thread.start()
+    return server.sockets[0].getsockname()[1]
+
+
+def stop_gateway():
+    """Close every connection and stop the gateway."""
+    global loop, thread, server
+    if loop is None:
+        return
+
+    async def shut_down():
+        server.close()
+        tasks = [connection.task for connection in connections]
+        for connection in list(connections):
+            connection.close_soon(GOING_AWAY)
+        if tasks:
+            await asyncio.wait(tasks, timeout=SEND_TIMEOUT)
+        await server.wait_closed()
+
+    asyncio.run_coroutine_threadsafe(shut_down(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    loop = thread = server = None
+
+
+def connection_count():
+    """Return how many clients are connected."""
+    return len(connections)
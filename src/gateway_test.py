@@ -0,0 +1,150 @@
+import base64
+import json
+import os
+import socket
+import struct
+import pytest
+import gateway
+from auth import auth_register, auth_logout
+from channel import channel_invite, channel_leave
+from channels import channels_create
+from message import message_send
+from other import clear
+
+
+@pytest.fixture
+def port():
+    clear()
+    port = gateway.start_gateway()
+    yield port
+    gateway.stop_gateway()
+
+
+@pytest.fixture
+def owner():
+    return auth_register("owner@gmail.com", "Password#1", "First", "Last")
+
+
+class Client:
+    """A bare WebSocket client, enough to talk to the gateway."""
+
+    def __init__(self, port, token):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall(
+            (
+                f"GET /?token={token} HTTP/1.1\r\nHost: localhost\r\n"
+                "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        self.file = self.sock.makefile("rb")
+        self.status = self.file.readline().decode()
+        self.headers = []
+        line = self.file.readline()
+        while line != b"\r\n":
+            self.headers.append(line.decode().strip())
+            line = self.file.readline()
+        self.key = key
+
+    def send(self, opcode, payload):
+        mask = os.urandom(4)
+        head = struct.pack("!BB", 0x80 | opcode, 0x80 | len(payload))
+        self.sock.sendall(head + mask + gateway.unmask(payload, mask))
+
+    def send_json(self, value):
+        self.send(gateway.TEXT, json.dumps(value).encode())
+
+    def receive(self):
+        head = self.file.read(2)
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.file.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.file.read(8))[0]
+        return head[0] & 0x0F, self.file.read(length)
+
+    def receive_json(self):
+        opcode, payload = self.receive()
+        assert opcode == gateway.TEXT
+        return json.loads(payload)
+
+
+def test_gateway_pushes_channel_events(port, owner):
+    channel_id = channels_create(owner["token"], "channel", True)["channel_id"]
+    client = Client(port, owner["token"])
+    assert "101" in client.status
+    assert f"Sec-WebSocket-Accept: {gateway.accept_key(client.key)}" in client.headers
+    message_id = message_send(owner["token"], channel_id, "hello")["message_id"]
+    event = client.receive_json()
+    assert event["event"] == "message_sent"
+    assert event["channel_id"] == channel_id
+    assert event["message"]["message_id"] == message_id
+
+
+def test_gateway_follows_joins_and_leaves(port, owner):
+    user = auth_register("user@gmail.com", "Password#1", "User", "One")
+    channel_id = channels_create(owner["token"], "channel", False)["channel_id"]
+    client = Client(port, user["token"])
+    channel_invite(owner["token"], channel_id, user["u_id"])
+    assert client.receive_json() == {
+        "event": "channel_joined",
+        "channel_id": channel_id,
+    }
+    message_send(owner["token"], channel_id, "welcome")
+    assert client.receive_json()["event"] == "message_sent"
+    channel_leave(user["token"], channel_id)
+    assert client.receive_json() == {"event": "channel_left", "channel_id": channel_id}
+    message_send(owner["token"], channel_id, "gone")
+    client.send(gateway.PING, b"ping")
+    assert client.receive() == (gateway.PONG, b"ping")
+
+
+def test_gateway_send_op(port, owner):
+    channel_id = channels_create(owner["token"], "channel", True)["channel_id"]
+    client = Client(port, owner["token"])
+    client.send_json({"op": "send", "channel_id": channel_id, "message": "hi"})
+    replies = [client.receive_json(), client.receive_json()]
+    sent = next(reply for reply in replies if reply.get("op") == "sent")
+    event = next(reply for reply in replies if reply.get("event") == "message_sent")
+    assert event["message"]["message_id"] == sent["message_id"]
+    client.send_json({"op": "send", "channel_id": 999, "message": "hi"})
+    assert client.receive_json()["op"] == "error"
+
+
+def test_gateway_refuses_bad_token(port, owner):
+    client = Client(port, "not a token")
+    assert "403" in client.status
+
+
+def test_gateway_evicts_slow_consumer(port, owner):
+    client = Client(port, owner["token"])
+    connection = next(iter(gateway.connections))
+    events = [{"event": "test"}] * (gateway.SEND_BUFFER * 4)
+    accepted = [connection.deliver(event) for event in events]
+    assert accepted[-1] is False
+    assert connection.closing == gateway.TRY_AGAIN
+
+
+def test_gateway_close(port, owner):
+    client = Client(port, owner["token"])
+    client.send(gateway.CLOSE, struct.pack("!H", gateway.NORMAL))
+    assert client.receive() == (gateway.CLOSE, struct.pack("!H", gateway.NORMAL))
+
+
+def test_gateway_closes_on_logout(port, owner, monkeypatch):
+    monkeypatch.setattr(gateway, "PING_INTERVAL", 0.05)
+    client = Client(port, owner["token"])
+    assert client.receive() == (gateway.PING, b"")
+    auth_logout(owner["token"])
+    opcode, payload = client.receive()
+    while opcode == gateway.PING:
+        opcode, payload = client.receive()
+    assert (opcode, payload) == (gateway.CLOSE, struct.pack("!H", gateway.POLICY))
+
+
+def test_accept_key():
+    # the example handshake of RFC 6455
+    assert (
+        gateway.accept_key("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+    )
@@ -1,11 +1,14 @@
 import time
-import threading
 from auth import auth_token
-from channel import find_channel, validate_channel_id
-from data import data
+from channel import validate_channel_id
+import store
 from error import InputError, AccessError
+from records import Message, ScheduledMessage
+from scheduler import Scheduler
 from user import find_user
-from channels import channels_list
+
+# Most messages one call to message_send_batch may send
+MAX_BATCH = 1000
 
 
 def message_send(token, channel_id, message):
@@ -16,35 +19,110 @@ def message_send(token, channel_id, message):
     u_id = auth_token(token)
     if len(message) > 1000:
         raise InputError("Message is longer than 1000 characters.")
-    channel = find_channel(channel_id)
-    if u_id not in (
-        [owner["u_id"] for owner in channel["owner_members"]]
-        + [member["u_id"] for member in channel["all_members"]]
-    ):
+    if not store.is_member(channel_id, u_id):
         raise AccessError(f"User is not a member of channel {channel_id}.")
-    message_id = data["id"]
-    message_details = {
-        "channel_id": channel_id,
-        "message_id": message_id,
-        "u_id": u_id,
-        "message": message,
-        "time_created": int(time.time()),
-        "reacts": [],
-        "is_pinned": False,
-    }
-    data["id"] += 1
-    data["messages"].append(message_details)
+    message_id = store.next_id()
+    message_details = Message(
+        channel_id=channel_id,
+        message_id=message_id,
+        u_id=u_id,
+        message=message,
+        time_created=int(time.time()),
+    )
+    store.add_message(message_details)
     return {"message_id": message_id}
 
 
+def message_send_batch(token, items):
+    """
+    Send each of items, a list of {"channel_id", "message"}, as the user.
+    Return, in the order of items, the message_id each was sent with or the
+    error that kept it from being sent.
+    """
+    u_id = auth_token(token)
+    if not isinstance(items, list):
+        raise InputError("messages must be a list.")
+    if len(items) > MAX_BATCH:
+        raise InputError(f"No more than {MAX_BATCH} messages can be sent at once.")
+    # channel_id -> error, or None if the user may send to it
+    channels = {}
+    results = []
+    valid = []
+    for item in items:
+        if not valid_batch_item(item):
+            results.append({"error": error_details(InputError("Invalid item."))})
+            continue
+        channel_id, message = item["channel_id"], item["message"]
+        if channel_id not in channels:
+            channels[channel_id] = batch_channel_error(channel_id, u_id)
+        error = channels[channel_id]
+        if error is None and len(message) > 1000:
+            error = InputError("Message is longer than 1000 characters.")
+        if error is not None:
+            results.append({"error": error_details(error)})
+            continue
+        valid.append((len(results), channel_id, message))
+        results.append(None)
+
+    time_created = int(time.time())
+    messages = [
+        Message(
+            channel_id=channel_id,
+            message_id=message_id,
+            u_id=u_id,
+            message=message,
+            time_created=time_created,
+        )
+        for message_id, (_, channel_id, message) in zip(
+            store.next_ids(len(valid)), valid
+        )
+    ]
+    store.add_messages(messages)
+    for (i, _, _), message in zip(valid, messages):
+        results[i] = {"message_id": message.message_id}
+    return {"results": results}
+
+
+def valid_batch_item(item):
+    """Return whether item is a dict of an int channel_id and a str message."""
+    if not isinstance(item, dict):
+        return False
+    channel_id = item.get("channel_id")
+    return (
+        isinstance(channel_id, int)
+        and not isinstance(channel_id, bool)
+        and isinstance(item.get("message"), str)
+    )
+
+
+def batch_channel_error(channel_id, u_id):
+    """Return the error sending to a channel would raise, or None."""
+    try:
+        validate_channel_id(channel_id)
+    except InputError as error:
+        return error
+    if not store.is_member(channel_id, u_id):
+        return AccessError(f"User is not a member of channel {channel_id}.")
+    return None
+
+
+def error_details(error):
+    """Return the code, name and message of an error for a batch result."""
+    return {
+        "code": error.code,
+        "name": type(error).__name__,
+        "message": error.description,
+    }
+
+
 def message_remove(token, message_id):
     """Remove the message specified by message_id."""
     u_id = auth_token(token)
-    if not any(message["message_id"] == message_id for message in data["messages"]):
-        raise InputError("Message with that id no longer exists.")
     message = find_message(message_id)
+    if not message:
+        raise InputError("Message with that id no longer exists.")
     check_user_message_perms(u_id, message)
-    data["messages"].remove(message)
+    store.remove_message(message_id)
     return {}
 
 
@@ -54,50 +132,131 @@ def message_edit(token, message_id, message):
     message_details = find_message(message_id)
     check_user_message_perms(u_id, message_details)
     if message:
-        message_idx = data["messages"].index(message_details)
-        data["messages"][message_idx]["message"] = message
+        store.set_message_text(message_details, message)
     else:
-        message_remove(token, message_id)
+        store.remove_message(message_id)
     return {}
 
 
 def message_sendlater(token, channel_id, message, time_sent):
-    time_now = int(time.time())
-    print(time_now)
-    print(time_sent)
-    if time_sent < time_now:
+    """
+    Schedule a message to be sent to a channel at the unix time time_sent,
+    returning the message_id it will be sent with.
+    """
+    validate_channel_id(channel_id)
+    u_id = auth_token(token)
+    if len(message) > 1000:
+        raise InputError("Message is longer than 1000 characters.")
+    if not store.is_member(channel_id, u_id):
+        raise AccessError(f"User is not a member of channel {channel_id}.")
+    if time_sent < int(time.time()):
         raise InputError("Time given is not valid - it is in the past.")
-    # schedule the time
-    t = threading.Timer(
-        time_sent - time_now, message_send, [token, channel_id, message]
-    )
-    t.start()
+    message_id = store.next_id()
+    scheduled = ScheduledMessage(message_id, channel_id, u_id, message, time_sent)
+    store.add_scheduled(scheduled)
+    scheduled_sends.schedule(time_sent, message_id, scheduled)
+    return {"message_id": message_id}
+
+
+def message_sendlater_cancel(token, message_id):
+    """Cancel a message the user scheduled that has not yet been sent."""
+    u_id = auth_token(token)
+    job = scheduled_sends.get(message_id)
+    if job is None:
+        raise InputError("Message is not scheduled to be sent.")
+    if job[1].u_id != u_id:
+        raise AccessError("Only the sender can cancel a scheduled message.")
+    # the message may have been sent since it was looked up
+    if not scheduled_sends.cancel(message_id):
+        raise InputError("Message is not scheduled to be sent.")
+    store.remove_scheduled(message_id)
     return {}
 
 
+def message_sendlater_list(token):
+    """Return the messages the user has scheduled that have not yet been sent."""
+    u_id = auth_token(token)
+    messages = [
+        {
+            "message_id": scheduled.message_id,
+            "channel_id": scheduled.channel_id,
+            "message": scheduled.message,
+            "time_sent": scheduled.time_sent,
+        }
+        for _, _, scheduled in scheduled_sends.pending()
+        if scheduled.u_id == u_id
+    ]
+    return {"messages": messages}
+
+
+def send_scheduled(message_id, scheduled, time_sent):
+    """Send a scheduled message, unless its sender has since left the channel."""
+    channel_id = scheduled.channel_id
+    # a message sent just before a crash is still queued after a restart
+    if (
+        store.get_message(message_id) is None
+        and store.get_channel(channel_id) is not None
+        and store.is_member(channel_id, scheduled.u_id)
+    ):
+        store.add_message(
+            Message(
+                channel_id=channel_id,
+                message_id=message_id,
+                u_id=scheduled.u_id,
+                message=scheduled.message,
+                time_created=time_sent,
+            )
+        )
+    store.remove_scheduled(message_id)
+
+
+def restore_scheduled():
+    """
+    Reschedule the messages that were waiting to be sent when the server
+    last stopped. Those that fell due meanwhile are sent straight away.
+    """
+    scheduled_sends.restore(
+        [
+            (scheduled.time_sent, scheduled.message_id, scheduled)
+            for scheduled in store.scheduled_list()
+        ]
+    )
+
+
+def sendlater_lag_stats():
+    """Return how late scheduled messages were sent compared to time_sent."""
+    return scheduled_sends.lag_stats()
+
+
+# Messages waiting to be sent by message_sendlater
+scheduled_sends = Scheduler(send_scheduled)
+
+
 def message_react(token, message_id, react_id):
     react_exceptions(token, message_id, react_id, True)
     u_id = auth_token(token)
-    find_message(message_id)["reacts"][0]["u_ids"].append(u_id)
+    message = find_message(message_id)
+    store.set_message_reacted(message, u_id, True)
     return {}
 
 
 def message_unreact(token, message_id, react_id):
     react_exceptions(token, message_id, react_id, False)
     u_id = auth_token(token)
-    find_message(message_id)["reacts"][0]["u_ids"].remove(u_id)
+    message = find_message(message_id)
+    store.set_message_reacted(message, u_id, False)
     return {}
 
 
 def message_pin(token, message_id):
     pin_exceptions(token, message_id, True)
-    find_message(message_id)["is_pinned"] = True
+    store.set_message_pinned(find_message(message_id), True)
     return {}
 
 
 def message_unpin(token, message_id):
     pin_exceptions(token, message_id, False)
-    find_message(message_id)["is_pinned"] = False
+    store.set_message_pinned(find_message(message_id), False)
     return {}
 
 
@@ -105,64 +264,53 @@ def react_exceptions(token, message_id, react_id, reacting):
     if react_id != 1:
         raise InputError("The react ID is invalid. Only valid react ID is 1.")
 
-    # A list of user's channel ids
-    channel_ids = [
-        channel["channel_id"] for channel in channels_list(token)["channels"]
-    ]
+    u_id = auth_token(token)
     message = find_message(message_id)
-    if message["channel_id"] not in channel_ids:
+    if not message or not store.is_member(message.channel_id, u_id):
         raise InputError(
             "The message_id is not a valid message within a channel user has joined."
         )
 
-    u_id = auth_token(token)
-    message = find_message(message_id)
     # Exceptions related to no reacts at all
-    if message["reacts"] == []:
+    if not message.reacts:
         if reacting:
             react_info = {"react_id": react_id, "u_ids": []}
-            message["reacts"].append(react_info)
+            message.reacts = [react_info]
         else:
             raise InputError("Message has no reacts.")  # an assumption made here
 
     # Exceptions related to user already reacted/unreacted to the message
-    if u_id in message["reacts"][0]["u_ids"] and reacting:
+    if u_id in message.reacts[0]["u_ids"] and reacting:
         raise InputError("User is currently reacted to the message.")
-    elif u_id not in message["reacts"][0]["u_ids"] and not reacting:
+    elif u_id not in message.reacts[0]["u_ids"] and not reacting:
         raise InputError("User is not currently reacted to the message.")
 
 
 def pin_exceptions(token, message_id, pinning):
+    u_id = auth_token(token)
     message = find_message(message_id)
-    channels = channels_list(token)["channels"]
-    # A list of user's channel ids
-    channel_ids = [channel["channel_id"] for channel in channels]
     if not message:
         raise InputError("Message ID given is not a valid message.")
-    elif message["channel_id"] not in channel_ids:
+    elif not store.is_member(message.channel_id, u_id):
         raise AccessError("User is not part of channel the message is in.")
 
     # Exceptions related to whether the msg is already pinned/unpinned
-    if not message["is_pinned"] and not pinning:
+    if not message.is_pinned and not pinning:
         raise InputError("Message is already unpinned.")
-    elif message["is_pinned"] and pinning:
+    elif message.is_pinned and pinning:
         raise InputError("Message is already pinned.")
 
-    u_id = auth_token(token)
-    permission_id = find_user(u_id)["permission_id"]
-    message_channel = find_channel(message["channel_id"])
-    owners = [owner["u_id"] for owner in message_channel["owner_members"]]
-    if u_id not in owners and permission_id != 1:
+    permission_id = find_user(u_id).permission_id
+    if not store.is_owner(message.channel_id, u_id) and permission_id != 1:
         raise AccessError("User is not an owner.")
 
 
 def check_user_message_perms(u_id, message):
     """Raise AccessError if user is lacks perms to modify a message."""
-    if message["u_id"] != u_id:
-        channel = find_channel(message["channel_id"])
+    if message.u_id != u_id:
         if (
-            not any(owner["u_id"] == u_id for owner in channel["owner_members"])
-            and find_user(u_id)["permission_id"] != 1
+            not store.is_owner(message.channel_id, u_id)
+            and find_user(u_id).permission_id != 1
         ):
             raise AccessError(
                 "Authorised user is not permitted \
@@ -172,11 +320,4 @@ def check_user_message_perms(u_id, message):
 
 def find_message(message_id):
     """Find message given message_id."""
-    return next(
-        (
-            message
-            for message in data["messages"]
-            if message["message_id"] == message_id
-        ),
-        False,
-    )
+    return store.get_message(message_id) or False
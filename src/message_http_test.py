@@ -187,3 +187,30 @@ def test_message_unpin_http(url, supply_user, supply_message):
     }
     requests.post(f"{url}/message/pin", json=data)
     assert requests.post(f"{url}/message/unpin", json=data).status_code == 200
+
+
+def test_message_send_batch_http(url, supply_user, supply_channel):
+    sent = requests.post(
+        f"{url}/message/send/batch",
+        json={
+            "token": supply_user["token"],
+            "messages": [
+                {"channel_id": supply_channel["channel_id"], "message": "first"},
+                {"channel_id": -1, "message": "nowhere"},
+                {"channel_id": supply_channel["channel_id"], "message": "second"},
+            ],
+        },
+    )
+    assert sent.status_code == 200
+    results = sent.json()["results"]
+    assert "message_id" in results[0] and "message_id" in results[2]
+    assert results[1]["error"]["name"] == "InputError"
+    messages = requests.get(
+        f"{url}/channel/messages",
+        params={
+            "token": supply_user["token"],
+            "channel_id": supply_channel["channel_id"],
+            "start": 0,
+        },
+    ).json()["messages"]
+    assert [message["message"] for message in messages] == ["second", "first"]
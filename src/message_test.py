@@ -103,6 +103,64 @@ def test_message_sendlater_invalid_time(supply_user, supply_channels):
         )
 
 
+def test_message_sendlater(supply_user, supply_channels):
+    channel_id = supply_channels["channel_id"]
+    now = int(time.time())
+    later = message_sendlater(supply_user["token"], channel_id, "Later", now)
+    sent = message_send(supply_user["token"], channel_id, "Now")
+    assert later["message_id"] < sent["message_id"]
+    for _ in range(100):
+        messages = channel_messages(supply_user["token"], channel_id, 0)["messages"]
+        if len(messages) == 2:
+            break
+        time.sleep(0.02)
+    assert {message["message_id"] for message in messages} == {
+        later["message_id"],
+        sent["message_id"],
+    }
+    assert message_sendlater_list(supply_user["token"]) == {"messages": []}
+
+
+def test_message_sendlater_cancel(supply_user, supply_channels):
+    channel_id = supply_channels["channel_id"]
+    time_sent = int(time.time()) + 3600
+    later = message_sendlater(supply_user["token"], channel_id, "Later", time_sent)
+    assert message_sendlater_list(supply_user["token"])["messages"] == [
+        {
+            "message_id": later["message_id"],
+            "channel_id": channel_id,
+            "message": "Later",
+            "time_sent": time_sent,
+        }
+    ]
+    new_user = auth_register("owner@gmail.com", "Password", "Owner", "Name")
+    assert message_sendlater_list(new_user["token"]) == {"messages": []}
+    with pytest.raises(AccessError):
+        message_sendlater_cancel(new_user["token"], later["message_id"])
+    message_sendlater_cancel(supply_user["token"], later["message_id"])
+    assert message_sendlater_list(supply_user["token"]) == {"messages": []}
+    with pytest.raises(InputError):
+        message_sendlater_cancel(supply_user["token"], later["message_id"])
+
+
+def test_message_sendlater_cancel_after_sent(supply_user, supply_channels, monkeypatch):
+    channel_id = supply_channels["channel_id"]
+    later = message_sendlater(
+        supply_user["token"], channel_id, "Later", int(time.time()) + 3600
+    )
+    get = scheduled_sends.get
+
+    def get_then_send(message_id):
+        # the job is taken to be sent just after it is looked up
+        job = get(message_id)
+        scheduled_sends.cancel(message_id)
+        return job
+
+    monkeypatch.setattr(scheduled_sends, "get", get_then_send)
+    with pytest.raises(InputError):
+        message_sendlater_cancel(supply_user["token"], later["message_id"])
+
+
 def test_message_react_invalid_react_id(supply_user, supply_channels):
     msg_id = message_send(
         supply_user["token"], supply_channels["channel_id"], "Some message"
@@ -219,3 +277,65 @@ def test_message_unpin_valid(supply_user, supply_channels):
     message_unpin(supply_user["token"], msg_id)
     with pytest.raises(InputError):
         message_unpin(supply_user["token"], msg_id)
+
+
+def test_message_send_batch(supply_user, supply_channels):
+    token = supply_user["token"]
+    channel_id = supply_channels["channel_id"]
+    other = auth_register("other@gmail.com", "Password#1", "Other", "User")
+    private_id = channels_create(other["token"], "private", False)["channel_id"]
+    results = message_send_batch(
+        token,
+        [
+            {"channel_id": channel_id, "message": "one"},
+            {"channel_id": private_id, "message": "not a member"},
+            {"channel_id": 999, "message": "no such channel"},
+            {"channel_id": channel_id, "message": "a" * 1001},
+            {"channel_id": channel_id},
+            {"channel_id": channel_id, "message": "two"},
+        ],
+    )["results"]
+    assert results[0]["message_id"] + 1 == results[5]["message_id"]
+    assert [result.get("error", {}).get("name") for result in results] == [
+        None,
+        "AccessError",
+        "InputError",
+        "InputError",
+        "InputError",
+        None,
+    ]
+    messages = channel_messages(token, channel_id, 0)["messages"]
+    assert [message["message"] for message in messages] == ["two", "one"]
+
+
+def test_message_send_batch_invalid(supply_user):
+    with pytest.raises(AccessError):
+        message_send_batch("not a token", [])
+    with pytest.raises(InputError):
+        message_send_batch(
+            supply_user["token"], [{"channel_id": 0, "message": "hi"}] * 1001
+        )
+    assert message_send_batch(supply_user["token"], []) == {"results": []}
+    with pytest.raises(InputError):
+        message_send_batch(supply_user["token"], {"channel_id": 0, "message": "hi"})
+
+
+def test_message_send_batch_malformed_items(supply_user, supply_channels):
+    token = supply_user["token"]
+    channel_id = supply_channels["channel_id"]
+    results = message_send_batch(
+        token,
+        [
+            {"channel_id": channel_id, "message": {"a": 1}},
+            {"channel_id": channel_id, "message": ["a"]},
+            {"channel_id": True, "message": "bool channel"},
+            {"channel_id": str(channel_id), "message": "str channel"},
+            "not an item",
+            {"channel_id": channel_id, "message": "hello again"},
+        ],
+    )["results"]
+    assert [result.get("error", {}).get("name") for result in results] == [
+        "InputError"
+    ] * 5 + [None]
+    messages = channel_messages(token, channel_id, 0)["messages"]
+    assert [message["message"] for message in messages] == ["hello again"]
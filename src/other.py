@@ -1,23 +1,31 @@
 """ File containing the functions clear(), users_all() and search()."""
-from data import data
-from auth import auth_token
-from channels import channels_list
+from auth import auth_token, token_cache_stats
+from cache import LRUCache
 from error import AccessError, InputError
+from message import scheduled_sends, sendlater_lag_stats
 from user import validate_user_id, find_user
-from data import data
-from auth import auth_token
-from channels import channels_list
+import events
+import search_pool
+import session
+import store
+
+# Most search results remembered at once
+SEARCH_CACHE_SIZE = 1024
+# (query, page, filters, (channel_id, version) of each channel searched)
+# -> search result. A change to a searched channel gives it a new version,
+# so results of the old one are never looked up again and age out.
+search_cache = LRUCache(SEARCH_CACHE_SIZE)
 
 
 def clear():
     """
     Clears all data stored in the project's data file.
     """
-    data["id"] = 0
-    data["users"][:] = []
-    data["sessions"][:] = []
-    data["messages"][:] = []
-    data["channels"][:] = []
+    store.clear()
+    session.clear()
+    search_cache.clear()
+    scheduled_sends.clear()
+    events.clear()
 
 
 def users_all(token):
@@ -28,13 +36,13 @@ def users_all(token):
     auth_token(token)
 
     users = []
-    for user in data["users"]:
+    for user in store.user_list():
         user_data = {
-            "u_id": user["u_id"],
-            "email": user["email"],
-            "name_first": user["name_first"],
-            "name_last": user["name_last"],
-            "handle_str": user["handle_str"],
+            "u_id": user.u_id,
+            "email": user.email,
+            "name_first": user.name_first,
+            "name_last": user.name_last,
+            "handle_str": user.handle_str,
         }
         users.append(user_data)
 
@@ -42,41 +50,170 @@ def users_all(token):
 
 
 # Assumption: Upper and Lower case letters are viewed as the same, does not affect the search
-def search(token, query_str):
+def search(
+    token,
+    query_str,
+    start=0,
+    limit=None,
+    cursor=None,
+    channel_ids=None,
+    author_id=None,
+    time_start=None,
+    time_end=None,
+    pinned=False,
+):
     """
     Return a list of messages (matching the query string) in all of
-    the channels the user has joined. In the list, each message is stored
-    in a dictionary containing the message_id, u_id, message, time_created.
+    the channels the user has joined, newest first. In the list, each message
+    is stored in a dictionary containing the message_id, u_id, message,
+    time_created. At most limit messages are returned (all if None), after
+    skipping start matches. cursor resumes the search after the last message
+    of an earlier page; the cursor for the next page is returned, or None
+    (with an end of -1) once there are no more matches.
+
+    The search can be narrowed to messages in channel_ids, sent by
+    author_id, created between time_start and time_end inclusive, or pinned.
     """
-    auth_token(token)
-    # Create a list of channel_ids of channels the user is in
-    channels = channels_list(token)["channels"]
-    channel_ids = [channel["channel_id"] for channel in channels]
-    messages = []
-
-    for message in data["messages"]:
-        if (
-            query_str.lower() in message["message"].lower()
-            and message["channel_id"] in channel_ids
-        ):
-            message_data = {
-                "message_id": message["message_id"],
-                "u_id": message["u_id"],
-                "message": message["message"],
-                "time_created": message["time_created"],
-            }
-            messages.append(message_data)
-    return {"messages": messages}
+    u_id = auth_token(token)
+    if start < 0:
+        raise InputError("start must not be negative.")
+    if limit is not None and limit < 1:
+        raise InputError("limit must be at least 1.")
+    # The channels the user is in, narrowed to those asked for
+    user_channel_ids = store.user_channel_ids(u_id)
+    if channel_ids is None:
+        channel_ids = user_channel_ids
+    else:
+        channel_ids = [
+            channel_id for channel_id in user_channel_ids if channel_id in channel_ids
+        ]
+    query_str = query_str.lower()
+    cache_key = (
+        query_str,
+        start,
+        limit,
+        cursor,
+        author_id,
+        time_start,
+        time_end,
+        pinned,
+        tuple(
+            (channel_id, store.channel_version(channel_id))
+            for channel_id in channel_ids
+        ),
+    )
+    result = search_cache.get(cache_key)
+    if result is not None:
+        return result
+
+    before = None if cursor is None else parse_cursor(cursor)
+    candidates = store.search_candidates(query_str)
+    covered = sum(store.channel_message_count(channel_id) for channel_id in channel_ids)
+
+    # the index only narrows the search; confirm each candidate matches,
+    # newest first, until the page and one more match have been found
+    wanted = None if limit is None else start + limit + 1
+    matches = None
+    if (
+        search_pool.is_running()
+        and covered >= search_pool.PARALLEL_THRESHOLD
+        and (candidates is None or len(candidates) >= search_pool.PARALLEL_THRESHOLD)
+    ):
+        # the workers walk their own channels, so only the filters are sent
+        keys = search_pool.search(
+            query_str,
+            channel_ids,
+            u_id=author_id,
+            since=time_start,
+            until=time_end,
+            pinned=pinned,
+            before=before,
+            wanted=wanted,
+        )
+        # None if the pool was stopped after it was checked
+        if keys is not None:
+            matches = [store.get_message(key[1]) for key in keys]
+    if matches is None:
+        keys = store.newest_message_keys(
+            channel_ids=channel_ids,
+            u_id=author_id,
+            since=time_start,
+            until=time_end,
+            pinned=pinned,
+            candidates=candidates,
+            before=before,
+        )
+        matches = []
+        for key in keys:
+            message = store.get_message(key[1])
+            if query_str in message.message.lower():
+                matches.append(message)
+                if len(matches) == wanted:
+                    break
+
+    page = matches[start:] if limit is None else matches[start : start + limit]
+    messages = [
+        {
+            "message_id": message.message_id,
+            "u_id": message.u_id,
+            "message": message.message,
+            "time_created": message.time_created,
+        }
+        for message in page
+    ]
+    more = wanted is not None and len(matches) == wanted
+    result = {
+        "messages": messages,
+        "start": start,
+        "end": start + limit if more else -1,
+        "cursor": make_cursor(page[-1]) if more else None,
+    }
+    search_cache.put(cache_key, result)
+    return result
+
+
+def search_cache_stats():
+    """Return hit/miss counters for the search result cache."""
+    return search_cache.stats()
+
+
+def make_cursor(message):
+    """Return a search cursor positioned after message."""
+    return f"{message.time_created}:{message.message_id}"
+
+
+def parse_cursor(cursor):
+    """Return the recency key a search cursor resumes before."""
+    try:
+        time_created, message_id = cursor.split(":")
+        return (int(time_created), int(message_id))
+    except (AttributeError, ValueError):
+        raise InputError("cursor is invalid.") from None
 
 
 def admin_userpermission_change(token, u_id, permission_id):
     token_id = auth_token(token)
-    if find_user(token_id)["permission_id"] == 1:
+    if find_user(token_id).permission_id == 1:
         if permission_id in [1, 2]:
             validate_user_id(u_id)
             user = find_user(u_id)
-            user["permission_id"] = permission_id
+            user.permission_id = permission_id
+            store.save_user(user)
         else:
             raise InputError("permission_id is invalid.")
     else:
         raise AccessError("The authorised user is not an owner.")
+
+
+def server_stats(token):
+    """
+    Return the counters the server keeps on itself: hits and misses of the
+    verified token and search result caches, and how late scheduled
+    messages were sent.
+    """
+    auth_token(token)
+    return {
+        "token_cache": token_cache_stats(),
+        "search_cache": search_cache_stats(),
+        "sendlater_lag": sendlater_lag_stats(),
+    }
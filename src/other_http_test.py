@@ -115,3 +115,26 @@ def test_search_messages_found_http(url, supply_user1):
     assert message_req.status_code == 200
     messages_list = message_req.json()["messages"]
     assert len(messages_list) == 2
+
+    # Paging through the results one at a time, newest first
+    params = {"token": supply_user1["token"], "query_str": "message", "limit": 1}
+    first_page = requests.get(f"{url}/search", params=params).json()
+    assert first_page["messages"][0]["message"] == "Last message"
+    params["cursor"] = first_page["cursor"]
+    second_page = requests.get(f"{url}/search", params=params).json()
+    assert second_page["messages"][0]["message"] == "This is a message"
+    assert second_page["end"] == -1
+
+
+def test_stats_http(url, supply_user1):
+    """ Read the server's cache and scheduled message counters. """
+    params = {"token": supply_user1["token"]}
+    first = requests.get(f"{url}/stats", params=params).json()
+    stats_req = requests.get(f"{url}/stats", params=params)
+    assert stats_req.status_code == 200
+    stats = stats_req.json()
+    assert set(stats) == {"token_cache", "search_cache", "sendlater_lag"}
+    assert stats["token_cache"]["hits"] > first["token_cache"]["hits"]
+
+    stats_req = requests.get(f"{url}/stats", params={"token": "invalid_token"})
+    assert stats_req.status_code == 400
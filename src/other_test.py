@@ -5,10 +5,11 @@ The functions are users_all and search.
 
 import pytest
 from other import clear, search, users_all, admin_userpermission_change
+from other import search_cache_stats, server_stats
 from auth import auth_register
 from channels import channels_create
 from channel import channel_join
-from message import message_send
+from message import message_send, message_edit, message_remove, message_pin
 from error import AccessError, InputError
 
 
@@ -174,6 +175,117 @@ def test_messages_from_only_joined(supply_user1, supply_user2):
     assert messages_found[0]["u_id"] == supply_user1["u_id"]
 
 
+def test_search_after_edit_and_remove(supply_user1):
+    """ Test that search reflects messages edited or removed after sending. """
+    channel_id = channels_create(supply_user1["token"], "channel", True)["channel_id"]
+    first = message_send(supply_user1["token"], channel_id, "Lunch at noon?")
+    second = message_send(supply_user1["token"], channel_id, "Lunch is late.")
+    message_send(supply_user1["token"], channel_id, "Sure, see you then.")
+    assert len(search(supply_user1["token"], "lunch")["messages"]) == 2
+
+    message_edit(supply_user1["token"], first["message_id"], "Dinner at six?")
+    message_remove(supply_user1["token"], second["message_id"])
+    assert search(supply_user1["token"], "lunch")["messages"] == []
+    messages_found = search(supply_user1["token"], "r at S")["messages"]
+    assert [message["message"] for message in messages_found] == ["Dinner at six?"]
+    assert len(search(supply_user1["token"], "?")["messages"]) == 1
+
+
+def test_search_pages_newest_first(supply_user1):
+    """ Test that search pages through matches newest first. """
+    channel_id = channels_create(supply_user1["token"], "channel", True)["channel_id"]
+    for i in range(7):
+        message_send(supply_user1["token"], channel_id, f"standup {i}")
+    message_send(supply_user1["token"], channel_id, "unrelated")
+
+    everything = search(supply_user1["token"], "standup")
+    assert [message["message"] for message in everything["messages"]] == [
+        f"standup {i}" for i in range(6, -1, -1)
+    ]
+    assert everything["end"] == -1 and everything["cursor"] is None
+
+    page = search(supply_user1["token"], "standup", start=1, limit=3)
+    assert [message["message"] for message in page["messages"]] == [
+        "standup 5",
+        "standup 4",
+        "standup 3",
+    ]
+    assert page["end"] == 4
+
+    page = search(supply_user1["token"], "standup", cursor=page["cursor"], limit=3)
+    assert [message["message"] for message in page["messages"]] == [
+        "standup 2",
+        "standup 1",
+        "standup 0",
+    ]
+    assert page["end"] == -1 and page["cursor"] is None
+
+
+def test_search_filters(supply_user1, supply_user2):
+    """ Test that search can be narrowed by channel, author, time and pins. """
+    channel1 = channels_create(supply_user1["token"], "channel1", True)["channel_id"]
+    channel2 = channels_create(supply_user1["token"], "channel2", True)["channel_id"]
+    channel3 = channels_create(supply_user2["token"], "channel3", True)["channel_id"]
+    channel_join(supply_user2["token"], channel1)
+    first = message_send(supply_user1["token"], channel1, "deploy at 5")
+    second = message_send(supply_user2["token"], channel1, "deploy done")
+    third = message_send(supply_user1["token"], channel2, "deploy failed")
+    message_send(supply_user2["token"], channel3, "deploy elsewhere")
+    message_pin(supply_user1["token"], third["message_id"])
+
+    def found(**filters):
+        messages = search(supply_user1["token"], "deploy", **filters)["messages"]
+        return [message["message_id"] for message in messages]
+
+    assert found() == [third["message_id"], second["message_id"], first["message_id"]]
+    assert found(channel_ids=[channel1]) == [second["message_id"], first["message_id"]]
+    assert found(channel_ids=[channel3]) == []
+    assert found(author_id=supply_user1["u_id"]) == [
+        third["message_id"],
+        first["message_id"],
+    ]
+    assert found(author_id=supply_user2["u_id"], channel_ids=[channel2]) == []
+    assert found(pinned=True) == [third["message_id"]]
+    assert found(time_start=0, time_end=1) == []
+    assert len(found(time_start=0)) == 3
+
+
+def test_search_cache(supply_user1, supply_user2):
+    """ Test that repeated searches are cached until a searched channel changes. """
+    channel1 = channels_create(supply_user1["token"], "channel1", True)["channel_id"]
+    channel2 = channels_create(supply_user2["token"], "channel2", True)["channel_id"]
+    message_send(supply_user1["token"], channel1, "incident opened")
+    first = search(supply_user1["token"], "incident")
+    hits = search_cache_stats()["hits"]
+    assert search(supply_user1["token"], "Incident") == first
+    assert search_cache_stats()["hits"] == hits + 1
+
+    # a message in a channel the search does not cover keeps the result
+    message_send(supply_user2["token"], channel2, "incident elsewhere")
+    search(supply_user1["token"], "incident")
+    assert search_cache_stats()["hits"] == hits + 2
+
+    # joining a channel changes the channels searched
+    channel_join(supply_user1["token"], channel2)
+    assert len(search(supply_user1["token"], "incident")["messages"]) == 2
+    assert search_cache_stats()["hits"] == hits + 2
+
+    # as does a change to a message in a searched channel
+    message_send(supply_user1["token"], channel1, "incident closed")
+    assert len(search(supply_user1["token"], "incident")["messages"]) == 3
+    assert search_cache_stats()["hits"] == hits + 2
+
+
+def test_search_invalid_page(supply_user1):
+    """ Test that search rejects a bad start, limit or cursor. """
+    with pytest.raises(InputError):
+        search(supply_user1["token"], "message", start=-1)
+    with pytest.raises(InputError):
+        search(supply_user1["token"], "message", limit=0)
+    with pytest.raises(InputError):
+        search(supply_user1["token"], "message", cursor="not a cursor")
+
+
 # ===============================================================
 
 # Testing admin_userpermission_change
@@ -213,3 +325,20 @@ def test_admin_valid_inputs(supply_user1, supply_user2):
         "channel_id"
     ]
     channel_join(supply_user1["token"], channel_id)
+
+
+def test_server_stats(supply_user1):
+    """ Test that the server's counters count token and search lookups. """
+    before = server_stats(supply_user1["token"])
+    search(supply_user1["token"], "anything")
+    search(supply_user1["token"], "anything")
+    after = server_stats(supply_user1["token"])
+    assert after["token_cache"]["hits"] > before["token_cache"]["hits"]
+    assert after["search_cache"]["hits"] == before["search_cache"]["hits"] + 1
+    assert set(after["sendlater_lag"]) == {"count", "mean", "max", "p50", "p99"}
+
+
+def test_server_stats_invalid_token(supply_user1):
+    """ Test that only a logged in user can read the server's counters. """
+    with pytest.raises(AccessError):
+        server_stats("invalid_token")
@@ -0,0 +1,264 @@
+"""
+Durability for the in-memory data store. Every change to data.py is
+appended to a write-ahead log as the new state of the entity it touched,
+so replaying the log in order is idempotent. A background thread writes
+the log out in batches and fsyncs once per batch (group commit), and
+periodically writes a compacted snapshot of the whole store in the
+binary format of snapshot.py. Recovery maps the latest snapshot and
+replays only the log written after it.
+
+Persistence is off until open_store() is called with a directory, so the
+record_* functions cost nothing when nothing is being persisted.
+"""
+import json
+import os
+import threading
+import time
+from data import data
+import snapshot as snapshot_format
+from records import Channel, Message, ScheduledMessage, Session, User, to_dict
+
+# Seconds the flusher waits to gather a batch before writing it out
+FLUSH_INTERVAL = 0.005
+# Records in the buffer that trigger a flush without waiting
+FLUSH_BATCH_SIZE = 512
+# If True, a write returns only once its record has been fsynced
+SYNC_COMMIT = False
+# Seconds between snapshots, and the records needed since the last one
+SNAPSHOT_INTERVAL = 300
+SNAPSHOT_MIN_RECORDS = 10000
+
+SNAPSHOT_FILE = "snapshot.bin"
+LOG_PREFIX = "wal-"
+LOG_SUFFIX = ".log"
+
+# The record type stored under each kind of entity
+RECORD_TYPES = {
+    "users": User,
+    "sessions": Session,
+    "channels": Channel,
+    "messages": Message,
+    "scheduled": ScheduledMessage,
+}
+
+# The open log, or None while persistence is off
+wal = None
+
+
+class WriteAheadLog:
+    """An append-only, segmented log of store mutations."""
+
+    def __init__(self, directory, lsn):
+        self.directory = directory
+        self.lsn = lsn
+        self.durable_lsn = lsn
+        self.snapshot_lsn = lsn
+        self.buffer = []
+        self.closed = False
+        # lock guards the buffer and counters, io_lock the segment file
+        self.lock = threading.Lock()
+        self.io_lock = threading.RLock()
+        self.flushed = threading.Condition(self.lock)
+        self.pending = threading.Condition(self.lock)
+        self.segment = self.open_segment(lsn + 1)
+        threading.Thread(
+            target=self.flush_loop, name="wal-flusher", daemon=True
+        ).start()
+        threading.Thread(
+            target=self.snapshot_loop, name="wal-snapshotter", daemon=True
+        ).start()
+
+    def open_segment(self, first_lsn):
+        """Open a new log segment whose first record will be first_lsn."""
+        name = f"{LOG_PREFIX}{first_lsn:012d}{LOG_SUFFIX}"
+        return open(os.path.join(self.directory, name), "ab")
+
+    def append(self, record):
+        """
+        Buffer a record, returning once it is durable if SYNC_COMMIT is set.
+        Entities in the record are serialised under the lock that orders the
+        log, so when two changes to one entity race, the copy logged last is
+        the later state.
+        """
+        with self.lock:
+            self.lsn += 1
+            record["lsn"] = self.lsn
+            self.buffer.append(json.dumps(record, default=to_dict).encode() + b"\n")
+            lsn = self.lsn
+            if len(self.buffer) >= FLUSH_BATCH_SIZE:
+                self.pending.notify()
+            if SYNC_COMMIT:
+                while self.durable_lsn < lsn and not self.closed:
+                    self.flushed.wait()
+        return lsn
+
+    def flush(self):
+        """Write out and fsync every record appended so far."""
+        with self.io_lock:
+            with self.lock:
+                batch, self.buffer = self.buffer, []
+                lsn = self.lsn
+            self.write_batch(batch, lsn)
+
+    def write_batch(self, batch, lsn):
+        """Write and fsync a batch ending at lsn. The caller holds io_lock."""
+        if batch:
+            self.segment.write(b"".join(batch))
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+        with self.lock:
+            self.durable_lsn = max(self.durable_lsn, lsn)
+            self.flushed.notify_all()
+
+    def flush_loop(self):
+        """Flush a batch every FLUSH_INTERVAL, or sooner once one is full."""
+        while not self.closed:
+            with self.lock:
+                if len(self.buffer) < FLUSH_BATCH_SIZE:
+                    self.pending.wait(FLUSH_INTERVAL)
+            self.flush()
+
+    def snapshot_loop(self):
+        """Take a snapshot every SNAPSHOT_INTERVAL if enough has changed."""
+        while not self.closed:
+            time.sleep(SNAPSHOT_INTERVAL)
+            changed = self.lsn - self.snapshot_lsn
+            if not self.closed and changed >= SNAPSHOT_MIN_RECORDS:
+                self.snapshot()
+
+    def snapshot(self):
+        """
+        Write a snapshot of the store and drop the log segments it covers.
+        The log rolls over to a new segment at the snapshot point, so every
+        record after the snapshot is in a segment that is kept. Changes made
+        while the snapshot is written are logged after it and replayed.
+        """
+        with self.io_lock:
+            with self.lock:
+                batch, self.buffer = self.buffer, []
+                lsn = self.lsn
+                state = copy_state()
+            self.write_batch(batch, lsn)
+            self.segment.close()
+            self.segment = self.open_segment(lsn + 1)
+        snapshot_format.write(os.path.join(self.directory, SNAPSHOT_FILE), lsn, state)
+        self.snapshot_lsn = lsn
+        for name, first_lsn in log_segments(self.directory):
+            if first_lsn <= lsn:
+                os.remove(os.path.join(self.directory, name))
+        return lsn
+
+    def close(self):
+        """Flush everything still buffered and stop the background threads."""
+        with self.io_lock:
+            self.flush()
+            with self.lock:
+                self.closed = True
+                self.pending.notify()
+                self.flushed.notify_all()
+            self.segment.close()
+
+
+def open_store(directory):
+    """
+    Recover data.py from the snapshot and log in directory, then start
+    logging changes there. Callers rebuild the derived indexes afterwards.
+    """
+    global wal
+    os.makedirs(directory, exist_ok=True)
+    lsn = recover(directory)
+    wal = WriteAheadLog(directory, lsn)
+    return lsn
+
+
+def close_store():
+    """Flush and close the log, turning persistence off."""
+    global wal
+    if wal is not None:
+        wal.close()
+        wal = None
+
+
+def snapshot():
+    """Take a snapshot now. Return its lsn, or None if persistence is off."""
+    if wal is None:
+        return None
+    return wal.snapshot()
+
+
+def record_put(kind, key, value):
+    """Log the new state of data[kind][key], or of data[kind] if key is None."""
+    if wal is not None:
+        wal.append({"op": "put", "kind": kind, "key": key, "value": value})
+
+
+def record_delete(kind, key):
+    """Log the removal of data[kind][key]."""
+    if wal is not None:
+        wal.append({"op": "del", "kind": kind, "key": key})
+
+
+def record_clear():
+    """Log that every entity was removed."""
+    if wal is not None:
+        wal.append({"op": "clear"})
+
+
+def apply(record):
+    """Redo one logged change against data.py."""
+    if record["op"] == "clear":
+        data["id"] = 0
+        for kind in RECORD_TYPES:
+            data[kind].clear()
+    elif record["key"] is None:
+        data[record["kind"]] = record["value"]
+    elif record["op"] == "put":
+        value = RECORD_TYPES[record["kind"]].from_dict(record["value"])
+        data[record["kind"]][record["key"]] = value
+    else:
+        data[record["kind"]].pop(record["key"], None)
+
+
+def copy_state():
+    """
+    Capture data.py for a snapshot. Entities are written out later, so this
+    only copies the maps' contents and is cheap enough to hold the log lock.
+    """
+    return {
+        "id": data["id"],
+        "users": list(data["users"].values()),
+        "sessions": list(data["sessions"].values()),
+        "channels": list(data["channels"].values()),
+        "messages": snapshot_format.freeze_messages(data["messages"]),
+        "scheduled": list(data["scheduled"].values()),
+    }
+
+
+def log_segments(directory):
+    """Return (file name, first lsn) of every log segment, oldest first."""
+    segments = [
+        (name, int(name[len(LOG_PREFIX) : -len(LOG_SUFFIX)]))
+        for name in os.listdir(directory)
+        if name.startswith(LOG_PREFIX) and name.endswith(LOG_SUFFIX)
+    ]
+    return sorted(segments, key=lambda segment: segment[1])
+
+
+def recover(directory):
+    """Load the latest snapshot, replay the log after it and return the last lsn."""
+    lsn = 0
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if os.path.exists(path):
+        lsn = snapshot_format.load(path, data)
+    for name, _ in log_segments(directory):
+        with open(os.path.join(directory, name), "rb") as segment:
+            for line in segment:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn write at the end of the log from a crash
+                    break
+                if record["lsn"] > lsn:
+                    apply(record)
+                    lsn = record["lsn"]
+    return lsn
@@ -0,0 +1,144 @@
+import os
+import time
+import pytest
+from auth import auth_register, auth_token
+from channel import channel_messages
+from channels import channels_create
+from message import message_send, message_edit, message_sendlater
+from message import message_sendlater_list, restore_scheduled, sendlater_lag_stats
+from other import clear
+import persist
+from records import ScheduledMessage
+import session
+import store
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    clear()
+    persist.open_store(str(tmp_path))
+    yield str(tmp_path)
+    persist.close_store()
+    clear()
+
+
+def restart(directory):
+    """Drop everything held in memory and recover it from directory."""
+    persist.close_store()
+    clear()
+    persist.open_store(directory)
+    store.rebuild()
+    session.rebuild()
+
+
+def test_persist_recovers_from_log(data_dir):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_id = channels_create(user["token"], "A", True)["channel_id"]
+    message_id = message_send(user["token"], channel_id, "Test")["message_id"]
+    message_edit(user["token"], message_id, "Tset")
+
+    restart(data_dir)
+    assert auth_token(user["token"]) == user["u_id"]
+    messages = channel_messages(user["token"], channel_id, 0)["messages"]
+    assert [message["message"] for message in messages] == ["Tset"]
+    assert message_send(user["token"], channel_id, "New")["message_id"] > message_id
+
+
+def test_persist_snapshot_then_replay_tail(data_dir):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_id = channels_create(user["token"], "A", True)["channel_id"]
+    message_send(user["token"], channel_id, "Before")
+    lsn = persist.snapshot()
+    message_send(user["token"], channel_id, "After")
+
+    segments = persist.log_segments(data_dir)
+    assert all(first_lsn > lsn for _, first_lsn in segments)
+    assert os.path.exists(os.path.join(data_dir, persist.SNAPSHOT_FILE))
+
+    restart(data_dir)
+    messages = channel_messages(user["token"], channel_id, 0)["messages"]
+    assert [message["message"] for message in messages] == ["After", "Before"]
+
+
+def test_persist_scheduled_messages(data_dir):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_id = channels_create(user["token"], "A", True)["channel_id"]
+    time_sent = int(time.time()) + 3600
+    later = message_sendlater(user["token"], channel_id, "Later", time_sent)
+    persist.snapshot()
+    # messages that fell due while the server was down
+    overdue = [store.next_id() for _ in range(3)]
+    for i, message_id in enumerate(overdue):
+        store.add_scheduled(
+            ScheduledMessage(
+                message_id,
+                channel_id,
+                user["u_id"],
+                f"Late {i}",
+                int(time.time()) - 5 + i,
+            )
+        )
+
+    restart(data_dir)
+    count = sendlater_lag_stats()["count"]
+    restore_scheduled()
+    for _ in range(100):
+        messages = channel_messages(user["token"], channel_id, 0)["messages"]
+        if len(messages) == 3:
+            break
+        time.sleep(0.02)
+    assert [message["message"] for message in messages] == [
+        "Late 2",
+        "Late 1",
+        "Late 0",
+    ]
+    assert sendlater_lag_stats()["count"] == count + 3
+    assert sendlater_lag_stats()["max"] >= 3
+    pending = message_sendlater_list(user["token"])["messages"]
+    assert [message["message_id"] for message in pending] == [later["message_id"]]
+
+    restart(data_dir)
+    assert [scheduled.message_id for scheduled in store.scheduled_list()] == [
+        later["message_id"]
+    ]
+
+
+def test_persist_ignores_torn_write(data_dir):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    persist.close_store()
+    name, _ = persist.log_segments(data_dir)[-1]
+    with open(os.path.join(data_dir, name), "ab") as segment:
+        segment.write(b'{"op": "put", "kind"')
+
+    clear()
+    persist.open_store(data_dir)
+    store.rebuild()
+    assert store.get_user(user["u_id"])["email"] == "validemail@gmail.com"
+
+
+def test_persist_serialises_entities_in_log_order(data_dir, monkeypatch):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_id = channels_create(user["token"], "A", True)["channel_id"]
+    message_id = message_send(user["token"], channel_id, "Test")["message_id"]
+    message = store.get_message(message_id)
+    serialise = type(message).to_dict
+    held = []
+
+    def to_dict(record):
+        held.append(persist.wal.lock.locked())
+        return serialise(record)
+
+    monkeypatch.setattr(type(message), "to_dict", to_dict)
+    store.save_message(message)
+    assert held == [True]
+
+
+def test_persist_recovers_session_use(data_dir, monkeypatch):
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    login = time.time()
+    # used just before it would have gone idle, long after logging in
+    monkeypatch.setattr(session.time, "time", lambda: login + session.IDLE_TTL - 1)
+    auth_token(user["token"])
+    monkeypatch.setattr(session.time, "time", lambda: login + session.IDLE_TTL + 1)
+    restart(data_dir)
+    assert auth_token(user["token"]) == user["u_id"]
@@ -0,0 +1,157 @@
+"""
+Slotted record types for the entities held in data.py. A record stores its
+fields in fixed slots instead of a per-instance dict, which keeps millions
+of messages far smaller in memory. Records are turned back into the dict
+shapes of the interface by to_dict(), which server.py applies to whatever
+a route returns. Fields can also be read as record["field"] so code that
+treats an entity as a read-only mapping keeps working.
+"""
+
+
+class Record:
+    """Base class giving records dict conversion, equality and repr."""
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """Return the record in its dict shape."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, fields):
+        """Build a record from its dict shape."""
+        return cls(**fields)
+
+    def __getitem__(self, field):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class User(Record):
+    """A registered user."""
+
+    __slots__ = (
+        "u_id",
+        "email",
+        "password",
+        "name_first",
+        "name_last",
+        "handle_str",
+        "permission_id",
+    )
+
+    def __init__(
+        self, u_id, email, password, name_first, name_last, handle_str, permission_id
+    ):
+        self.u_id = u_id
+        self.email = email
+        self.password = password
+        self.name_first = name_first
+        self.name_last = name_last
+        self.handle_str = handle_str
+        self.permission_id = permission_id
+
+    def member_details(self):
+        """Return the user as an entry of a channel's member lists."""
+        return {
+            "u_id": self.u_id,
+            "name_first": self.name_first,
+            "name_last": self.name_last,
+        }
+
+
+class Channel(Record):
+    """A channel and the details of its owners and members."""
+
+    __slots__ = ("channel_id", "name", "is_public", "owner_members", "all_members")
+
+    def __init__(self, channel_id, name, is_public, owner_members, all_members):
+        self.channel_id = channel_id
+        self.name = name
+        self.is_public = is_public
+        self.owner_members = owner_members
+        self.all_members = all_members
+
+
+class Message(Record):
+    """
+    A message sent to a channel. reacts is an empty tuple until the message
+    is first reacted to, so unreacted messages carry no list of their own.
+    """
+
+    __slots__ = (
+        "channel_id",
+        "message_id",
+        "u_id",
+        "message",
+        "time_created",
+        "reacts",
+        "is_pinned",
+    )
+
+    def __init__(
+        self,
+        channel_id,
+        message_id,
+        u_id,
+        message,
+        time_created,
+        reacts=(),
+        is_pinned=False,
+    ):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.u_id = u_id
+        self.message = message
+        self.time_created = time_created
+        self.reacts = reacts
+        self.is_pinned = is_pinned
+
+    def to_dict(self):
+        fields = super().to_dict()
+        fields["reacts"] = [
+            {"react_id": react["react_id"], "u_ids": list(react["u_ids"])}
+            for react in self.reacts
+        ]
+        return fields
+
+
+class ScheduledMessage(Record):
+    """A message waiting to be sent by message_sendlater at time_sent."""
+
+    __slots__ = ("message_id", "channel_id", "u_id", "message", "time_sent")
+
+    def __init__(self, message_id, channel_id, u_id, message, time_sent):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.u_id = u_id
+        self.message = message
+        self.time_sent = time_sent
+
+
+class Session(Record):
+    """A logged in session and when it was started and last used."""
+
+    __slots__ = ("token", "u_id", "created", "last_used")
+
+    def __init__(self, token, u_id, created, last_used):
+        self.token = token
+        self.u_id = u_id
+        self.created = created
+        self.last_used = last_used
+
+
+def to_dict(value):
+    """json.dumps default hook: serialise records to their dict shapes."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,43 @@
+""" Tests for the slotted record types."""
+import json
+import pytest
+from records import Channel, Message, Session, User, to_dict
+
+
+def test_user_round_trip():
+    user = User(0, "a@b.com", "hash", "First", "Last", "firstlast", 1)
+    assert User.from_dict(user.to_dict()) == user
+    assert user["handle_str"] == "firstlast"
+    assert user.member_details() == {
+        "u_id": 0,
+        "name_first": "First",
+        "name_last": "Last",
+    }
+    with pytest.raises(KeyError):
+        user["missing"]
+
+
+def test_records_have_no_instance_dict():
+    message = Message(1, 2, 0, "Hello", 100)
+    assert not hasattr(message, "__dict__")
+    with pytest.raises(AttributeError):
+        message.extra = True
+
+
+def test_message_reacts_start_empty():
+    message = Message(1, 2, 0, "Hello", 100)
+    assert message.reacts == ()
+    assert message.to_dict()["reacts"] == []
+    message.reacts = [{"react_id": 1, "u_ids": [0]}]
+    assert Message.from_dict(message.to_dict()) == message
+
+
+def test_records_serialise_to_json():
+    channel = Channel(1, "general", True, [], [])
+    session = Session("token", 0, 10.0, 20.0)
+    assert json.loads(json.dumps([channel, session], default=to_dict)) == [
+        channel.to_dict(),
+        session.to_dict(),
+    ]
+    with pytest.raises(TypeError):
+        json.dumps(object(), default=to_dict)
@@ -0,0 +1,178 @@
+"""
+A scheduler that runs jobs at given times. Jobs wait in a min-heap of due
+times watched by a single thread, which hands each job to a bounded pool
+of worker threads when it falls due, so scheduling many jobs costs a heap
+entry each rather than a sleeping thread each.
+
+A job is a key and a payload; when it is due the scheduler's handler is
+called with both and the time it was due. Cancelled jobs are dropped from
+the heap lazily, when they reach its top.
+
+Jobs restored after a restart that were due while the server was down are
+run in due order by a separate, smaller pool, so a backlog is worked off
+without holding up jobs falling due now. How late each job runs compared
+to when it was due is recorded for lag_stats().
+"""
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads that run due jobs, and that catch up on overdue ones
+WORKERS = 4
+CATCH_UP_WORKERS = 1
+# Most recent lags kept for the percentiles of lag_stats()
+LAG_SAMPLES = 1024
+
+
+class Scheduler:
+    """Run handler(key, payload, due) for each scheduled job once it is due."""
+
+    def __init__(self, handler, workers=WORKERS):
+        self.handler = handler
+        self.workers = workers
+        # (due, sequence number, key) of every job, earliest first
+        self.heap = []
+        # key -> (due, sequence number, payload) of every pending job
+        self.jobs = {}
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.thread = None
+        self.pool = None
+        self.catch_up_pool = None
+        # seconds between when recent jobs were due and when they ran
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def start(self):
+        """Start the scheduler thread and worker pool if not yet running."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="scheduler-worker"
+            )
+            self.thread = threading.Thread(
+                target=self.run, name="scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def schedule(self, due, key, payload):
+        """Run the job key with payload at the unix time due."""
+        self.start()
+        with self.lock:
+            self.sequence += 1
+            self.jobs[key] = (due, self.sequence, payload)
+            heapq.heappush(self.heap, (due, self.sequence, key))
+            self.changed.notify()
+
+    def restore(self, jobs):
+        """
+        Reschedule (due, key, payload) jobs kept from before a restart. Jobs
+        already due are run in due order by the catch-up pool.
+        """
+        self.start()
+        now = time.time()
+        overdue = []
+        for due, key, payload in sorted(jobs, key=lambda job: job[0]):
+            if due > now:
+                self.schedule(due, key, payload)
+                continue
+            with self.lock:
+                self.sequence += 1
+                self.jobs[key] = (due, self.sequence, payload)
+                overdue.append((key, self.sequence))
+        with self.lock:
+            if self.catch_up_pool is None:
+                self.catch_up_pool = ThreadPoolExecutor(
+                    max_workers=CATCH_UP_WORKERS,
+                    thread_name_prefix="scheduler-catch-up",
+                )
+        for key, sequence in overdue:
+            self.catch_up_pool.submit(self.catch_up, key, sequence)
+
+    def catch_up(self, key, sequence):
+        """Run a restored overdue job unless it was cancelled meanwhile."""
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None or job[1] != sequence:
+                return
+            del self.jobs[key]
+        self.run_job(key, job[2], job[0])
+
+    def run_job(self, key, payload, due):
+        """Record how late a job is and run it."""
+        lag = max(time.time() - due, 0.0)
+        with self.lock:
+            self.lags.append(lag)
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        self.handler(key, payload, due)
+
+    def lag_stats(self):
+        """Return counters of how late jobs ran compared to when they were due."""
+        with self.lock:
+            lags = sorted(self.lags)
+            count, total, worst = self.lag_count, self.lag_total, self.lag_max
+
+        def percentile(fraction):
+            return lags[min(int(len(lags) * fraction), len(lags) - 1)] if lags else 0.0
+
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "max": worst,
+            "p50": percentile(0.5),
+            "p99": percentile(0.99),
+        }
+
+    def cancel(self, key):
+        """Cancel a pending job. Return False if it is not pending."""
+        with self.lock:
+            return self.jobs.pop(key, None) is not None
+
+    def get(self, key):
+        """Return (due, payload) of a pending job, or None if it is not pending."""
+        with self.lock:
+            job = self.jobs.get(key)
+        return None if job is None else (job[0], job[2])
+
+    def pending(self):
+        """Return (due, key, payload) of every pending job, earliest first."""
+        with self.lock:
+            jobs = [(due, key, payload) for key, (due, _, payload) in self.jobs.items()]
+        return sorted(jobs, key=lambda job: job[0])
+
+    def clear(self):
+        """Cancel every pending job."""
+        with self.lock:
+            self.jobs.clear()
+            self.heap.clear()
+
+    def run(self):
+        """Wait for the earliest job to fall due and dispatch it."""
+        while True:
+            with self.lock:
+                while True:
+                    if not self.heap:
+                        self.changed.wait()
+                        continue
+                    due, sequence, key = self.heap[0]
+                    job = self.jobs.get(key)
+                    if job is None or job[1] != sequence:
+                        # cancelled or rescheduled since it was pushed
+                        heapq.heappop(self.heap)
+                        continue
+                    delay = due - time.time()
+                    if delay > 0:
+                        self.changed.wait(delay)
+                        continue
+                    heapq.heappop(self.heap)
+                    del self.jobs[key]
+                    break
+            self.pool.submit(self.run_job, key, job[2], due)
@@ -0,0 +1,38 @@
+import threading
+import time
+from scheduler import Scheduler
+
+
+def test_scheduler_runs_jobs_in_due_order():
+    ran = []
+    done = threading.Event()
+
+    def handler(key, payload, due):
+        ran.append((key, payload))
+        if len(ran) == 3:
+            done.set()
+
+    scheduler = Scheduler(handler, workers=1)
+    now = time.time()
+    scheduler.schedule(now + 0.2, "c", 3)
+    scheduler.schedule(now, "a", 1)
+    scheduler.schedule(now + 0.1, "b", 2)
+    assert done.wait(2)
+    assert ran == [("a", 1), ("b", 2), ("c", 3)]
+    assert scheduler.pending() == []
+
+
+def test_scheduler_cancel():
+    ran = []
+    scheduler = Scheduler(lambda key, payload, due: ran.append(key))
+    now = time.time()
+    scheduler.schedule(now + 0.05, "a", None)
+    scheduler.schedule(now + 3600, "b", None)
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    assert scheduler.get("b")[0] == now + 3600
+    time.sleep(0.15)
+    assert ran == []
+    assert [key for _, key, _ in scheduler.pending()] == ["b"]
+    scheduler.clear()
+    assert scheduler.get("b") is None
@@ -0,0 +1,253 @@
+"""
+Parallel search over a pool of worker processes, for workspaces large
+enough that checking every candidate message on one core is too slow.
+
+The channels are split into shards by channel_id, and each shard is held
+by a dedicated single-process executor that keeps its own read-only copy
+of the shard's messages: each channel's recency keys in order, and the
+author, pinned flag and lowercased text of every message. Sends, edits,
+pins and removals are queued per shard by store.py and shipped with the
+shard's next search, so a worker sees every change made before the search
+it is running.
+
+A search sends each shard holding one of the searched channels only the
+query and its filters. The worker walks its channels newest first,
+checking each message as it goes, and returns once it has enough matches;
+the matches of every shard are merged back into recency order.
+
+The pool is off until start_pool() is called, so the record_* functions
+cost nothing when searching stays in one process. Workers import nothing
+but this module, which keeps it free of the rest of the server.
+"""
+import heapq
+import multiprocessing
+import threading
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Messages a search must cover before it is spread over the pool
+PARALLEL_THRESHOLD = 100000
+# Changes queued for a shard that are shipped without waiting for a search
+# of one of its channels
+PENDING_LIMIT = 1024
+
+# The executors, one per shard, or None while the pool is off
+executors = None
+# Changes not yet sent to each shard: a message's row, or (message_id,
+# channel_id) on removal
+pending = []
+lock = threading.Lock()
+
+# In a worker: channel_id -> sorted (time_created, message_id) keys of the
+# channel's messages, and message_id -> its row as made by message_row
+shard_keys = {}
+shard_messages = {}
+
+
+def message_row(message):
+    """Return what a worker keeps of a message."""
+    return (
+        message.message_id,
+        message.channel_id,
+        message.time_created,
+        message.u_id,
+        message.is_pinned,
+        message.message.lower(),
+    )
+
+
+def load_shard(rows):
+    """Initialise a worker with the rows of its shard."""
+    shard_keys.clear()
+    shard_messages.clear()
+    for row in rows:
+        message_id, channel_id, time_created = row[:3]
+        shard_keys.setdefault(channel_id, []).append((time_created, message_id))
+        shard_messages[message_id] = row
+    for keys in shard_keys.values():
+        keys.sort()
+
+
+def apply_changes(changes):
+    """Apply changes to the worker's shard, in order."""
+    for change in changes:
+        apply_change(change)
+
+
+def apply_change(change):
+    """Apply one change to the worker's shard. None clears the shard."""
+    if change is None:
+        shard_keys.clear()
+        shard_messages.clear()
+        return
+    message_id, channel_id = change[:2]
+    old = shard_messages.get(message_id)
+    if len(change) == 2:
+        if old is not None:
+            del shard_messages[message_id]
+            keys = shard_keys[channel_id]
+            del keys[bisect_left(keys, (old[2], message_id))]
+        return
+    shard_messages[message_id] = change
+    if old is None:
+        insort(shard_keys.setdefault(channel_id, []), (change[2], message_id))
+
+
+def newest_keys(channel_id, since, until, before):
+    """
+    Return an iterator of the keys of a channel in the worker's shard, newest
+    first, sent between since and until and before the key before.
+    """
+    keys = shard_keys.get(channel_id, ())
+    lo = 0 if since is None else bisect_left(keys, (since,))
+    hi = len(keys) if until is None else bisect_left(keys, (until + 1,))
+    if before is not None:
+        hi = min(hi, bisect_left(keys, before))
+    return islice(reversed(keys), len(keys) - hi, len(keys) - lo)
+
+
+def search_shard(
+    changes, query_str, channel_ids, u_id, since, until, pinned, before, wanted
+):
+    """
+    Apply changes to the worker's shard, then return the recency keys of the
+    messages in channel_ids matching the filters whose text contains
+    query_str, newest first, stopping after wanted.
+    """
+    apply_changes(changes)
+    walks = [
+        newest_keys(channel_id, since, until, before) for channel_id in channel_ids
+    ]
+    matches = []
+    for key in heapq.merge(*walks, reverse=True):
+        _, _, _, author, is_pinned, text = shard_messages[key[1]]
+        if (
+            (u_id is None or author == u_id)
+            and (not pinned or is_pinned)
+            and query_str in text
+        ):
+            matches.append(key)
+            if len(matches) == wanted:
+                break
+    return matches
+
+
+def start_pool(processes, messages):
+    """Start processes workers, each holding one shard of the given messages."""
+    global executors, pending
+    stop_pool()
+    shards = [[] for _ in range(processes)]
+    for message in messages:
+        shards[message.channel_id % processes].append(message_row(message))
+    context = multiprocessing.get_context("spawn")
+    with lock:
+        pending = [[] for _ in range(processes)]
+        executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=load_shard,
+                initargs=(shard,),
+            )
+            for shard in shards
+        ]
+
+
+def stop_pool():
+    """Shut the pool down, returning search to a single process."""
+    global executors
+    with lock:
+        running, executors = executors, None
+    if running is not None:
+        for executor in running:
+            executor.shutdown()
+
+
+def is_running():
+    """Return True if searches can be spread over the pool."""
+    return executors is not None
+
+
+def record_message(message):
+    """Queue a message's new state after it is sent or changed."""
+    if executors is not None:
+        record(message.channel_id, message_row(message))
+
+
+def record_remove(message_id, channel_id):
+    """Queue the removal of a message."""
+    if executors is not None:
+        record(channel_id, (message_id, channel_id))
+
+
+def record(channel_id, change):
+    """
+    Queue a change for the shard of channel_id, shipping the shard's queue
+    once it is long, as a shard is only sent changes with its own searches.
+    """
+    with lock:
+        if executors is None:
+            return
+        shard = channel_id % len(executors)
+        pending[shard].append(change)
+        if len(pending[shard]) >= PENDING_LIMIT:
+            changes, pending[shard] = pending[shard], []
+            executors[shard].submit(apply_changes, changes)
+
+
+def record_clear():
+    """Queue the removal of every message."""
+    if executors is not None:
+        with lock:
+            for changes in pending:
+                changes[:] = [None]
+
+
+def search(
+    query_str,
+    channel_ids,
+    u_id=None,
+    since=None,
+    until=None,
+    pinned=None,
+    before=None,
+    wanted=None,
+):
+    """
+    Return the recency keys, newest first, of the messages in channel_ids,
+    sent by u_id, sent between since and until inclusive, pinned if pinned
+    is True and before the key before, whose text contains the lowercased
+    query_str, stopping after wanted (all if None). None matches anything.
+    Return None if the pool has been stopped, for the caller to search in
+    its own process instead.
+    """
+    with lock:
+        if executors is None:
+            return None
+        shards = len(executors)
+        shard_channels = [[] for _ in range(shards)]
+        for channel_id in channel_ids:
+            shard_channels[channel_id % shards].append(channel_id)
+        # submitting under the lock keeps each shard's changes in order
+        futures = []
+        for shard, executor in enumerate(executors):
+            if not shard_channels[shard]:
+                continue
+            changes, pending[shard] = pending[shard], []
+            futures.append(
+                executor.submit(
+                    search_shard,
+                    changes,
+                    query_str,
+                    shard_channels[shard],
+                    u_id,
+                    since,
+                    until,
+                    pinned,
+                    before,
+                    wanted,
+                )
+            )
+    results = [future.result() for future in futures]
+    return list(islice(heapq.merge(*results, reverse=True), wanted))
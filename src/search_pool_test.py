@@ -0,0 +1,87 @@
+import pytest
+from auth import auth_register
+from channels import channels_create
+from message import message_send, message_edit, message_remove
+from other import clear, search
+import search_pool
+import store
+
+
+@pytest.fixture
+def supply_pool(monkeypatch):
+    clear()
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_id = channels_create(user["token"], "A", True)["channel_id"]
+    message_ids = [
+        message_send(user["token"], channel_id, f"incident {i}")["message_id"]
+        for i in range(10)
+    ]
+    monkeypatch.setattr(search_pool, "PARALLEL_THRESHOLD", 0)
+    search_pool.start_pool(2, store.message_list())
+    yield user, channel_id, message_ids
+    search_pool.stop_pool()
+    clear()
+
+
+def test_pool_search_matches_serial(supply_pool):
+    user, _, message_ids = supply_pool
+    messages = search(user["token"], "INCIDENT")["messages"]
+    assert [message["message_id"] for message in messages] == message_ids[::-1]
+    page = search(user["token"], "incident", start=2, limit=3)
+    assert [message["message"] for message in page["messages"]] == [
+        "incident 7",
+        "incident 6",
+        "incident 5",
+    ]
+    assert page["end"] == 5
+
+
+def test_pool_search_after_stop(supply_pool, monkeypatch):
+    user, _, message_ids = supply_pool
+    search_pool.stop_pool()
+    assert search_pool.search("incident", [0]) is None
+    # the pool stops between search checking it and asking it
+    monkeypatch.setattr(search_pool, "is_running", lambda: True)
+    messages = search(user["token"], "incident", limit=3)["messages"]
+    assert [message["message_id"] for message in messages] == message_ids[:-4:-1]
+
+
+def test_pool_search_sees_changes(supply_pool):
+    user, channel_id, message_ids = supply_pool
+    message_edit(user["token"], message_ids[0], "all clear")
+    message_remove(user["token"], message_ids[1])
+    new_id = message_send(user["token"], channel_id, "incident 10")["message_id"]
+    messages = search(user["token"], "incident")["messages"]
+    expected = [new_id] + message_ids[:1:-1]
+    assert [message["message_id"] for message in messages] == expected
+    messages = search(user["token"], "clear")["messages"]
+    assert [message["message_id"] for message in messages] == [message_ids[0]]
+    clear()
+    assert search_pool.pending == [[None], [None]]
+
+
+def test_pool_search_only_asks_needed_shards(supply_pool, monkeypatch):
+    user, channel_id, message_ids = supply_pool
+    other_id = channels_create(user["token"], "B", True)["channel_id"]
+    while other_id % 2 == channel_id % 2:
+        other_id = channels_create(user["token"], "B", True)["channel_id"]
+    other_message = message_send(user["token"], other_id, "incident B")["message_id"]
+    message_send(user["token"], channel_id, "resolved")
+    messages = search(user["token"], "incident", channel_ids=[channel_id])["messages"]
+    assert [message["message_id"] for message in messages] == message_ids[::-1]
+    # the other channel's shard was not searched, so keeps its change queued
+    assert search_pool.pending[channel_id % 2] == []
+    assert len(search_pool.pending[other_id % 2]) == 1
+    messages = search(user["token"], "incident", limit=2)["messages"]
+    assert [message["message_id"] for message in messages] == [
+        other_message,
+        message_ids[-1],
+    ]
+
+    # a long queue is shipped without waiting for a search
+    monkeypatch.setattr(search_pool, "PENDING_LIMIT", 2)
+    message_send(user["token"], other_id, "one")
+    message_send(user["token"], other_id, "two")
+    assert search_pool.pending[other_id % 2] == []
+    messages = search(user["token"], "two", channel_ids=[other_id])["messages"]
+    assert [message["message"] for message in messages] == ["two"]
@@ -4,23 +4,42 @@ import channels
 import message
 import user
 import other
+import session
 import sys
-from json import dumps
-from flask import Flask, request
+import atexit
+import os
+import gateway
+import persist
+import search_pool
+import store
+import json
+from records import to_dict
+from flask import Flask, Response, request, stream_with_context
+from werkzeug.exceptions import HTTPException
 from flask_cors import CORS
 from error import InputError
 
 
-def defaultHandler(err):
-    response = err.get_response()
-    print("response", err, err.get_response())
-    response.data = dumps(
+def dumps(value):
+    """Serialise a route's result, turning records into their dict shapes."""
+    return json.dumps(value, default=to_dict)
+
+
+def error_body(err):
+    """Return the JSON body describing an error."""
+    return dumps(
         {
             "code": err.code,
             "name": "System Error",
             "message": err.get_description(),
         }
     )
+
+
+def defaultHandler(err):
+    response = err.get_response()
+    print("response", err, err.get_response())
+    response.data = error_body(err)
     response.content_type = "application/json"
     return response
 
@@ -31,6 +50,11 @@ CORS(APP)
 APP.config["TRAP_HTTP_EXCEPTIONS"] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+# Most sub-requests one call to /batch may make
+MAX_BATCH_REQUESTS = 50
+# Routes /batch will not run: itself, and ones that stream
+UNBATCHED = {"batch", "channel_stream"}
+
 # Example
 @APP.route("/echo", methods=["GET"])
 def echo():
@@ -88,6 +112,42 @@ def channel_messages():
     return dumps(channel.channel_messages(token, channel_id, start))
 
 
+@APP.route("/channel/messages/range", methods=["GET"])
+def channel_messages_range():
+    token = request.args.get("token")
+    channel_id = int(request.args.get("channel_id"))
+    time_start = int(request.args.get("time_start"))
+    time_end = int(request.args.get("time_end"))
+    start = int(request.args.get("start", 0))
+    return dumps(
+        channel.channel_messages_range(token, channel_id, time_start, time_end, start)
+    )
+
+
+@APP.route("/channel/messages/since", methods=["GET"])
+def channel_messages_since():
+    token = request.args.get("token")
+    channel_id = int(request.args.get("channel_id"))
+    seq = int(request.args.get("seq"))
+    return dumps(channel.channel_messages_since(token, channel_id, seq))
+
+
+@APP.route("/channel/stream", methods=["GET"])
+def channel_stream():
+    token = request.args.get("token")
+    channel_id = int(request.args.get("channel_id"))
+    stream = channel.channel_subscribe(token, channel_id)
+
+    def send():
+        # sent at once so the client sees the stream open before any event
+        yield ": subscribed\n\n"
+        for event in stream:
+            # a comment line keeps idle connections from timing out
+            yield ": keep-alive\n\n" if event is None else f"data: {dumps(event)}\n\n"
+
+    return Response(stream_with_context(send()), mimetype="text/event-stream")
+
+
 @APP.route("/channel/leave", methods=["POST"])
 def channel_leave():
     data = request.get_json()
@@ -152,6 +212,14 @@ def message_send():
     return dumps(message.message_send(token, channel_id, message_actual))
 
 
+@APP.route("/message/send/batch", methods=["POST"])
+def message_send_batch():
+    data = request.get_json()
+    token = data["token"]
+    items = data["messages"]
+    return dumps(message.message_send_batch(token, items))
+
+
 @APP.route("/message/remove", methods=["DELETE"])
 def message_remove():
     data = request.get_json()
@@ -181,6 +249,20 @@ def message_sendlater():
     )
 
 
+@APP.route("/message/sendlater/cancel", methods=["POST"])
+def message_sendlater_cancel():
+    data = request.get_json()
+    token = data["token"]
+    message_id = int(data["message_id"])
+    return dumps(message.message_sendlater_cancel(token, message_id))
+
+
+@APP.route("/message/sendlater/list", methods=["GET"])
+def message_sendlater_list():
+    token = request.args.get("token")
+    return dumps(message.message_sendlater_list(token))
+
+
 @APP.route("/message/react", methods=["POST"])
 def message_react():
     data = request.get_json()
@@ -266,7 +348,82 @@ def admin_userpermission_change():
 def search():
     token = request.args.get("token")
     query_str = request.args.get("query_str")
-    return dumps(other.search(token, query_str))
+    start = int(request.args.get("start", 0))
+    limit = request.args.get("limit")
+    limit = int(limit) if limit is not None else None
+    cursor = request.args.get("cursor")
+    channel_ids = request.args.getlist("channel_id", type=int) or None
+    author_id = request.args.get("author_id", type=int)
+    time_start = request.args.get("time_start", type=int)
+    time_end = request.args.get("time_end", type=int)
+    pinned = request.args.get("pinned", "false").lower() in ("1", "true")
+    return dumps(
+        other.search(
+            token,
+            query_str,
+            start,
+            limit,
+            cursor,
+            channel_ids,
+            author_id,
+            time_start,
+            time_end,
+            pinned,
+        )
+    )
+
+
+@APP.route("/stats", methods=["GET"])
+def stats():
+    token = request.args.get("token")
+    return dumps(other.server_stats(token))
+
+
+@APP.route("/batch", methods=["POST"])
+def batch():
+    data = request.get_json()
+    token = data.get("token")
+    sub_requests = data["requests"]
+    if len(sub_requests) > MAX_BATCH_REQUESTS:
+        raise InputError(
+            description=f"No more than {MAX_BATCH_REQUESTS} requests can be batched."
+        )
+    if token is not None:
+        # checked once here; the sub-requests find it in the verified cache
+        auth.auth_token(token)
+    responses = [run_sub_request(sub_request, token) for sub_request in sub_requests]
+    return '{"responses": [' + ", ".join(responses) + "]}"
+
+
+def run_sub_request(sub_request, token):
+    """
+    Run one of the sub-requests of /batch through its route's handler and
+    return its status and body as JSON. A sub-request is {"method", "path",
+    "params"}, its params sent as the query string of a GET and as the JSON
+    body otherwise, and given the batch's token unless it has its own.
+    """
+    try:
+        method = sub_request.get("method", "GET").upper()
+        path = sub_request["path"]
+        params = dict(sub_request.get("params") or {})
+        if token is not None:
+            params.setdefault("token", token)
+        endpoint, view_args = APP.url_map.bind("localhost").match(path, method)
+        if endpoint in UNBATCHED:
+            raise InputError(description=f"{path} cannot be batched.")
+        if method == "GET":
+            context = APP.test_request_context(path, method=method, query_string=params)
+        else:
+            context = APP.test_request_context(path, method=method, json=params)
+        with context:
+            body = APP.view_functions[endpoint](**view_args)
+        status = 200
+    except HTTPException as err:
+        status, body = err.code, error_body(err)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        err = InputError(description="Invalid request.")
+        status, body = err.code, error_body(err)
+    return f'{{"status": {status}, "body": {body}}}'
 
 
 @APP.route("/clear", methods=["DELETE"])
@@ -275,4 +432,22 @@ def clear():
 
 
 if __name__ == "__main__":
+    # Persist the workspace only when given somewhere to keep it
+    if os.environ.get("FLOCKR_DATA_DIR"):
+        persist.open_store(os.environ["FLOCKR_DATA_DIR"])
+        atexit.register(persist.close_store)
+        store.rebuild()
+        session.rebuild()
+        message.restore_scheduled()
+    # Spread large searches over worker processes when asked to
+    if os.environ.get("FLOCKR_SEARCH_PROCESSES"):
+        search_pool.start_pool(
+            int(os.environ["FLOCKR_SEARCH_PROCESSES"]), store.message_list()
+        )
+        atexit.register(search_pool.stop_pool)
+    # Push events over WebSockets too when given a port for it
+    if os.environ.get("FLOCKR_GATEWAY_PORT"):
+        gateway.start_gateway(port=int(os.environ["FLOCKR_GATEWAY_PORT"]))
+        atexit.register(gateway.stop_gateway)
+    session.start_sweeper()
     APP.run(port=0)  # Do not edit this port
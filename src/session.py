@@ -0,0 +1,152 @@
+"""
+Active login sessions. Sessions are kept in data.py keyed by token, with
+the set of tokens each user holds indexed alongside, so checking a token
+is a single lookup. A session expires once it has gone IDLE_TTL seconds
+without being used or ABSOLUTE_TTL seconds after login; expired sessions
+are dropped when next looked up or by the background sweeper.
+
+Tokens whose signature has already been verified are remembered in a
+bounded LRU cache, so busy tokens skip JWT decoding. Ending a session in
+any way evicts its token from the cache.
+
+A session's last use is logged by persist.py at most once every
+USE_LOG_INTERVAL seconds, so a recovered session is at most that much
+older than it was, without logging every request.
+"""
+import threading
+import time
+from cache import LRUCache
+from data import data
+import persist
+from records import Session
+
+# Seconds a session may go unused / may live in total. None disables a limit.
+IDLE_TTL = 24 * 60 * 60
+ABSOLUTE_TTL = 7 * 24 * 60 * 60
+# Seconds between sweeps for expired sessions
+SWEEP_INTERVAL = 60
+# Most verified tokens remembered at once
+TOKEN_CACHE_SIZE = 4096
+# Seconds between logging a session's last_used
+USE_LOG_INTERVAL = 60
+
+# u_id -> set of tokens the user is logged in with
+user_sessions = {}
+# token -> u_id of tokens whose signature has been verified
+verified_tokens = LRUCache(TOKEN_CACHE_SIZE)
+# token -> last_used of each session as last logged
+logged_uses = {}
+
+lock = threading.Lock()
+
+
+def session_add(token, u_id):
+    """Start (or restart) a session for u_id under token."""
+    now = time.time()
+    with lock:
+        data["sessions"][token] = Session(
+            token=token, u_id=u_id, created=now, last_used=now
+        )
+        user_sessions.setdefault(u_id, set()).add(token)
+        logged_uses[token] = now
+        persist.record_put("sessions", token, data["sessions"][token])
+
+
+def session_touch(token):
+    """
+    Return the u_id of the live session for token, marking it as used, or
+    None if there is no such session or it has expired.
+    """
+    now = time.time()
+    with lock:
+        session = data["sessions"].get(token)
+        if session is None:
+            return None
+        if is_expired(session, now):
+            drop(token)
+            return None
+        session.last_used = now
+        if now - logged_uses.get(token, session.created) >= USE_LOG_INTERVAL:
+            logged_uses[token] = now
+            persist.record_put("sessions", token, session)
+        return session.u_id
+
+
+def session_remove(token):
+    """End the session for token. Return False if there was no such session."""
+    with lock:
+        if token not in data["sessions"]:
+            return False
+        drop(token)
+        return True
+
+
+def session_tokens(u_id):
+    """Return the tokens of a user's sessions."""
+    with lock:
+        return set(user_sessions.get(u_id, ()))
+
+
+def is_expired(session, now):
+    """Check whether a session has outlived either TTL at time now."""
+    if IDLE_TTL is not None and now - session.last_used > IDLE_TTL:
+        return True
+    return ABSOLUTE_TTL is not None and now - session.created > ABSOLUTE_TTL
+
+
+def drop(token):
+    """Remove a session and its index entry. The caller must hold lock."""
+    session = data["sessions"].pop(token)
+    verified_tokens.pop(token)
+    logged_uses.pop(token, None)
+    persist.record_delete("sessions", token)
+    tokens = user_sessions.get(session.u_id, set())
+    tokens.discard(token)
+    if not tokens:
+        user_sessions.pop(session.u_id, None)
+
+
+def sweep(now=None):
+    """Drop every expired session and return how many were dropped."""
+    now = time.time() if now is None else now
+    with lock:
+        expired = [
+            token
+            for token, session in data["sessions"].items()
+            if is_expired(session, now)
+        ]
+        for token in expired:
+            drop(token)
+    return len(expired)
+
+
+def start_sweeper():
+    """Start a daemon thread that sweeps expired sessions every SWEEP_INTERVAL."""
+
+    def run():
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            sweep()
+
+    sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+    sweeper.start()
+    return sweeper
+
+
+def rebuild():
+    """Recompute the per-user session index from data.py."""
+    with lock:
+        user_sessions.clear()
+        logged_uses.clear()
+        for token, session in data["sessions"].items():
+            user_sessions.setdefault(session.u_id, set()).add(token)
+            logged_uses[token] = session.last_used
+
+
+def clear():
+    """End every session."""
+    with lock:
+        data["sessions"].clear()
+        user_sessions.clear()
+        verified_tokens.clear()
+        logged_uses.clear()
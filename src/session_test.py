@@ -0,0 +1,70 @@
+import time
+import pytest
+from auth import auth_register, auth_logout, auth_token
+from data import data
+from error import AccessError
+from other import clear
+import session
+
+
+@pytest.fixture
+def supply_user():
+    clear()
+    return auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+
+
+@pytest.fixture
+def short_ttls():
+    idle_ttl, absolute_ttl = session.IDLE_TTL, session.ABSOLUTE_TTL
+    yield
+    session.IDLE_TTL, session.ABSOLUTE_TTL = idle_ttl, absolute_ttl
+
+
+def test_session_tokens(supply_user):
+    assert session.session_tokens(supply_user["u_id"]) == {supply_user["token"]}
+    auth_logout(supply_user["token"])
+    assert session.session_tokens(supply_user["u_id"]) == set()
+
+
+def test_session_idle_expiry(supply_user, short_ttls):
+    session.IDLE_TTL = 60
+    assert session.session_touch(supply_user["token"]) == supply_user["u_id"]
+    data["sessions"][supply_user["token"]].last_used -= 61
+    with pytest.raises(AccessError):
+        auth_token(supply_user["token"])
+    assert session.session_tokens(supply_user["u_id"]) == set()
+
+
+def test_session_absolute_expiry(supply_user, short_ttls):
+    session.IDLE_TTL = None
+    session.ABSOLUTE_TTL = 3600
+    assert session.sweep(time.time() + 3599) == 0
+    assert session.sweep(time.time() + 3601) == 1
+    with pytest.raises(AccessError):
+        auth_token(supply_user["token"])
+
+
+def test_session_sweep_keeps_live_sessions(supply_user, short_ttls):
+    other = auth_register("otheremail@gmail.com", "123abc!@#", "Other", "User")
+    session.IDLE_TTL = 60
+    data["sessions"][supply_user["token"]].last_used -= 61
+    assert session.sweep() == 1
+    assert auth_token(other["token"]) == other["u_id"]
+
+
+def test_verified_token_cache(supply_user):
+    auth_token(supply_user["token"])
+    auth_token(supply_user["token"])
+    stats = session.verified_tokens.stats()
+    assert stats["hits"] >= 1
+    assert supply_user["token"] in session.verified_tokens
+    auth_logout(supply_user["token"])
+    assert supply_user["token"] not in session.verified_tokens
+
+
+def test_verified_token_cache_evicted_on_expiry(supply_user, short_ttls):
+    auth_token(supply_user["token"])
+    session.IDLE_TTL = 60
+    data["sessions"][supply_user["token"]].last_used -= 61
+    session.sweep()
+    assert supply_user["token"] not in session.verified_tokens
@@ -0,0 +1,414 @@
+"""
+Binary snapshot format for the data store, read through mmap so a large
+workspace is ready to serve as soon as the file is mapped.
+
+Users, sessions, channels and messages scheduled to be sent are few and
+are decoded when the snapshot is loaded. Messages are not: the snapshot
+holds fixed-width columns of their ids, channel ids, authors and send
+times, a byte per message flagging whether it is pinned, a sorted id index
+for binary search, each channel's message ids in send order, and the
+encoded records themselves. A record is decoded the first time it is
+looked up, so loading costs the same however many messages the workspace
+has.
+
+All integers are little-endian. The file is a header naming the lsn and
+next id, a table of (name, offset, length) sections, then the sections.
+"""
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from records import Channel, Message, ScheduledMessage, Session, User
+
+MAGIC = b"FLOCKSNP"
+VERSION = 4
+HEADER = struct.Struct("<8sIqqI")
+SECTION = struct.Struct("<8sQQ")
+# message_id, channel_id, u_id, time_created, is_pinned, length of text
+MESSAGE = struct.Struct("<qqqq?I")
+REACT_COUNT = struct.Struct("<H")
+# react_id, number of u_ids
+REACT = struct.Struct("<iI")
+
+
+def encode_message(message):
+    """Pack a message into its binary record."""
+    text = message.message.encode("utf-8")
+    parts = [
+        MESSAGE.pack(
+            message.message_id,
+            message.channel_id,
+            message.u_id,
+            message.time_created,
+            message.is_pinned,
+            len(text),
+        ),
+        text,
+        REACT_COUNT.pack(len(message.reacts)),
+    ]
+    for react in message.reacts:
+        parts.append(REACT.pack(react["react_id"], len(react["u_ids"])))
+        parts.append(array("q", react["u_ids"]).tobytes())
+    return b"".join(parts)
+
+
+def decode_message(record):
+    """Unpack a binary record into a message."""
+    message_id, channel_id, u_id, time_created, is_pinned, length = MESSAGE.unpack_from(
+        record
+    )
+    offset = MESSAGE.size
+    text = bytes(record[offset : offset + length]).decode("utf-8")
+    offset += length
+    (react_count,) = REACT_COUNT.unpack_from(record, offset)
+    offset += REACT_COUNT.size
+    reacts = []
+    for _ in range(react_count):
+        react_id, count = REACT.unpack_from(record, offset)
+        offset += REACT.size
+        u_ids = array("q")
+        u_ids.frombytes(record[offset : offset + 8 * count])
+        offset += 8 * count
+        reacts.append({"react_id": react_id, "u_ids": u_ids.tolist()})
+    return Message(
+        channel_id=channel_id,
+        message_id=message_id,
+        u_id=u_id,
+        message=text,
+        time_created=time_created,
+        reacts=reacts or (),
+        is_pinned=is_pinned,
+    )
+
+
+class Snapshot:
+    """A snapshot file mapped into memory."""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.lsn, self.next_id, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot")
+        self.sections = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(
+                self.map, HEADER.size + i * SECTION.size
+            )
+            self.sections[name.rstrip(b"\0").decode()] = (offset, length)
+        self.message_ids = self.column("msgids")
+        self.message_channels = self.column("msgchan")
+        self.message_users = self.column("msguser")
+        self.message_times = self.column("msgtime")
+        self.message_pins = self.section("msgpin")
+        self.message_offsets = self.column("msgoffs")
+        self.sorted_ids = self.column("sortids")
+        self.sorted_rows = self.column("sortrows")
+        self.log_ids = self.column("logids")
+        log_dir = self.column("logdir")
+        # channel_id -> (first index in log_ids, number of messages)
+        self.logs = {
+            log_dir[i]: (log_dir[i + 1], log_dir[i + 2])
+            for i in range(0, len(log_dir), 3)
+        }
+
+    def section(self, name):
+        """Return a section as a memoryview into the map."""
+        offset, length = self.sections[name]
+        return memoryview(self.map)[offset : offset + length]
+
+    def column(self, name):
+        """Return a section of int64s as an indexable memoryview."""
+        return self.section(name).cast("q")
+
+    def entities(self, name, record_type):
+        """Decode one of the JSON sections of entities."""
+        return [
+            record_type.from_dict(fields)
+            for fields in json.loads(bytes(self.section(name)))
+        ]
+
+    def find(self, message_id):
+        """Return the row holding message_id, or None if it is not here."""
+        if not isinstance(message_id, int):
+            return None
+        i = bisect_left(self.sorted_ids, message_id)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == message_id:
+            return self.sorted_rows[i]
+        return None
+
+    def record(self, row):
+        """Return the encoded record at row."""
+        offset = self.sections["msgdata"][0]
+        start = offset + self.message_offsets[row]
+        end = offset + self.message_offsets[row + 1]
+        return self.map[start:end]
+
+    def channel_log(self, channel_id):
+        """Return the ids of a channel's messages in send order."""
+        start, count = self.logs.get(channel_id, (0, 0))
+        log = array("q")
+        log.frombytes(self.log_ids[start : start + count].cast("B"))
+        return log
+
+
+class MappedMessages(MutableMapping):
+    """
+    The message map of data.py when it was loaded from a snapshot. Lookups
+    fall through to the snapshot and the decoded message is kept, so later
+    edits change the kept copy. New and deleted messages are tracked so the
+    snapshot itself is never modified.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # message_id -> message, for every message decoded or stored since
+        self.loaded = {}
+        # ids (in insertion order) of messages not in the snapshot
+        self.added = {}
+        # ids of snapshot messages that have been deleted
+        self.deleted = set()
+
+    def in_snapshot(self, message_id):
+        """Return the snapshot row of a live snapshot message, or None."""
+        if self.snapshot is None or message_id in self.deleted:
+            return None
+        return self.snapshot.find(message_id)
+
+    def __getitem__(self, message_id):
+        if message_id in self.loaded:
+            return self.loaded[message_id]
+        row = self.in_snapshot(message_id)
+        if row is None:
+            raise KeyError(message_id)
+        message = decode_message(self.snapshot.record(row))
+        return self.loaded.setdefault(message_id, message)
+
+    def __setitem__(self, message_id, message):
+        if message_id not in self.loaded and self.in_snapshot(message_id) is None:
+            self.deleted.discard(message_id)
+            self.added[message_id] = None
+        self.loaded[message_id] = message
+
+    def __delitem__(self, message_id):
+        if message_id in self.added:
+            del self.added[message_id]
+        elif self.in_snapshot(message_id) is not None:
+            self.deleted.add(message_id)
+        else:
+            raise KeyError(message_id)
+        self.loaded.pop(message_id, None)
+
+    def __contains__(self, message_id):
+        return message_id in self.loaded or self.in_snapshot(message_id) is not None
+
+    def __iter__(self):
+        if self.snapshot is not None:
+            for message_id in self.snapshot.message_ids:
+                if message_id not in self.deleted:
+                    yield message_id
+        yield from list(self.added)
+
+    def __len__(self):
+        count = len(self.snapshot.message_ids) if self.snapshot is not None else 0
+        return count - len(self.deleted) + len(self.added)
+
+    def clear(self):
+        self.snapshot = None
+        self.loaded.clear()
+        self.added.clear()
+        self.deleted.clear()
+
+    def channel_log(self, channel_id):
+        """Return the ids of a channel's live snapshot messages in send order."""
+        if self.snapshot is None:
+            return array("q")
+        log = self.snapshot.channel_log(channel_id)
+        if self.deleted:
+            log = array("q", (i for i in log if i not in self.deleted))
+        return log
+
+    def snapshot_columns(self):
+        """
+        Return the message_id, channel_id, u_id and time_created columns of
+        the snapshot, its pinned flags and its sorted id index (the sorted
+        ids and the row of each), as views into the map. They include
+        messages since deleted.
+        """
+        if self.snapshot is None:
+            return None
+        return (
+            self.snapshot.message_ids,
+            self.snapshot.message_channels,
+            self.snapshot.message_users,
+            self.snapshot.message_times,
+            self.snapshot.message_pins,
+            self.snapshot.sorted_ids,
+            self.snapshot.sorted_rows,
+        )
+
+    def added_messages(self):
+        """Return the messages stored since the snapshot, in insertion order."""
+        return [self.loaded[message_id] for message_id in self.added]
+
+    def freeze(self):
+        """
+        Capture what is needed to write this map to a new snapshot. Only the
+        bookkeeping is copied; snapshot records are read later as raw bytes.
+        """
+        return (self.snapshot, dict(self.loaded), list(self.added), set(self.deleted))
+
+
+def freeze_messages(messages):
+    """Capture a message map (a dict or MappedMessages) for write()."""
+    if isinstance(messages, MappedMessages):
+        return messages.freeze()
+    return (None, dict(messages), list(messages), set())
+
+
+def message_rows(frozen):
+    """
+    Yield (message_id, channel_id, u_id, time_created, is_pinned, record)
+    for every message in a frozen map.
+    """
+    snapshot, loaded, added, deleted = frozen
+    if snapshot is not None:
+        for row, message_id in enumerate(snapshot.message_ids):
+            if message_id in deleted:
+                continue
+            if message_id in loaded:
+                yield message_columns(loaded[message_id])
+            else:
+                yield (
+                    message_id,
+                    snapshot.message_channels[row],
+                    snapshot.message_users[row],
+                    snapshot.message_times[row],
+                    snapshot.message_pins[row],
+                    snapshot.record(row),
+                )
+    for message_id in added:
+        yield message_columns(loaded[message_id])
+
+
+def message_columns(message):
+    """Return a message's row as yielded by message_rows()."""
+    return (
+        message.message_id,
+        message.channel_id,
+        message.u_id,
+        message.time_created,
+        message.is_pinned,
+        encode_message(message),
+    )
+
+
+def dump_entities(records):
+    """Encode a list of records as a JSON section."""
+    return json.dumps([record.to_dict() for record in records]).encode()
+
+
+def write(path, lsn, state):
+    """
+    Atomically write a snapshot of state, as returned by persist.copy_state,
+    to path.
+    """
+    message_ids = array("q")
+    message_channels = array("q")
+    message_users = array("q")
+    message_times = array("q")
+    message_pins = bytearray()
+    message_offsets = array("q", [0])
+    logs = {}
+    tmp_path = path + ".tmp"
+    with open(tmp_path + ".data", "w+b") as records:
+        for (
+            message_id,
+            channel_id,
+            u_id,
+            time_created,
+            is_pinned,
+            record,
+        ) in message_rows(state["messages"]):
+            message_ids.append(message_id)
+            message_channels.append(channel_id)
+            message_users.append(u_id)
+            message_times.append(time_created)
+            message_pins.append(is_pinned)
+            records.write(record)
+            message_offsets.append(message_offsets[-1] + len(record))
+            logs.setdefault(channel_id, array("q")).append(message_id)
+        rows = sorted(range(len(message_ids)), key=message_ids.__getitem__)
+        log_dir = array("q")
+        log_ids = array("q")
+        for channel_id, log in logs.items():
+            log_dir.extend((channel_id, len(log_ids), len(log)))
+            log_ids.extend(log)
+        sections = [
+            ("users", dump_entities(state["users"])),
+            ("sessions", dump_entities(state["sessions"])),
+            ("channels", dump_entities(state["channels"])),
+            ("sched", dump_entities(state["scheduled"])),
+            ("msgids", message_ids.tobytes()),
+            ("msgchan", message_channels.tobytes()),
+            ("msguser", message_users.tobytes()),
+            ("msgtime", message_times.tobytes()),
+            ("msgpin", bytes(message_pins)),
+            ("msgoffs", message_offsets.tobytes()),
+            ("sortids", array("q", (message_ids[row] for row in rows)).tobytes()),
+            ("sortrows", array("q", rows).tobytes()),
+            ("logdir", log_dir.tobytes()),
+            ("logids", log_ids.tobytes()),
+            ("msgdata", records),
+        ]
+        with open(tmp_path, "wb") as snapshot_file:
+            offset = HEADER.size + SECTION.size * len(sections)
+            # keep every section 8 byte aligned for the int64 columns
+            table = []
+            for name, body in sections:
+                length = body.tell() if name == "msgdata" else len(body)
+                offset += -offset % 8
+                table.append(SECTION.pack(name.encode(), offset, length))
+                offset += length
+            snapshot_file.write(
+                HEADER.pack(MAGIC, VERSION, lsn, state["id"], len(sections))
+            )
+            snapshot_file.write(b"".join(table))
+            for name, body in sections:
+                snapshot_file.write(b"\0" * (-snapshot_file.tell() % 8))
+                if name == "msgdata":
+                    body.seek(0)
+                    while True:
+                        chunk = body.read(1 << 20)
+                        if not chunk:
+                            break
+                        snapshot_file.write(chunk)
+                else:
+                    snapshot_file.write(body)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+    os.remove(tmp_path + ".data")
+    os.replace(tmp_path, path)
+
+
+def load(path, data):
+    """Load the snapshot at path into data and return its lsn."""
+    snapshot = Snapshot(path)
+    data["id"] = snapshot.next_id
+    data["users"] = {user.u_id: user for user in snapshot.entities("users", User)}
+    data["sessions"] = {
+        session.token: session for session in snapshot.entities("sessions", Session)
+    }
+    data["channels"] = {
+        channel.channel_id: channel
+        for channel in snapshot.entities("channels", Channel)
+    }
+    data["messages"] = MappedMessages(snapshot)
+    data["scheduled"] = {
+        scheduled.message_id: scheduled
+        for scheduled in snapshot.entities("sched", ScheduledMessage)
+    }
+    return snapshot.lsn
@@ -0,0 +1,98 @@
+import pytest
+from auth import auth_register
+from channel import channel_messages
+from channels import channels_create
+from data import data
+from message import (
+    message_send,
+    message_edit,
+    message_remove,
+    message_react,
+    message_pin,
+)
+from other import clear
+import persist
+import snapshot
+import store
+
+
+@pytest.fixture
+def supply_workspace():
+    clear()
+    user = auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+    channel_a = channels_create(user["token"], "A", True)["channel_id"]
+    channel_b = channels_create(user["token"], "B", True)["channel_id"]
+    message_ids = [
+        message_send(user["token"], channel, f"{channel} {i} ✓")["message_id"]
+        for i in range(5)
+        for channel in (channel_a, channel_b)
+    ]
+    message_react(user["token"], message_ids[0], 1)
+    message_pin(user["token"], message_ids[1])
+    yield user, channel_a, channel_b, message_ids
+    clear()
+
+
+def reload(tmp_path):
+    """Write data.py to a snapshot and load it back."""
+    path = str(tmp_path / "snapshot.bin")
+    snapshot.write(path, 7, persist.copy_state())
+    expected = {key: value.to_dict() for key, value in data["messages"].items()}
+    assert snapshot.load(path, data) == 7
+    store.rebuild()
+    return expected
+
+
+def test_snapshot_round_trip(tmp_path, supply_workspace):
+    expected = reload(tmp_path)
+    assert isinstance(data["messages"], snapshot.MappedMessages)
+    assert data["messages"].loaded == {}
+    assert dict(data["messages"].items()) == expected
+    assert data["messages"][supply_workspace[3][0]]["reacts"][0]["u_ids"] == [0]
+    assert store.find_messages(pinned=True) == [supply_workspace[3][1]]
+
+
+def test_snapshot_loads_messages_lazily(tmp_path, supply_workspace):
+    user, channel_a, _, message_ids = supply_workspace
+    reload(tmp_path)
+    messages = channel_messages(user["token"], channel_a, 0)["messages"]
+    assert [message["message_id"] for message in messages] == message_ids[::2][::-1]
+    assert set(data["messages"].loaded) == set(message_ids[::2])
+
+
+def test_snapshot_changes_after_load(tmp_path, supply_workspace):
+    user, channel_a, channel_b, message_ids = supply_workspace
+    reload(tmp_path)
+    message_remove(user["token"], message_ids[0])
+    message_edit(user["token"], message_ids[2], "Edited")
+    new_id = message_send(user["token"], channel_a, "New")["message_id"]
+    messages = channel_messages(user["token"], channel_a, 0)["messages"]
+    assert [message["message"] for message in messages][:2] == [
+        "New",
+        f"{channel_a} 4 ✓",
+    ]
+    assert messages[-1]["message"] == "Edited"
+    assert len(data["messages"]) == 10
+
+    # a snapshot of a mapped store copies untouched records as they are
+    expected = reload(tmp_path)
+    assert dict(data["messages"].items()) == expected
+    assert store.channel_message_count(channel_a) == 5
+    assert store.channel_message_count(channel_b) == 5
+    assert store.find_messages(channel_ids=[channel_b]) == message_ids[1::2]
+    assert store.find_messages(channel_ids=[channel_a])[-1] == new_id
+    assert new_id in data["messages"] and message_ids[0] not in data["messages"]
+
+
+def test_snapshot_columns_read_in_place(tmp_path, supply_workspace):
+    user, channel_a, _, message_ids = supply_workspace
+    reload(tmp_path)
+    columns = store.message_columns
+    assert isinstance(columns.message_ids.base, memoryview)
+    assert len(columns.message_ids.rows) == len(columns.maxima) == 0
+    assert columns.row(message_ids[3]) == 3
+    new_id = message_send(user["token"], channel_a, "New")["message_id"]
+    assert columns.row(new_id) == 10
+    message_remove(user["token"], message_ids[3])
+    assert columns.row(message_ids[3]) is None
+    assert store.find_messages(channel_ids=[channel_a], since=0)[-1] == new_id
@@ -0,0 +1,730 @@
+"""
+Primary-key access to the users, channels and messages held in data.py.
+Each entity is kept in a map keyed by its id so lookups are O(1). The
+*_list functions return the old list views for callers that iterate.
+
+Each channel also has a log of its message ids in the order they were
+sent, so a page of a channel's history is read newest-first in O(page
+size) regardless of how many messages the workspace holds. A removed
+message is found in the log through its map of ids to slots and left as a
+tombstone until the log is compacted, so removal costs O(1) too. When
+the messages were loaded from a snapshot, a channel's log is read from it
+the first time the channel is used. The ids of the messages each user
+sent are kept the same way, built from the columns the first time a
+user's messages are looked up, and so is each channel's time log, its
+messages ordered by time_created for looking up a range of times.
+
+Channel membership is indexed both ways: the sets of owner and member ids
+of every channel, and the set of channel ids every user belongs to. A user
+is in a channel if they appear in either its owner_members or all_members.
+
+Every change to a channel's messages gives the channel a new version stamp,
+so a result computed from a set of channels can tell when it is stale.
+
+The metadata of every message is also held in columnar form by columns.py,
+so filtering messages by channel, author or time never walks the records,
+and their text is indexed by text_index.py for search.
+
+Every change to a message is published by events.py to the subscribers of
+its channel, as a small event carrying only what changed.
+
+Emails and handles are unique, so each has a map back to the owning u_id.
+For handles generated at registration the next numeric suffix to try is
+remembered per name, so a common first name does not re-test every suffix.
+
+Every change made through this module is also logged by persist.py. Code
+that edits an entity in place calls the matching save_* function after.
+"""
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import count
+from data import data
+import events
+import persist
+import search_pool
+from columns import MessageColumns, MessageLog, TimeLog
+from snapshot import MappedMessages
+from text_index import TrigramIndex, WordIndex, fold
+
+# channel_id -> MessageLog of that channel's message ids, oldest first
+channel_logs = {}
+# u_id -> MessageLog of the ids of the messages they sent, oldest first
+author_logs = {}
+# channel_id -> MessageLog of the ids of its pinned messages, in pin order
+pinned_logs = {}
+# channel_id -> TimeLog of that channel's messages
+channel_time_logs = {}
+# channel_id -> stamp of the last change to one of its messages
+channel_versions = {}
+change_stamps = count(1)
+# message_id, channel_id, u_id and time_created of every message
+message_columns = MessageColumns()
+# lowercased word -> ids of the messages using it
+word_index = WordIndex()
+# trigram of casefolded text -> sorted ids of the messages holding it
+trigram_index = TrigramIndex()
+# channel_id -> set of u_ids in owner_members / all_members
+channel_owners = {}
+channel_members = {}
+# u_id -> set of channel_ids the user is in
+user_channels = {}
+# email -> u_id and handle_str -> u_id
+user_emails = {}
+user_handles = {}
+# generated handle prefix -> next numeric suffix to try
+handle_suffixes = {}
+
+# A lookup driven by an index covering more than 1 / SCAN_FRACTION of the
+# messages scans the columns whole instead
+SCAN_FRACTION = 4
+# Keys read from a channel's time log at once when walking it newest first
+WALK_CHUNK = 256
+
+id_lock = threading.Lock()
+# held while messages change and their events are published, so a batch of
+# them is appended together and a page of a channel is as of one seq
+message_lock = threading.RLock()
+
+
+def next_id():
+    """Allocate the next unused id for a user, channel or message."""
+    return next_ids(1).start
+
+
+def next_ids(count):
+    """Allocate a block of count consecutive unused ids, returned as a range."""
+    with id_lock:
+        first = data["id"]
+        data["id"] += count
+        persist.record_put("id", None, data["id"])
+    return range(first, first + count)
+
+
+def add_user(user):
+    """Store a new user under its u_id and index its email and handle."""
+    data["users"][user.u_id] = user
+    user_emails[user.email] = user.u_id
+    user_handles[user.handle_str] = user.u_id
+    persist.record_put("users", user.u_id, user)
+
+
+def save_user(user):
+    """Log a change made to a stored user."""
+    persist.record_put("users", user.u_id, user)
+
+
+def get_user(u_id):
+    """Return the user with the given u_id, or None if there is none."""
+    return data["users"].get(u_id)
+
+
+def get_user_by_email(email):
+    """Return the user registered with email, or None if there is none."""
+    return data["users"].get(user_emails.get(email))
+
+
+def get_user_by_handle(handle_str):
+    """Return the user with the given handle, or None if there is none."""
+    return data["users"].get(user_handles.get(handle_str))
+
+
+def set_user_email(user, email):
+    """Change a user's email, keeping the email index up to date."""
+    del user_emails[user.email]
+    user.email = email
+    user_emails[email] = user.u_id
+    save_user(user)
+
+
+def set_user_handle(user, handle_str):
+    """Change a user's handle, keeping the handle index up to date."""
+    del user_handles[user.handle_str]
+    user.handle_str = handle_str
+    user_handles[handle_str] = user.u_id
+    save_user(user)
+
+
+def user_list():
+    """Return all users in the order they registered."""
+    return list(data["users"].values())
+
+
+def add_channel(channel):
+    """Store a new channel under its channel_id and index its members."""
+    data["channels"][channel.channel_id] = channel
+    index_channel(channel)
+    save_channel(channel)
+
+
+def save_channel(channel):
+    """Log a change made to a stored channel."""
+    persist.record_put("channels", channel.channel_id, channel)
+
+
+def get_channel(channel_id):
+    """Return the channel with the given channel_id, or None if there is none."""
+    return data["channels"].get(channel_id)
+
+
+def channel_list():
+    """Return all channels in the order they were created."""
+    return list(data["channels"].values())
+
+
+def is_member(channel_id, u_id):
+    """Return True if the user is an owner or member of the channel."""
+    return u_id in channel_owners.get(channel_id, ()) or u_id in channel_members.get(
+        channel_id, ()
+    )
+
+
+def is_owner(channel_id, u_id):
+    """Return True if the user is an owner of the channel."""
+    return u_id in channel_owners.get(channel_id, ())
+
+
+def user_channel_ids(u_id):
+    """Return the ids of the channels a user is in, in creation order."""
+    return sorted(user_channels.get(u_id, ()))
+
+
+def add_member(channel_id, member):
+    """Add a member to a channel's all_members unless they are already there."""
+    if member["u_id"] in channel_members[channel_id]:
+        return
+    channel = data["channels"][channel_id]
+    channel.all_members.append(member)
+    channel_members[channel_id].add(member["u_id"])
+    index_membership(channel_id, member["u_id"])
+    save_channel(channel)
+
+
+def remove_member(channel_id, u_id):
+    """Remove a user from a channel's all_members."""
+    channel = data["channels"][channel_id]
+    channel.all_members = [
+        member for member in channel.all_members if member["u_id"] != u_id
+    ]
+    channel_members[channel_id].discard(u_id)
+    unindex_membership(channel_id, u_id)
+    save_channel(channel)
+
+
+def add_owner(channel_id, member):
+    """Add a member to a channel's owner_members."""
+    channel = data["channels"][channel_id]
+    channel.owner_members.append(member)
+    channel_owners[channel_id].add(member["u_id"])
+    index_membership(channel_id, member["u_id"])
+    save_channel(channel)
+
+
+def remove_owner(channel_id, u_id):
+    """Remove a user from a channel's owner_members."""
+    channel = data["channels"][channel_id]
+    channel.owner_members = [
+        owner for owner in channel.owner_members if owner["u_id"] != u_id
+    ]
+    channel_owners[channel_id].discard(u_id)
+    unindex_membership(channel_id, u_id)
+    save_channel(channel)
+
+
+def index_channel(channel):
+    """Add a channel's owners and members to the membership index."""
+    channel_id = channel.channel_id
+    channel_owners[channel_id] = {owner["u_id"] for owner in channel.owner_members}
+    channel_members[channel_id] = {member["u_id"] for member in channel.all_members}
+    for u_id in channel_owners[channel_id] | channel_members[channel_id]:
+        user_channels.setdefault(u_id, set()).add(channel_id)
+
+
+def index_membership(channel_id, u_id):
+    """Add channel_id to a user's channels, telling them if it is new."""
+    channels = user_channels.setdefault(u_id, set())
+    if channel_id not in channels:
+        channels.add(channel_id)
+        events.publish_user(u_id, {"event": "channel_joined", "channel_id": channel_id})
+
+
+def unindex_membership(channel_id, u_id):
+    """Drop channel_id from a user's channels once they hold no role in it."""
+    if not is_member(channel_id, u_id) and channel_id in user_channels.get(u_id, ()):
+        user_channels[u_id].discard(channel_id)
+        events.publish_user(u_id, {"event": "channel_left", "channel_id": channel_id})
+
+
+def add_messages(messages):
+    """
+    Store new messages, appending them to their channels' logs together.
+    Every message is checked first, so a malformed one stores none of them.
+    """
+    for message in messages:
+        check_message(message)
+    # the columns are built whole before any is written
+    columns = (
+        array("q", (message.message_id for message in messages)),
+        array("q", (message.channel_id for message in messages)),
+        array("q", (message.u_id for message in messages)),
+        array("q", (message.time_created for message in messages)),
+        bytes(message.is_pinned for message in messages),
+    )
+    with message_lock:
+        message_columns.extend(*columns)
+        for message in messages:
+            index_message(message)
+
+
+def add_message(message):
+    """Store a new message under its message_id and append it to its channel's log."""
+    check_message(message)
+    with message_lock:
+        message_columns.append(
+            message.message_id,
+            message.channel_id,
+            message.u_id,
+            message.time_created,
+            message.is_pinned,
+        )
+        index_message(message)
+
+
+def check_message(message):
+    """Raise TypeError unless a new message's fields have the types stored."""
+    for value in (
+        message.message_id,
+        message.channel_id,
+        message.u_id,
+        message.time_created,
+    ):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(f"Message {message.message_id} has a non-int id or time.")
+    if not isinstance(message.message, str):
+        raise TypeError(f"Message {message.message_id} has non-str text.")
+
+
+def index_message(message):
+    """
+    Store a new message whose row is in the columns, adding it to the other
+    logs and indexes. The caller holds message_lock.
+    """
+    data["messages"][message.message_id] = message
+    channel_log(message.channel_id).append(message.message_id)
+    if message.u_id in author_logs:
+        author_logs[message.u_id].append(message.message_id)
+    if message.is_pinned and message.channel_id in pinned_logs:
+        pinned_logs[message.channel_id].append(message.message_id)
+    if message.channel_id in channel_time_logs:
+        channel_time_logs[message.channel_id].add(
+            message.time_created, message.message_id
+        )
+    word_index.add(message.message_id, message.message)
+    trigram_index.add(message.message_id, message.message)
+    search_pool.record_message(message)
+    touch_channel(message.channel_id)
+    save_message(message)
+    events.publish(
+        message.channel_id,
+        {
+            "event": "message_sent",
+            "channel_id": message.channel_id,
+            "message": message.to_dict(),
+        },
+    )
+
+
+def save_message(message):
+    """Log a change made to a stored message."""
+    persist.record_put("messages", message.message_id, message)
+
+
+def set_message_text(message, text):
+    """Change a message's text, keeping the text index up to date."""
+    with message_lock:
+        word_index.remove(message.message_id, message.message)
+        trigram_index.remove(message.message_id, message.message)
+        message.message = text
+        word_index.add(message.message_id, text)
+        trigram_index.add(message.message_id, text)
+        search_pool.record_message(message)
+        touch_channel(message.channel_id)
+        save_message(message)
+        events.publish(
+            message.channel_id,
+            {
+                "event": "message_edited",
+                "channel_id": message.channel_id,
+                "message_id": message.message_id,
+                "message": text,
+            },
+        )
+
+
+def set_message_pinned(message, is_pinned):
+    """Pin or unpin a message, keeping the pinned column up to date."""
+    with message_lock:
+        message.is_pinned = is_pinned
+        message_columns.set_pinned(message.message_id, is_pinned)
+        if message.channel_id in pinned_logs:
+            log = pinned_logs[message.channel_id]
+            log.remove(message.message_id)
+            if is_pinned:
+                log.append(message.message_id)
+        search_pool.record_message(message)
+        touch_channel(message.channel_id)
+        save_message(message)
+        events.publish(
+            message.channel_id,
+            {
+                "event": "message_pinned" if is_pinned else "message_unpinned",
+                "channel_id": message.channel_id,
+                "message_id": message.message_id,
+            },
+        )
+
+
+def set_message_reacted(message, u_id, reacted):
+    """Add or take away a user's react to a message."""
+    with message_lock:
+        u_ids = message.reacts[0]["u_ids"]
+        if reacted:
+            u_ids.append(u_id)
+        else:
+            u_ids.remove(u_id)
+        save_message(message)
+        events.publish(
+            message.channel_id,
+            {
+                "event": "message_reacted" if reacted else "message_unreacted",
+                "channel_id": message.channel_id,
+                "message_id": message.message_id,
+                "react_id": message.reacts[0]["react_id"],
+                "u_id": u_id,
+            },
+        )
+
+
+def touch_channel(channel_id):
+    """Give a channel a new version after one of its messages changed."""
+    channel_versions[channel_id] = next(change_stamps)
+
+
+def channel_version(channel_id):
+    """Return a stamp that changes whenever a channel's messages change."""
+    return channel_versions.get(channel_id, 0)
+
+
+def get_message(message_id):
+    """Return the message with the given message_id, or None if there is none."""
+    return data["messages"].get(message_id)
+
+
+def remove_message(message_id):
+    """Delete the message with the given message_id."""
+    with message_lock:
+        message = data["messages"][message_id]
+        channel_log(message.channel_id).remove(message_id)
+        if message.u_id in author_logs:
+            author_logs[message.u_id].remove(message_id)
+        if message.channel_id in pinned_logs:
+            pinned_logs[message.channel_id].remove(message_id)
+        if message.channel_id in channel_time_logs:
+            channel_time_logs[message.channel_id].remove(
+                message.time_created, message_id
+            )
+        message_columns.remove(message_id)
+        word_index.remove(message_id, message.message)
+        trigram_index.remove(message_id, message.message)
+        search_pool.record_remove(message_id, message.channel_id)
+        touch_channel(message.channel_id)
+        del data["messages"][message_id]
+        persist.record_delete("messages", message_id)
+        events.publish(
+            message.channel_id,
+            {
+                "event": "message_removed",
+                "channel_id": message.channel_id,
+                "message_id": message_id,
+            },
+        )
+
+
+def message_list():
+    """Return all messages in the order they were sent."""
+    return list(data["messages"].values())
+
+
+def add_scheduled(scheduled):
+    """Store a message waiting to be sent under its reserved message_id."""
+    data["scheduled"][scheduled.message_id] = scheduled
+    persist.record_put("scheduled", scheduled.message_id, scheduled)
+
+
+def remove_scheduled(message_id):
+    """Forget a scheduled message once it is sent or cancelled."""
+    if data["scheduled"].pop(message_id, None) is not None:
+        persist.record_delete("scheduled", message_id)
+
+
+def scheduled_list():
+    """Return every message waiting to be sent."""
+    return list(data["scheduled"].values())
+
+
+def find_messages(channel_ids=None, u_id=None, since=None, until=None, pinned=None):
+    """
+    Return the ids of messages, oldest first, in any of channel_ids, sent by
+    u_id, sent between since and until inclusive and pinned if pinned is
+    True. None matches anything.
+    """
+    return message_columns.select(channel_ids, u_id, since, until, pinned)
+
+
+def search_candidates(query):
+    """
+    Return the sorted ids of messages whose text may contain query, or None
+    if every message has to be checked. Queries of three or more characters
+    use the trigram index and shorter ones the word index.
+    """
+    if len(fold(query)) >= 3:
+        index = trigram_index
+    else:
+        index = word_index
+    index.build(data["messages"].values())
+    return index.candidates(query, len(message_columns) // SCAN_FRACTION)
+
+
+def newest_message_keys(
+    channel_ids=None,
+    u_id=None,
+    since=None,
+    until=None,
+    pinned=None,
+    candidates=None,
+    before=None,
+):
+    """
+    Return an iterator of the (time_created, message_id) recency keys of the
+    messages that find_messages would return, newest first, keeping only
+    those among the sorted candidates if they are given and those before
+    the key before.
+
+    If the candidates, the author's log or, when pinned is True, the
+    channels' pinned logs are fewer than the channels' messages and a small
+    part of the workspace, the smallest has its keys looked up in the
+    columns and sorted. Otherwise the channels' time logs are merged
+    newest first as the iterator is read, so a caller that stops once it
+    has a page reads no further back than that page. Without channels the
+    columns are scanned whole.
+    """
+    sources = []
+    if candidates is not None:
+        sources.append((len(candidates), lambda: candidates))
+    if u_id is not None:
+        sources.append((len(author_log(u_id)), lambda: author_log(u_id)))
+    if pinned:
+        pinned_channels = data["channels"] if channel_ids is None else channel_ids
+        pinned_ids = [
+            message_id
+            for channel_id in pinned_channels
+            for message_id in pinned_log(channel_id)
+        ]
+        sources.append((len(pinned_ids), lambda: pinned_ids))
+    size, driver = min(sources, key=lambda source: source[0], default=(None, None))
+    if channel_ids is not None:
+        count = sum(channel_message_count(channel_id) for channel_id in channel_ids)
+        if driver is None or size > count:
+            driver = None
+        channel_ids = set(channel_ids)
+
+    if driver is not None and size * SCAN_FRACTION <= len(message_columns):
+        keys = message_columns.keys(driver(), channel_ids, u_id, pinned)
+    elif channel_ids is not None:
+        return walk_channels(
+            channel_ids, u_id, since, until, pinned, candidates, before
+        )
+    else:
+        keys = message_columns.select_keys(None, u_id, since, until, pinned)
+        if candidates is not None:
+            candidates = set(candidates)
+            keys = [key for key in keys if key[1] in candidates]
+    keys.sort()
+    if since is not None:
+        keys = keys[bisect_left(keys, (since,)) :]
+    if until is not None:
+        keys = keys[: bisect_left(keys, (until + 1,))]
+    if before is not None:
+        keys = keys[: bisect_left(keys, before)]
+    return reversed(keys)
+
+
+def walk_channels(channel_ids, u_id, since, until, pinned, candidates, before):
+    """Yield the keys newest_message_keys returns by merging channels' time logs."""
+    walks = [
+        walk_channel(channel_id, since, until, before) for channel_id in channel_ids
+    ]
+    for key in heapq.merge(*walks, reverse=True):
+        if candidates is not None:
+            i = bisect_left(candidates, key[1])
+            if i == len(candidates) or candidates[i] != key[1]:
+                continue
+        if (u_id is not None or pinned) and not message_columns.keys(
+            (key[1],), None, u_id, pinned
+        ):
+            continue
+        yield key
+
+
+def walk_channel(channel_id, since, until, before):
+    """
+    Yield the keys of a channel's messages sent between since and until
+    and before the key before, newest first, a chunk at a time. Each chunk
+    is read under message_lock and the next resumes before the last key
+    read, so messages changing between chunks neither repeat nor skip one.
+    """
+    while True:
+        with message_lock:
+            keys = channel_time_log(channel_id).newest(before, since, until, WALK_CHUNK)
+        yield from keys
+        if len(keys) < WALK_CHUNK:
+            return
+        before = keys[-1]
+
+
+def author_log(u_id):
+    """Return the ids of the messages a user sent, oldest first."""
+    log = author_logs.get(u_id)
+    if log is None:
+        log = author_logs[u_id] = MessageLog(message_columns.select(u_id=u_id))
+    return log
+
+
+def pinned_log(channel_id):
+    """Return the ids of a channel's pinned messages, in the order pinned."""
+    log = pinned_logs.get(channel_id)
+    if log is None:
+        with message_lock:
+            log = pinned_logs.get(channel_id)
+            if log is None:
+                log = pinned_logs[channel_id] = MessageLog(
+                    message_columns.select(channel_ids=[channel_id], pinned=True)
+                )
+    return log
+
+
+def channel_log(channel_id):
+    """Return the ids of a channel's messages, oldest first."""
+    log = channel_logs.get(channel_id)
+    if log is None:
+        messages = data["messages"]
+        if isinstance(messages, MappedMessages):
+            log = MessageLog(messages.channel_log(channel_id))
+        else:
+            log = MessageLog()
+        channel_logs[channel_id] = log
+    return log
+
+
+def channel_message_count(channel_id):
+    """Return the number of messages in a channel."""
+    return len(channel_log(channel_id))
+
+
+def channel_message_page(channel_id, start, count):
+    """
+    Return up to count messages from a channel, newest first, skipping the
+    start most recent ones.
+    """
+    log = channel_log(channel_id)
+    end = len(log) - start
+    messages = data["messages"]
+    return [
+        messages[message_id]
+        for message_id in reversed(log.page(max(end - count, 0), max(end, 0)))
+    ]
+
+
+def channel_time_log(channel_id):
+    """Return the TimeLog of a channel's messages."""
+    log = channel_time_logs.get(channel_id)
+    if log is None:
+        with message_lock:
+            log = channel_time_logs.get(channel_id)
+            if log is None:
+                log = channel_time_logs[channel_id] = TimeLog(
+                    message_columns.keys(channel_log(channel_id))
+                )
+    return log
+
+
+def channel_message_range(channel_id, since, until, start, count):
+    """
+    Return up to count of the messages of a channel sent between since and
+    until inclusive, oldest first, skipping the start oldest, and how many
+    such messages there are.
+    """
+    log = channel_time_log(channel_id)
+    lo, hi = log.span(since, until)
+    messages = data["messages"]
+    page = log.page(lo + start, min(lo + start + count, hi))
+    return [messages[message_id] for message_id in page], hi - lo
+
+
+def rebuild():
+    """Recompute the derived indexes from the entities in data.py."""
+    channel_logs.clear()
+    author_logs.clear()
+    pinned_logs.clear()
+    channel_time_logs.clear()
+    channel_versions.clear()
+    channel_owners.clear()
+    channel_members.clear()
+    user_channels.clear()
+    user_emails.clear()
+    user_handles.clear()
+    handle_suffixes.clear()
+    message_columns.clear()
+    word_index.clear()
+    trigram_index.clear()
+    for user in data["users"].values():
+        user_emails[user.email] = user.u_id
+        user_handles[user.handle_str] = user.u_id
+    for channel in data["channels"].values():
+        index_channel(channel)
+    messages = data["messages"]
+    if isinstance(messages, MappedMessages):
+        # the snapshot's columns are read in place and logs of its messages
+        # load lazily; only add what came after
+        if messages.snapshot is not None:
+            message_columns.load_base(*messages.snapshot_columns())
+            for message_id in messages.deleted:
+                message_columns.remove(message_id)
+            for message_id, message in messages.loaded.items():
+                if message_id not in messages.added:
+                    message_columns.set_pinned(message_id, message.is_pinned)
+        messages = messages.added_messages()
+    else:
+        messages = messages.values()
+    for message in messages:
+        channel_log(message.channel_id).append(message.message_id)
+        message_columns.append(
+            message.message_id,
+            message.channel_id,
+            message.u_id,
+            message.time_created,
+            message.is_pinned,
+        )
+
+
+def clear():
+    """Remove every stored entity and reset the id counter."""
+    data["id"] = 0
+    data["users"].clear()
+    data["channels"].clear()
+    data["messages"].clear()
+    data["scheduled"].clear()
+    rebuild()
+    search_pool.record_clear()
+    persist.record_clear()
@@ -0,0 +1,149 @@
+from itertools import islice
+import pytest
+from auth import auth_register
+from channel import channel_join, channel_leave, channel_addowner, channel_removeowner
+from channels import channels_create
+from message import message_send, message_remove, message_pin, message_unpin
+from other import clear
+from records import Message
+import store
+
+
+@pytest.fixture
+def supply_user():
+    clear()
+    return auth_register("validemail@gmail.com", "123abc!@#", "First", "Last")
+
+
+def test_store_get_user(supply_user):
+    user = store.get_user(supply_user["u_id"])
+    assert user["email"] == "validemail@gmail.com"
+    assert store.get_user(supply_user["u_id"] + 100) is None
+
+
+def test_store_get_channel(supply_user):
+    channel_id = channels_create(supply_user["token"], "A", True)["channel_id"]
+    assert store.get_channel(channel_id)["name"] == "A"
+    assert [channel["name"] for channel in store.channel_list()] == ["A"]
+
+
+def test_store_message_removed(supply_user):
+    channel_id = channels_create(supply_user["token"], "A", True)["channel_id"]
+    message_id = message_send(supply_user["token"], channel_id, "Test")["message_id"]
+    assert store.get_message(message_id)["message"] == "Test"
+    message_remove(supply_user["token"], message_id)
+    assert store.get_message(message_id) is None
+    assert store.message_list() == []
+
+
+def test_store_clear(supply_user):
+    clear()
+    assert store.user_list() == []
+    assert store.get_user(supply_user["u_id"]) is None
+
+
+def test_store_channel_message_page(supply_user):
+    channel_a = channels_create(supply_user["token"], "A", True)["channel_id"]
+    channel_b = channels_create(supply_user["token"], "B", True)["channel_id"]
+    for i in range(60):
+        message_send(supply_user["token"], channel_a, f"a{i}")
+        message_send(supply_user["token"], channel_b, f"b{i}")
+    assert store.channel_message_count(channel_a) == 60
+    page = store.channel_message_page(channel_a, 0, 50)
+    assert [message["message"] for message in page] == [
+        f"a{i}" for i in range(59, 9, -1)
+    ]
+    page = store.channel_message_page(channel_a, 50, 50)
+    assert [message["message"] for message in page] == [
+        f"a{i}" for i in range(9, -1, -1)
+    ]
+    assert store.channel_message_page(channel_a, 60, 50) == []
+
+
+def test_store_membership_index(supply_user):
+    other = auth_register("otheremail@gmail.com", "123abc!@#", "Other", "User")
+    channel_id = channels_create(supply_user["token"], "A", True)["channel_id"]
+    assert store.is_owner(channel_id, supply_user["u_id"])
+    assert not store.is_member(channel_id, other["u_id"])
+
+    channel_join(other["token"], channel_id)
+    assert store.is_member(channel_id, other["u_id"])
+    assert store.user_channel_ids(other["u_id"]) == [channel_id]
+
+    channel_addowner(supply_user["token"], channel_id, other["u_id"])
+    channel_removeowner(supply_user["token"], channel_id, other["u_id"])
+    assert not store.is_owner(channel_id, other["u_id"])
+    assert store.is_member(channel_id, other["u_id"])
+
+    channel_leave(other["token"], channel_id)
+    assert not store.is_member(channel_id, other["u_id"])
+    assert store.user_channel_ids(other["u_id"]) == []
+
+
+def test_store_newest_message_keys(supply_user, monkeypatch):
+    monkeypatch.setattr(store, "WALK_CHUNK", 2)
+    token = supply_user["token"]
+    channel_a = channels_create(token, "A", True)["channel_id"]
+    channel_b = channels_create(token, "B", True)["channel_id"]
+    message_ids = [
+        message_send(token, (channel_a, channel_b)[i % 3 == 0], str(i))["message_id"]
+        for i in range(10)
+    ]
+    keys = [
+        (store.get_message(message_id)["time_created"], message_id)
+        for message_id in message_ids
+    ]
+    newest = sorted(keys, reverse=True)
+    assert list(store.newest_message_keys(channel_ids=[channel_a, channel_b])) == newest
+    assert list(
+        store.newest_message_keys(channel_ids=[channel_b], candidates=message_ids[:4])
+    ) == [keys[3], keys[0]]
+    assert list(
+        store.newest_message_keys(channel_ids=[channel_a], before=newest[2])
+    ) == [key for key in newest[3:] if key[1] not in message_ids[::3]]
+
+    # a page is read without walking the rest of the channels
+    chunks = []
+    walk_channel = store.walk_channel
+
+    def counting_walk(*args):
+        for key in walk_channel(*args):
+            chunks.append(key)
+            yield key
+
+    monkeypatch.setattr(store, "walk_channel", counting_walk)
+    walk = store.newest_message_keys(channel_ids=[channel_a, channel_b])
+    assert list(islice(walk, 3)) == newest[:3]
+    assert len(chunks) < len(keys)
+
+
+def test_store_add_messages_all_or_nothing(supply_user):
+    channel_id = channels_create(supply_user["token"], "A", True)["channel_id"]
+    u_id = supply_user["u_id"]
+    good = Message(channel_id, store.next_id(), u_id, "fine", 0)
+    bad = Message(channel_id, store.next_id(), u_id, {"a": 1}, 0)
+    with pytest.raises(TypeError):
+        store.add_messages([good, bad])
+    assert len(store.message_columns) == 0
+    assert store.get_message(good.message_id) is None
+    assert store.channel_message_count(channel_id) == 0
+    assert list(store.newest_message_keys(u_id=u_id)) == []
+
+
+def test_store_pinned_log(supply_user):
+    token = supply_user["token"]
+    channel_id = channels_create(token, "A", True)["channel_id"]
+    message_ids = [
+        message_send(token, channel_id, str(i))["message_id"] for i in range(6)
+    ]
+    message_pin(token, message_ids[1])
+    assert list(store.pinned_log(channel_id)) == [message_ids[1]]
+    for message_id in message_ids[3:]:
+        message_pin(token, message_id)
+    message_unpin(token, message_ids[4])
+    message_remove(token, message_ids[5])
+    assert list(store.pinned_log(channel_id)) == [message_ids[1], message_ids[3]]
+    keys = store.newest_message_keys(channel_ids=[channel_id], pinned=True)
+    assert [key[1] for key in keys] == [message_ids[3], message_ids[1]]
+    keys = store.newest_message_keys(pinned=True)
+    assert [key[1] for key in keys] == [message_ids[3], message_ids[1]]
@@ -0,0 +1,342 @@
+"""
+Indexes over the text of messages, used by other.search to find the
+messages that can contain a query without reading every message.
+
+Text is indexed case-insensitively, matching the lowercased substring test
+search applies. An index only narrows the candidates: search still checks
+every candidate against the query, so results are exactly those of a full
+scan. An index is built from data.py the first time it is queried and is
+then kept up to date by store.py as messages are sent, edited and removed.
+
+A TrigramIndex answers any query of three or more characters. Shorter
+queries are answered from a WordIndex of the words messages contain. An
+index that would narrow the search to more than a given number of
+messages answers None instead, as checking the messages newest first
+until a page is found is then cheaper than gathering every candidate.
+"""
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from itertools import accumulate, chain, filterfalse
+
+WORD = re.compile(r"\w+")
+# Ids in each delta encoded block of a posting
+BLOCK_SIZE = 128
+# Changes held outside a posting's blocks before it is encoded again
+MERGE_THRESHOLD = 64
+
+
+def fold(text):
+    """
+    Fold text for the trigram index. Folding lowercased text char by char
+    means any query.lower() found in text.lower() folds to a substring of
+    the folded text.
+    """
+    return text.lower().casefold()
+
+
+def trigrams(text):
+    """Return the set of three character substrings of folded text."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TextIndex:
+    """Shared upkeep of an index that is built on first use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.built = False
+
+    def clear(self):
+        """Drop the index; it is rebuilt on the next query."""
+        with self.lock:
+            self.postings = {}
+            self.built = False
+
+    def build(self, messages):
+        """Index every message unless the index is already built."""
+        with self.lock:
+            if self.built:
+                return
+            for message in sorted(messages, key=lambda message: message.message_id):
+                self.index(message.message_id, message.message)
+            self.built = True
+
+    def add(self, message_id, text):
+        """Index a newly sent or edited message."""
+        with self.lock:
+            if self.built:
+                self.index(message_id, text)
+
+    def remove(self, message_id, text):
+        """Drop a message's old text from the index."""
+        with self.lock:
+            if self.built:
+                self.unindex(message_id, text)
+
+
+class WordIndex(TextIndex):
+    """An inverted index from each lowercased word to the messages using it."""
+
+    def index(self, message_id, text):
+        """Add a message's words. The caller holds lock."""
+        for word in set(WORD.findall(text.lower())):
+            self.postings.setdefault(word, set()).add(message_id)
+
+    def unindex(self, message_id, text):
+        """Remove a message's words. The caller holds lock."""
+        for word in set(WORD.findall(text.lower())):
+            posting = self.postings.get(word)
+            if posting is not None:
+                posting.discard(message_id)
+                if not posting:
+                    del self.postings[word]
+
+    def matching_words(self, token, prefix_open, suffix_open):
+        """
+        Return the indexed words a query token can fall in. A token cut by
+        the start (or end) of the query can be the end (or start) of a word;
+        a token between separators must be a whole word.
+        """
+        if not prefix_open and not suffix_open:
+            return [token] if token in self.postings else []
+        if prefix_open and suffix_open:
+            return [word for word in self.postings if token in word]
+        if prefix_open:
+            return [word for word in self.postings if word.endswith(token)]
+        return [word for word in self.postings if word.startswith(token)]
+
+    def candidates(self, query, most=None):
+        """
+        Return the sorted ids of messages that may contain query, or None
+        if the query has no words to narrow the search by or they match
+        more than most messages.
+
+        The messages of each token's words are gathered one word at a time,
+        keeping only those matching the earlier tokens. Later tokens can
+        only narrow the matches, so gathering the last token's stops as
+        soon as more than most are found.
+        """
+        query = query.lower()
+        tokens = list(WORD.finditer(query))
+        if not tokens:
+            return None
+        with self.lock:
+            matches = None
+            for i, token in enumerate(tokens):
+                last = i == len(tokens) - 1
+                words = self.matching_words(
+                    token.group(),
+                    prefix_open=i == 0 and token.start() == 0,
+                    suffix_open=last and token.end() == len(query),
+                )
+                found = set()
+                for word in words:
+                    posting = self.postings[word]
+                    found |= posting if matches is None else posting & matches
+                    if last and most is not None and len(found) > most:
+                        return None
+                matches = found
+                if not matches:
+                    break
+        return sorted(matches)
+
+
+def pack_gaps(message_ids):
+    """
+    Return the gaps between consecutive sorted message_ids, in the narrowest
+    array type that holds the widest of them.
+    """
+    gaps = [b - a for a, b in zip(message_ids, message_ids[1:])]
+    widest = max(gaps, default=0)
+    for typecode in "BHI":
+        if widest < 1 << 8 * array(typecode).itemsize:
+            return array(typecode, gaps)
+    return array("q", gaps)
+
+
+class Posting:
+    """
+    The ids of the messages containing one trigram, in increasing order,
+    delta encoded in blocks of BLOCK_SIZE ids. A block holds the gaps between
+    its ids in the narrowest array type that fits them, usually one or two
+    bytes an id, and the first id of each block is kept as its skip key, so
+    finding an id bisects the skip keys and decodes a single block. The
+    last decoded block is cached, as the ids TrigramIndex probes for come
+    in increasing order. Ids after the last full block are kept plainly
+    until they fill one. An id below the last (an edited older message) is
+    held in added, and a removed id in removed, until enough have gathered
+    to encode the posting again.
+    """
+
+    __slots__ = (
+        "firsts",
+        "blocks",
+        "tail",
+        "last",
+        "added",
+        "removed",
+        "cached_from",
+        "cached_to",
+        "cached_ids",
+    )
+
+    def __init__(self, message_ids=()):
+        self.firsts = array("q")
+        self.blocks = []
+        self.tail = array("q")
+        self.last = None
+        self.added = None
+        self.removed = None
+        self.cached_from = self.cached_to = 0
+        self.cached_ids = None
+        for message_id in message_ids:
+            self.append(message_id)
+
+    def __len__(self):
+        return (
+            len(self.blocks) * BLOCK_SIZE
+            + len(self.tail)
+            + (len(self.added) if self.added else 0)
+            - (len(self.removed) if self.removed else 0)
+        )
+
+    def __contains__(self, message_id):
+        if self.added and message_id in self.added:
+            return True
+        if self.removed and message_id in self.removed:
+            return False
+        if self.cached_from <= message_id < self.cached_to:
+            message_ids = self.cached_ids
+        elif self.tail and message_id >= self.tail[0]:
+            message_ids = self.tail
+        else:
+            block = bisect_right(self.firsts, message_id) - 1
+            if block < 0:
+                return False
+            message_ids = self.cache_block(block)
+        i = bisect_left(message_ids, message_id)
+        return i < len(message_ids) and message_ids[i] == message_id
+
+    def __iter__(self):
+        """Yield the ids in increasing order."""
+        message_ids = chain(
+            chain.from_iterable(
+                accumulate(gaps, initial=first)
+                for first, gaps in zip(self.firsts, self.blocks)
+            ),
+            self.tail,
+        )
+        if self.removed:
+            message_ids = filterfalse(self.removed.__contains__, message_ids)
+        if self.added:
+            message_ids = merge(message_ids, sorted(self.added))
+        return message_ids
+
+    def cache_block(self, block):
+        """
+        Decode a block into the cache, with the range of ids it covers, and
+        return its ids.
+        """
+        firsts = self.firsts
+        self.cached_ids = list(accumulate(self.blocks[block], initial=firsts[block]))
+        self.cached_from = firsts[block]
+        if block + 1 < len(firsts):
+            self.cached_to = firsts[block + 1]
+        else:
+            self.cached_to = self.tail[0] if self.tail else self.last + 1
+        return self.cached_ids
+
+    def append(self, message_id):
+        """Add an id above every id in the posting."""
+        self.tail.append(message_id)
+        self.last = message_id
+        if len(self.tail) == BLOCK_SIZE:
+            self.firsts.append(self.tail[0])
+            self.blocks.append(pack_gaps(self.tail))
+            self.tail = array("q")
+
+    def add(self, message_id):
+        """Add an id to the posting."""
+        if self.removed and message_id in self.removed:
+            self.removed.discard(message_id)
+        elif self.last is None or message_id > self.last:
+            self.append(message_id)
+        else:
+            if self.added is None:
+                self.added = set()
+            self.added.add(message_id)
+            self.merge_if_full()
+
+    def remove(self, message_id):
+        """Remove an id from the posting."""
+        if self.added and message_id in self.added:
+            self.added.discard(message_id)
+        else:
+            if self.removed is None:
+                self.removed = set()
+            self.removed.add(message_id)
+            self.merge_if_full()
+
+    def merge_if_full(self):
+        """Encode the posting again once enough changes are held outside it."""
+        held = (len(self.added) if self.added else 0) + (
+            len(self.removed) if self.removed else 0
+        )
+        if held >= MERGE_THRESHOLD:
+            self.__init__(list(self))
+
+
+class TrigramIndex(TextIndex):
+    """An index from each trigram of folded text to the messages containing it."""
+
+    def index(self, message_id, text):
+        """Add a message's trigrams. The caller holds lock."""
+        for trigram in trigrams(fold(text)):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = Posting()
+            posting.add(message_id)
+
+    def unindex(self, message_id, text):
+        """Remove a message's trigrams. The caller holds lock."""
+        for trigram in trigrams(fold(text)):
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.remove(message_id)
+                if not len(posting):
+                    del self.postings[trigram]
+
+    def candidates(self, query, most=None):
+        """
+        Return the sorted ids of messages containing every trigram of query,
+        or None if the query is too short to have any or even its rarest
+        trigram is in more than most messages.
+
+        The ids of the rarest trigram's posting are probed for in each other
+        posting in turn through its skip keys, keeping those found, so the
+        cost follows the rarest posting's length, not the common ones'.
+        """
+        wanted = trigrams(fold(query))
+        if not wanted:
+            return None
+        with self.lock:
+            postings = []
+            for trigram in wanted:
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+            rarest, others = postings[0], postings[1:]
+            if most is not None and len(rarest) > most:
+                return None
+            matches = list(rarest)
+            for posting in others:
+                matches = [
+                    message_id for message_id in matches if message_id in posting
+                ]
+            return matches
@@ -0,0 +1,128 @@
+from records import Message
+import text_index
+from text_index import Posting, TrigramIndex, WordIndex
+
+
+def supply_index():
+    index = WordIndex()
+    index.build(
+        [
+            Message(1, 0, 0, "Hello world", 0),
+            Message(1, 1, 0, "Worldwide hello!", 0),
+            Message(1, 2, 0, "say hello-world twice", 0),
+        ]
+    )
+    return index
+
+
+def test_word_index_candidates():
+    index = supply_index()
+    assert index.candidates("HELLO") == [0, 1, 2]
+    assert index.candidates("orld") == [0, 1, 2]
+    assert index.candidates("llo wor") == [0, 1, 2]
+    assert index.candidates(" world ") == [0, 2]
+    assert index.candidates("hello-world") == [0, 1, 2]
+    assert index.candidates("zebra") == []
+    assert index.candidates("!") is None
+
+
+def test_word_index_stops_past_most():
+    index = WordIndex()
+    index.build([Message(1, i, 0, f"{i}m x{i % 2}", 0) for i in range(8)])
+    assert index.candidates("m", most=8) == list(range(8))
+    assert index.candidates("m", most=7) is None
+    assert index.candidates("m x1", most=4) == [1, 3, 5, 7]
+    assert index.candidates("m x1", most=3) is None
+    assert index.candidates("m x", most=7) is None
+
+
+def test_word_index_updates():
+    index = supply_index()
+    index.remove(0, "Hello world")
+    index.add(0, "Goodbye")
+    index.add(3, "Hello again")
+    assert index.candidates("hello") == [1, 2, 3]
+    assert index.candidates("goodbye") == [0]
+    assert "world" in index.postings
+    index.remove(1, "Worldwide hello!")
+    assert "worldwide" not in index.postings
+
+
+def test_word_index_unbuilt():
+    index = WordIndex()
+    index.add(0, "Hello")
+    assert index.postings == {}
+    index.build([Message(1, 0, 0, "Hello", 0)])
+    index.build([])
+    assert index.candidates("hello") == [0]
+
+
+def test_trigram_index_candidates():
+    index = TrigramIndex()
+    index.build(
+        [
+            Message(1, 0, 0, "Disappointing", 0),
+            Message(1, 1, 0, "Point taken.", 0),
+            Message(1, 2, 0, "Straße", 0),
+        ]
+    )
+    assert index.candidates("ppoint") == [0]
+    assert index.candidates("POINT") == [0, 1]
+    assert index.candidates("t taken.") == [1]
+    assert index.candidates("strasse") == [2]
+    assert index.candidates("zzz") == []
+    assert index.candidates("po") is None
+
+
+def test_trigram_index_updates():
+    index = TrigramIndex()
+    index.build([Message(1, 0, 0, "alpha", 0), Message(1, 5, 0, "beta", 0)])
+    index.remove(0, "alpha")
+    index.add(0, "alphabet")
+    index.add(9, "alphanumeric")
+    assert index.candidates("alpha") == [0, 9]
+    assert index.candidates("bet") == [0, 5]
+    index.remove(5, "beta")
+    assert index.candidates("bet") == [0]
+    index.remove(9, "alphanumeric")
+    assert "num" not in index.postings
+
+
+def test_posting_merges_changes(monkeypatch):
+    monkeypatch.setattr(text_index, "MERGE_THRESHOLD", 3)
+    posting = Posting()
+    for message_id in (0, 1, 200, 70000):
+        posting.add(message_id)
+    assert list(posting) == [0, 1, 200, 70000]
+    posting.add(50)
+    posting.remove(1)
+    assert list(posting) == [0, 50, 200, 70000]
+    assert 50 in posting and 1 not in posting and 200 in posting
+    posting.remove(70000)
+    assert posting.added is None and posting.removed is None
+    assert list(posting) == [0, 50, 200]
+    assert len(posting) == 3
+
+
+def test_posting_blocks(monkeypatch):
+    monkeypatch.setattr(text_index, "BLOCK_SIZE", 4)
+    message_ids = [3, 4, 300, 70000, 70001, 2**40, 2**40 + 9, 2**41, 2**41 + 1]
+    posting = Posting(message_ids)
+    assert list(posting.firsts) == [3, 70001]
+    assert [gaps.typecode for gaps in posting.blocks] == ["I", "q"]
+    assert list(posting.tail) == [2**41 + 1]
+    assert list(posting) == message_ids
+    assert len(posting) == len(message_ids)
+    assert all(message_id in posting for message_id in message_ids)
+    assert not any(message_id in posting for message_id in (0, 5, 70002, 2**42))
+
+
+def test_trigram_index_scans_common_queries():
+    index = TrigramIndex()
+    index.build(
+        [Message(1, i, 0, "common" if i % 2 else "common rare", 0) for i in range(8)]
+    )
+    assert index.candidates("common rare", most=4) == [0, 2, 4, 6]
+    assert index.candidates("common rare", most=3) is None
+    assert index.candidates("common", most=4) is None
+    assert index.candidates("common") == list(range(8))
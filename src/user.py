@@ -3,8 +3,8 @@ Functions related to the user's profile: allows user to display user_profile,
     edit their own profile (set name, email and handle)
 """
 from auth import auth_token, validate_email
-from data import data
 from error import AccessError, InputError
+import store
 
 
 def user_profile(token, u_id):
@@ -13,7 +13,8 @@ def user_profile(token, u_id):
     validate_user_id(u_id)
     user = find_user(u_id)
     profile = {
-        item: user[item] for item in user if item not in ("password", "permission_id")
+        item: getattr(user, item)
+        for item in ("u_id", "email", "name_first", "name_last", "handle_str")
     }
     return profile
 
@@ -26,8 +27,9 @@ def user_profile_setname(token, name_first, name_last):
     if len(name_last) < 1 or len(name_last) > 50:
         raise InputError("Last name must be between 1 and 50 characters long.")
     user = find_user(u_id)
-    user["name_first"] = name_first
-    user["name_last"] = name_last
+    user.name_first = name_first
+    user.name_last = name_last
+    store.save_user(user)
     return {}
 
 
@@ -36,10 +38,9 @@ def user_profile_setemail(token, email):
     u_id = auth_token(token)
     user = find_user(u_id)
     validate_email(email)
-    for user in data["users"]:
-        if user["email"] == email:
-            raise InputError("Email is in use.")
-    user["email"] = email
+    if store.get_user_by_email(email) is not None:
+        raise InputError("Email is in use.")
+    store.set_user_email(user, email)
     return {}
 
 
@@ -48,20 +49,19 @@ def user_profile_sethandle(token, handle_str):
     u_id = auth_token(token)
     if len(handle_str) < 3 or len(handle_str) > 20:
         raise InputError("Handle must be between 3 and 20 characters.")
-    for user in data["users"]:
-        if user["handle_str"] == handle_str:
-            raise InputError("Handle is in use.")
+    if store.get_user_by_handle(handle_str) is not None:
+        raise InputError("Handle is in use.")
     user = find_user(u_id)
-    user["handle_str"] = handle_str
+    store.set_user_handle(user, handle_str)
     return {}
 
 
 def validate_user_id(u_id):
     """Checks if a given u_id corresponds to an existing user"""
-    if u_id not in [user["u_id"] for user in data["users"]]:
+    if store.get_user(u_id) is None:
         raise InputError("User with u_id is not a valid user")
 
 
 def find_user(u_id):
     """Finds a user given u_id."""
-    return next(user for user in data["users"] if user["u_id"] == u_id)
+    return store.get_user(u_id)
@@ -135,3 +135,13 @@ def test_user_profile_sethandle_access_error(supply_user):
     """sethandle AccessError when fed invalid token."""
     with pytest.raises(AccessError):
         user_profile_sethandle("3", "validHandle")
+
+
+def test_user_profile_setemail_frees_old_email(supply_user, supply_user2):
+    """The old email can be taken once a user changes theirs."""
+    old_email = user_profile(supply_user["token"], supply_user["u_id"])["email"]
+    user_profile_setemail(supply_user["token"], "newemail@gmail.com")
+    user_profile_setemail(supply_user2["token"], old_email)
+    assert (
+        user_profile(supply_user2["token"], supply_user2["u_id"])["email"] == old_email
+    )